@@ -0,0 +1,307 @@
+"""
+预计算的聚合立方体
+对低基数维度列(如 Year、Category、Product)的全部组合做一次分组, 保存各数值列的
+和/非空计数/最小值/最大值及行数; 任意维度子集的分组汇总由该立方体上卷得到, 无需重新扫描数据。
+立方体在第一次使用时计算并写入数据缓存目录, 再次加载同一数据集时直接读取
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+from dataset_profile import DatasetProfile
+
+
+# 文本/类别列作为维度的最大不同值个数
+MAX_DIMENSION_CARDINALITY = 1000
+
+# 整数列同时作为维度的最大不同值个数(如年份); 更多取值的整数列只作为度量
+MAX_INT_DIMENSION_CARDINALITY = 50
+
+# 立方体的最大单元数(各维度不同值个数之积的上限)
+MAX_CUBE_CELLS = 200_000
+
+# 行数少于该值的数据集直接扫描已足够快, 不提供立方体
+MIN_CUBE_ROWS = 50_000
+
+# 缓存的上卷表和查询结果数
+MAX_CACHED = 256
+
+# 支持的聚合函数, 语义与 df.groupby(by)[values].agg(func) 相同
+FUNCS = ("sum", "mean", "count", "min", "max", "size")
+
+_ROWS = "__rows__"
+
+
+def _dtype(name: str) -> Any:
+    """概要中以字符串记录的列类型"""
+    try:
+        return pd.api.types.pandas_dtype(name)
+    except TypeError:
+        return pd.api.types.pandas_dtype("object")
+
+
+def _is_text(dtype: Any) -> bool:
+    return (
+        dtype == 'object'
+        or pd.api.types.is_string_dtype(dtype)
+        or isinstance(dtype, pd.CategoricalDtype)
+        or pd.api.types.is_bool_dtype(dtype)
+    )
+
+
+def choose_columns(profile: DatasetProfile, max_cells: int = MAX_CUBE_CELLS) -> Tuple[List[str], List[str]]:
+    """
+    按数据集概要选择维度列和度量列
+
+    Returns:
+        (维度列, 度量列) - 维度按基数从小到大加入, 直到各维度基数之积超过 max_cells
+    """
+    dtypes = {col: _dtype(profile.dtypes[col]) for col in profile.columns}
+    candidates = []
+    for col in profile.columns:
+        dtype = dtypes[col]
+        cardinality = profile.cardinality.get(col)
+        if cardinality is None or cardinality < 1:
+            continue
+        if _is_text(dtype) and cardinality <= MAX_DIMENSION_CARDINALITY:
+            candidates.append((cardinality, col))
+        elif pd.api.types.is_integer_dtype(dtype) and cardinality <= MAX_INT_DIMENSION_CARDINALITY:
+            candidates.append((cardinality, col))
+
+    dimensions = []
+    cells = 1
+    for cardinality, col in sorted(candidates):
+        # 缺失值单独成组
+        size = cardinality + (1 if profile.null_counts.get(col) else 0)
+        if cells * size > max_cells:
+            continue
+        cells *= size
+        dimensions.append(col)
+    dimensions = [col for col in profile.columns if col in dimensions]
+
+    measures = [
+        col for col in profile.columns
+        if pd.api.types.is_numeric_dtype(dtypes[col]) and not pd.api.types.is_bool_dtype(dtypes[col])
+    ]
+    return dimensions, measures
+
+
+class AggregateCubes:
+    """
+    数据集的聚合立方体, 以 cubes.agg(...) 提供给生成的代码
+
+    基础立方体(全部维度的分组统计)按需计算一次; 各维度子集的上卷结果按LRU缓存,
+    重复的问题只需在很小的表上筛选, 与原数据的行数无关
+    """
+
+    def __init__(
+        self,
+        profile: DatasetProfile,
+        load_frame: Callable[[], pd.DataFrame],
+        path: Optional[str] = None,
+        max_cells: int = MAX_CUBE_CELLS,
+        min_rows: int = MIN_CUBE_ROWS,
+    ):
+        """
+        Args:
+            profile: 数据集概要(用于选择维度列和度量列)
+            load_frame: 返回完整数据集的函数, 只在基础立方体未计算且磁盘上没有时调用
+            path: 基础立方体的Parquet文件路径, None表示不持久化
+            max_cells: 立方体的最大单元数
+            min_rows: 数据集的最少行数, 更小的数据集不提供立方体
+        """
+        self.dimensions, self.measures = choose_columns(profile, max_cells)
+        self.rows = profile.rows
+        self.min_rows = min_rows
+        self.path = path
+        self._load_frame = load_frame
+        self._base: Optional[pd.DataFrame] = None
+        self._cache: "OrderedDict[Tuple, Any]" = OrderedDict()  # 上卷表和查询结果
+        self._lock = threading.RLock()
+
+    @property
+    def available(self) -> bool:
+        return bool(self.dimensions) and bool(self.measures) and self.rows >= self.min_rows
+
+    @property
+    def materialized(self) -> bool:
+        return self._base is not None
+
+    def _stat_columns(self) -> List[str]:
+        columns = [_ROWS]
+        for measure in self.measures:
+            columns += [f"{measure}__sum", f"{measure}__count", f"{measure}__min", f"{measure}__max"]
+        return columns
+
+    def base(self) -> pd.DataFrame:
+        """基础立方体: 全部维度的分组统计(缺失值单独成组, 上卷时不丢失这些行)"""
+        if self._base is not None:
+            return self._base
+        with self._lock:
+            if self._base is None:
+                self._base = self._read() if self.path else None
+                if self._base is None:
+                    self._base = self._compute(self._load_frame())
+                    self._write()
+            return self._base
+
+    def _compute(self, df: pd.DataFrame) -> pd.DataFrame:
+        named = {_ROWS: (self.dimensions[0], "size")}
+        for measure in self.measures:
+            named[f"{measure}__sum"] = (measure, "sum")
+            named[f"{measure}__count"] = (measure, "count")
+            named[f"{measure}__min"] = (measure, "min")
+            named[f"{measure}__max"] = (measure, "max")
+        return df.groupby(self.dimensions, dropna=False, observed=True, sort=False).agg(**named).reset_index()
+
+    def _read(self) -> Optional[pd.DataFrame]:
+        try:
+            base = pd.read_parquet(self.path)
+        except Exception:
+            return None
+        if list(base.columns) != self.dimensions + self._stat_columns():
+            return None
+        return base
+
+    def _write(self):
+        try:
+            self._base.to_parquet(self.path, index=False)
+        except Exception as e:
+            print(f"⚠ 写入聚合立方体失败: {e}")
+
+    def _cached(self, key: Optional[Tuple], compute: Callable[[], Any]) -> Any:
+        """按LRU缓存计算结果; key 为None(条件不可哈希)时不缓存"""
+        if key is None:
+            return compute()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        value = compute()
+        with self._lock:
+            self._cache[key] = value
+            while len(self._cache) > MAX_CACHED:
+                self._cache.popitem(last=False)
+        return value
+
+    def _rollup(self, columns: Tuple[str, ...]) -> pd.DataFrame:
+        """在基础立方体上按维度子集上卷"""
+        return self._cached(("rollup", columns), lambda: self._regroup(self.base(), list(columns)))
+
+    def _regroup(self, table: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+        if columns == self.dimensions:
+            return table
+        named = {_ROWS: (_ROWS, "sum")}
+        for measure in self.measures:
+            named[f"{measure}__sum"] = (f"{measure}__sum", "sum")
+            named[f"{measure}__count"] = (f"{measure}__count", "sum")
+            named[f"{measure}__min"] = (f"{measure}__min", "min")
+            named[f"{measure}__max"] = (f"{measure}__max", "max")
+        return table.groupby(columns, dropna=False, observed=True, sort=False).agg(**named).reset_index()
+
+    def agg(
+        self,
+        by: Union[str, Sequence[str]],
+        values: Union[str, Sequence[str], None] = None,
+        func: str = "sum",
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Union[pd.Series, pd.DataFrame]:
+        """
+        分组汇总, 结果与 df[筛选].groupby(by)[values].agg(func) 相同
+
+        Args:
+            by: 分组的维度列
+            values: 汇总的数值列(单列返回Series, 列表返回DataFrame); func="size" 时忽略, 返回各组行数
+            func: sum / mean / count / min / max / size
+            where: 维度列的筛选条件 {列名: 值 或 值列表}
+
+        Raises:
+            KeyError: 列不是立方体的维度或度量(此时应直接使用 df)
+            ValueError: 不支持的聚合函数
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        value_list = [] if values is None else ([values] if isinstance(values, str) else list(values))
+        where = dict(where or {})
+        if func not in FUNCS:
+            raise ValueError(f"聚合立方体不支持 {func}, 可用: {', '.join(FUNCS)}; 其他计算请直接使用 df")
+        if not by:
+            raise ValueError("cubes.agg 需要至少一个分组列")
+        for col in by + list(where):
+            if col not in self.dimensions:
+                raise KeyError(f"{col} 不是聚合立方体的维度(可用: {', '.join(self.dimensions)}), 请直接使用 df")
+        for col in value_list:
+            if col not in self.measures:
+                raise KeyError(f"{col} 不是聚合立方体的数值列(可用: {', '.join(self.measures)}), 请直接使用 df")
+        if func != "size" and not value_list:
+            raise ValueError(f"func={func} 时需要指定 values")
+
+        try:
+            conditions = tuple(
+                (col, tuple(value) if isinstance(value, (list, tuple, set, frozenset)) else value)
+                for col, value in where.items()
+            )
+            key = ("agg", tuple(by), values if isinstance(values, str) else tuple(value_list), func, conditions)
+            hash(key)
+        except TypeError:
+            key = None
+        # 重复的查询直接返回缓存结果的副本(调用方可以修改)
+        return self._cached(key, lambda: self._answer(by, value_list, func, where, isinstance(values, str))).copy()
+
+    def _answer(
+        self, by: List[str], value_list: List[str], func: str, where: Dict[str, Any], single: bool
+    ) -> Union[pd.Series, pd.DataFrame]:
+        columns = tuple(col for col in self.dimensions if col in by or col in where)
+        table = self._rollup(columns)
+        if where:
+            mask = pd.Series(True, index=table.index)
+            for col, condition in where.items():
+                if isinstance(condition, (list, tuple, set, frozenset)):
+                    mask &= table[col].isin(list(condition))
+                else:
+                    mask &= table[col] == condition
+            table = table[mask]
+            if not set(where) <= set(by):
+                table = self._regroup(table, [col for col in self.dimensions if col in by])
+
+        # 与groupby的默认行为一致: 分组键为缺失值的行不出现在结果中
+        table = table.dropna(subset=by).set_index(by).sort_index()
+        if func == "size":
+            return table[_ROWS].rename(None)
+
+        frame = pd.DataFrame(index=table.index)
+        for col in value_list:
+            if func == "mean":
+                frame[col] = table[f"{col}__sum"] / table[f"{col}__count"].where(table[f"{col}__count"] > 0)
+            else:
+                frame[col] = table[f"{col}__{func}"]
+        if single:
+            return frame[value_list[0]]
+        return frame
+
+    def prompt_text(self) -> str:
+        """提示词中的使用说明"""
+        return (
+            f"已预计算聚合立方体 cubes: 维度 {', '.join(self.dimensions)}; 数值列 {', '.join(self.measures)}。"
+            "按这些维度分组汇总时优先使用 cubes.agg(by=[...], values='列名', func='sum', where={'维度': 值或列表}) "
+            f"(func 可为 {'/'.join(FUNCS)}), 结果与 df[筛选].groupby(by)[values].agg(func) 相同但无需扫描数据; "
+            "其他计算直接使用 df"
+        )
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """序列化(如发送到执行进程)时只携带基础立方体"""
+        state = self.__dict__.copy()
+        state["_base"] = self.base()
+        state["_load_frame"] = None
+        state["_cache"] = OrderedDict()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __repr__(self) -> str:
+        return f"cubes(dimensions={self.dimensions}, measures={self.measures})"
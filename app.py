@@ -3,9 +3,12 @@
 支持对话历史、代码生成、错误纠正和自然语言解释
 """
 
+import time
+
 import streamlit as st
-import pandas as pd
 from data_analyzer import DataAnalyzer
+from dtype_optimizer import format_memory_report
+from query_engine import ENGINES
 
 # 页面配置
 st.set_page_config(page_title="智能表格数据分析Agent 🤖", layout="wide")
@@ -15,6 +18,64 @@ st.title("🤖 智能表格数据分析Agent ")
 st.markdown("支持对话历史、自动代码生成、图表绘制、错误纠正和自然语言解释")
 st.divider()
 
+@st.cache_resource
+def get_process_executor():
+    """进程级共享的代码执行工作进程池(所有会话共用)"""
+    from code_executor import ProcessCodeExecutor
+    return ProcessCodeExecutor()
+
+
+@st.cache_resource
+def get_session_store():
+    """进程级共享的会话存储, 页面刷新或应用重启后按地址栏中的会话ID恢复"""
+    from session_store import SessionStore
+    return SessionStore()
+
+
+@st.cache_resource
+def get_execution_cache():
+    """进程级共享的执行结果缓存, 各会话中相同代码在相同数据上的结果直接复用"""
+    from execution_cache import ExecutionCache
+    return ExecutionCache()
+
+
+def restored_chats(analyzer):
+    """由恢复的对话记忆重建对话记录(图表不随会话保存)"""
+    return [
+        {
+            "question": hist["question"],
+            "code": hist["code"],
+            "execution_result": hist["result"],
+            "explanation": hist["explanation"],
+            "success": True,
+            "retry_count": 0,
+            "figure": None,
+        }
+        for hist in analyzer.execution_history
+    ]
+
+
+def render_explanation(chat):
+    """显示解释; 后台仍在生成时展示已收到的部分并定时刷新"""
+    future = chat.get("explanation_future")
+    if future is None or future.done():
+        st.info(chat["explanation"])
+    elif hasattr(st, "fragment"):
+        _render_pending_explanation(chat)
+    else:
+        # 旧版Streamlit不支持局部刷新, 等待解释生成完成
+        future.result()
+        st.info(chat["explanation"])
+
+
+if hasattr(st, "fragment"):
+    @st.fragment(run_every=0.5)
+    def _render_pending_explanation(chat):
+        if chat["explanation_future"].done():
+            st.rerun()
+        st.info((chat["explanation"] or "解释生成中...") + " ▌")
+
+
 # 初始化session state
 if "analyzer" not in st.session_state:
     st.session_state.analyzer = None
@@ -37,12 +98,18 @@ with st.sidebar:
     csv_path = None
     
     if data_source == "上传文件":
-        uploaded_file = st.file_uploader("上传CSV文件", type="csv")
-        if uploaded_file:
-            csv_path = uploaded_file
+        uploaded_files = st.file_uploader(
+            "上传CSV/Excel文件(可多选, 每个文件或工作表为一张表)",
+            type=["csv", "xlsx", "xls"],
+            accept_multiple_files=True,
+        )
+        if len(uploaded_files) == 1:
+            csv_path = uploaded_files[0]
+        elif uploaded_files:
+            csv_path = list(uploaded_files)
     else:
         csv_path_input = st.text_input(
-            "CSV文件路径:",
+            "CSV/Excel文件或目录路径:",
             value=r"d:\ms_project\excel_agent\data\大模型实习项目测试.csv"
         )
         if csv_path_input:
@@ -52,7 +119,7 @@ with st.sidebar:
     st.header("🤖 LLM设置")
     llm_provider = st.selectbox(
         "选择LLM:",
-        ["qwen3","gemini", "gpt", "claude", "deepseek"],
+        ["qwen3","gemini", "gpt", "claude", "deepseek", "auto"],
         index=0
     )
 
@@ -67,16 +134,38 @@ with st.sidebar:
                 except Exception as e:
                     st.error(f"切换失败: {e}")
     
+    isolated_exec = st.checkbox("隔离进程执行代码", value=False, help="在独立工作进程中执行生成的代码, 带超时和内存上限")
+    
+    engine = st.selectbox(
+        "查询引擎:",
+        ENGINES,
+        help="duckdb / polars 直接查询列式存储, 数据不整体载入内存, 适合超大数据集(需安装对应的包)",
+    )
+    
+    stream_load = st.checkbox("大文件分块加载", value=False, help="逐块读取并清理CSV, 写入列式存储, 降低内存峰值")
+    chunksize = None
+    if stream_load:
+        chunksize = int(st.number_input("每块行数:", min_value=10000, value=200000, step=10000))
+    
     if st.button("🚀 加载数据", width='stretch'):
         if csv_path:
             try:
                 with st.spinner("正在加载数据..."):
+                    progress_text = st.empty()
                     st.session_state.analyzer = DataAnalyzer(
                         csv_path=csv_path,
-                        llm_provider=llm_provider
+                        llm_provider=llm_provider,
+                        chunksize=chunksize,
+                        engine=engine,
+                        progress_callback=(lambda rows: progress_text.text(f"已加载 {rows} 行...")) if chunksize else None,
+                        executor=get_process_executor() if isolated_exec else None,
+                        session_store=get_session_store(),
+                        execution_cache=get_execution_cache(),
                     )
+                    progress_text.empty()
                     st.session_state.data_loaded = True
                     st.session_state.chat_history = []
+                    st.query_params["session"] = st.session_state.analyzer.session_id
                 st.success("✓ 数据加载成功!")
             except Exception as e:
                 st.error(f"❌ 加载失败: {str(e)}")
@@ -91,6 +180,28 @@ with st.sidebar:
                 st.session_state.analyzer.clear_history()
             st.rerun()
 
+# 页面刷新或应用重启后恢复地址栏中的会话(不重新读取CSV)
+session_param = st.query_params.get("session")
+if st.session_state.analyzer is None and session_param:
+    try:
+        st.session_state.analyzer = DataAnalyzer.resume(
+            session_param,
+            get_session_store(),
+            executor=get_process_executor() if isolated_exec else None,
+            execution_cache=get_execution_cache(),
+        )
+        st.session_state.chat_history = restored_chats(st.session_state.analyzer)
+        st.session_state.data_loaded = True
+    except KeyError:
+        st.warning(f"会话 {session_param} 不存在或已过期, 请重新加载数据")
+        del st.query_params["session"]
+    except FileNotFoundError as e:
+        # 上传文件的会话引用的数据缓存已被清理
+        st.warning(str(e))
+        del st.query_params["session"]
+    except Exception as e:
+        st.error(f"❌ 恢复会话失败: {str(e)}")
+
 # 主界面
 if st.session_state.data_loaded and st.session_state.analyzer:
     analyzer = st.session_state.analyzer
@@ -102,27 +213,32 @@ if st.session_state.data_loaded and st.session_state.analyzer:
     with col_data:
         st.header("📊 数据概览")
         
+        profile = analyzer.profile
+        catalog = analyzer.catalog
+        if catalog is not None:
+            # 多表数据集: 概览展示所选表基于样本的概要, 不加载整表
+            table_name = st.selectbox(f"数据表 (共{len(catalog)}张):", catalog.names)
+            profile = catalog.profile(table_name)
+            loaded = catalog.loaded()
+            if loaded:
+                st.caption("已加载: " + ", ".join(f"{name} ({size / 1024 ** 2:.1f}MB)" for name, size in loaded.items()))
+        
         with st.expander("数据集信息", expanded=True):
-            df = analyzer.df
-            st.write(f"**行数:** {len(df)}")
-            st.write(f"**列数:** {len(df.columns)}")
-            st.write(f"**列名:** {', '.join(df.columns.tolist())}")
+            st.write(f"**行数:** {'约' if catalog is not None else ''}{profile.rows}")
+            st.write(f"**列数:** {len(profile.columns)}")
+            st.write(f"**列名:** {', '.join(profile.columns)}")
+            memory_report = analyzer.memory_report if catalog is None else None
+            if memory_report and memory_report["columns"]:
+                st.write(f"**内存优化:** {format_memory_report(memory_report)}")
         
         with st.expander("前10行数据"):
-            st.dataframe(df.head(10), width='stretch')
+            st.dataframe(profile.head, width='stretch')
         
         with st.expander("数据统计"):
-            st.dataframe(df.describe(), width='stretch')
+            st.dataframe(profile.describe, width='stretch')
         
         with st.expander("数据类型"):
-            dtype_df = pd.DataFrame({
-                '列名': df.columns,
-                '数据类型': df.dtypes.values
-            })
-            # 避免 Arrow 转换错误: 将 dtype 对象转为字符串
-            if '数据类型' in dtype_df.columns:
-                dtype_df['数据类型'] = dtype_df['数据类型'].astype(str)
-            st.dataframe(dtype_df, width='stretch')
+            st.dataframe(profile.dtype_frame(), width='stretch')
     
     # 右侧 - 对话界面
     with col_chat:
@@ -131,6 +247,11 @@ if st.session_state.data_loaded and st.session_state.analyzer:
         # 显示对话历史
         chat_container = st.container()
         with chat_container:
+            summaries = analyzer.memory.summaries
+            if summaries:
+                with st.expander(f"🗂️ 更早的 {len(summaries)} 轮对话(摘要)", expanded=False):
+                    for line in summaries:
+                        st.markdown(f"- {line}")
             for i, chat in enumerate(st.session_state.chat_history):
                 # 用户问题
                 with st.chat_message("user"):
@@ -151,15 +272,25 @@ if st.session_state.data_loaded and st.session_state.analyzer:
                         
                         # 显示自然语言解释
                         st.markdown("**💡 分析解释:**")
-                        st.info(chat["explanation"])
+                        render_explanation(chat)
                         
                         if chat.get("figure") is not None:
                             st.markdown("**📈 生成的图表:**")
                             col1, col2, col3 = st.columns([1, 3, 1])
                             with col2:
-                                st.pyplot(chat["figure"], width='stretch')
-                            import matplotlib.pyplot as plt
-                            plt.close(chat["figure"])
+                                if isinstance(chat["figure"], bytes):
+                                    # 进程执行后端返回PNG字节
+                                    st.image(chat["figure"], width='stretch')
+                                else:
+                                    render_start = time.perf_counter()
+                                    st.pyplot(chat["figure"], width='stretch')
+                                    # 当前进程执行时图形在此渲染, 首次渲染耗时记入追踪
+                                    if chat.get("trace") is not None and not chat.get("figure_rendered"):
+                                        chat["trace"].record("figure_render", time.perf_counter() - render_start)
+                                        chat["figure_rendered"] = True
+                            if not isinstance(chat["figure"], bytes):
+                                import matplotlib.pyplot as plt
+                                plt.close(chat["figure"])
                         
                         if chat.get("retry_count", 0) > 0:
                             st.caption(f"ℹ️ 经过 {chat['retry_count'] + 1} 次尝试后成功")
@@ -196,9 +327,24 @@ if st.session_state.data_loaded and st.session_state.analyzer:
             st.rerun()
         
         if submit_btn and user_question.strip():
+            with st.chat_message("user"):
+                st.write(user_question)
+            live_answer = st.chat_message("assistant")
+
+            # 代码执行完立即展示结果; 解释在后台生成, 由对话历史中的解释区域轮询展示
+            def show_execution(partial):
+                with live_answer:
+                    st.success("✓ 分析完成")
+                    with st.expander("📊 执行结果", expanded=True):
+                        st.text(partial["execution_result"])
+
             with st.spinner("🤔 正在分析..."):
                 try:
-                    result = analyzer.generate_code(user_question)
+                    result = analyzer.generate_code(
+                        user_question,
+                        on_execution=show_execution,
+                        explain="async",
+                    )
                 except Exception as e:
                     import traceback
                     err_text = f"代码生成异常: {e}\n{traceback.format_exc()[:800]}"
@@ -222,6 +368,8 @@ if st.session_state.data_loaded and st.session_state.analyzer:
                         result["explanation"] += f"\n(provider={provider})"
                 
                 st.session_state.chat_history.append(result)
+                # 只保留对话记忆容量内的轮次(含图表), 更早的以摘要展示
+                del st.session_state.chat_history[:-analyzer.memory.max_turns]
                 st.rerun()
 
 else:
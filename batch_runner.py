@@ -0,0 +1,157 @@
+"""
+并发批处理
+从JSONL/CSV文件读取问题, 相互独立的问题并发执行, 同一追问链(chain)内的问题按顺序
+在同一会话中执行以保留对话历史; 每个问题完成后立即以JSONL写出结构化结果
+"""
+
+import asyncio
+import csv
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from data_analyzer import DataAnalyzer
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """
+    读取问题文件
+
+    JSONL: 每行为字符串, 或包含 question 及可选 id、chain 字段的对象
+    CSV: 需要 question 列, 可选 id、chain 列
+    未指定 chain 的问题彼此独立
+    """
+    items = []
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                items.append(dict(row))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                items.append({"question": item} if isinstance(item, str) else item)
+
+    questions = []
+    for index, item in enumerate(items):
+        question = (item.get("question") or "").strip()
+        if not question:
+            raise ValueError(f"第 {index + 1} 条记录缺少 question 字段")
+        item_id = item.get("id")
+        questions.append({
+            # 显式给出的 id(包括 0)原样保留, 缺失或为空时按行号编号
+            "id": item_id if item_id not in (None, "") else str(index + 1),
+            "question": question,
+            "chain": item.get("chain") or None,
+        })
+    return questions
+
+
+def group_chains(questions: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """按 chain 分组, 保持文件中的先后顺序; 无 chain 的问题单独成组"""
+    chains: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+    for item in questions:
+        key = item["chain"] or f"__single_{item['id']}"
+        chains.setdefault(key, []).append(item)
+    return list(chains.values())
+
+
+def _to_record(item: Dict[str, Any], result: Dict[str, Any], latency: float, provider: Optional[str]) -> Dict[str, Any]:
+    return {
+        "id": item["id"],
+        "chain": item["chain"],
+        "question": item["question"],
+        "success": result.get("success", False),
+        "code": result.get("code", ""),
+        "output": result.get("execution_result", ""),
+        "explanation": result.get("explanation", ""),
+        "error": result.get("error"),
+        "retries": result.get("retry_count", 0),
+        "latency": round(latency, 3),
+        "tokens": result.get("tokens"),
+        "timings": result["trace"].stages() if result.get("trace") else None,
+        "cache_hit": result.get("cache_hit"),
+        "provider": provider,
+    }
+
+
+async def run_batch(
+    analyzer: DataAnalyzer,
+    questions: List[Dict[str, Any]],
+    workers: int = 4,
+    output_path: Optional[str] = None,
+    on_result: Optional[Callable[[Dict[str, Any], Dict[str, Any]], None]] = None,
+    max_retries: int = 3,
+    append: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    并发执行一批问题
+
+    Args:
+        analyzer: 已加载数据的分析器, 每条追问链使用其 fork_session() 得到的独立会话
+        questions: load_questions 返回的问题列表
+        workers: 同时进行的问题数上限
+        output_path: 结果JSONL路径, 每完成一个问题写出一行
+        on_result: 每个问题完成时的回调 (record, result)
+        max_retries: 每个问题的最大重试次数
+        append: 追加到已有的结果文件, 默认覆盖
+
+    Returns:
+        按完成顺序排列的结果记录
+    """
+    semaphore = asyncio.Semaphore(max(1, workers))
+    records: List[Dict[str, Any]] = []
+    output = open(output_path, "a" if append else "w", encoding="utf-8") if output_path else None
+
+    def emit(item: Dict[str, Any], result: Dict[str, Any], latency: float, provider: Optional[str]):
+        record = _to_record(item, result, latency, provider)
+        records.append(record)
+        if output:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+        if on_result:
+            on_result(record, result)
+
+    async def emit_when_explained(item, result, latency, provider):
+        # 后台解释模式: 等待解释完成后再写出, 同一追问链的下一个问题无需等待
+        await result["explanation_future"]
+        emit(item, result, latency, provider)
+
+    async def run_chain(chain: List[Dict[str, Any]]):
+        session = analyzer.fork_session()
+        pending = []
+        for item in chain:
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    result = await session.agenerate_code(item["question"], max_retries=max_retries)
+                except Exception as e:
+                    result = session._new_result(item["question"])
+                    result["error"] = str(e)
+                    result["explanation"] = f"分析异常: {e}"
+                latency = time.perf_counter() - start
+
+            provider = getattr(session, "active_provider", None)
+            if result.get("explanation_future") is not None:
+                pending.append(asyncio.ensure_future(emit_when_explained(item, result, latency, provider)))
+            else:
+                emit(item, result, latency, provider)
+        await asyncio.gather(*pending)
+
+    try:
+        await asyncio.gather(*(run_chain(chain) for chain in group_chains(questions)))
+    finally:
+        if output:
+            output.close()
+    return records
+
+
+def default_output_path(questions_path: str) -> str:
+    """默认结果文件: 问题文件同目录下的 <名称>.results.jsonl"""
+    stem, _ = os.path.splitext(questions_path)
+    return f"{stem}.results.jsonl"
@@ -0,0 +1,238 @@
+"""
+DataAnalyzer 离线基准测试(脚本化LLM, 不依赖API Key与网络)
+
+使用方式:
+  python benchmarks/bench_analyzer.py --sizes 10k,100k,1m
+  python benchmarks/bench_analyzer.py --sizes 50m --chunksize 2000000
+  python benchmarks/bench_analyzer.py --output bench.json
+  python benchmarks/bench_analyzer.py --baseline bench.json --tolerance 0.2
+
+按行数生成与样例格式相同的未清洗CSV(缓存在 --data-dir 中复用), 对每个规模:
+- 加载: 读取CSV、清理、写缓存、数据概要各阶段的耗时与内存峰值
+- 提问: 脚本化LLM返回预设代码(含先出错再纠正的重试场景)和预设解释,
+  记录提示词构建、LLM调用、代码执行、解释各阶段的耗时, 以及代码执行的内存峰值
+LLM不产生延迟, 测得的即 DataAnalyzer 自身的开销; 指定 --baseline 时与之前的结果对比,
+任一阶段变慢超过 --tolerance 时以非零状态退出
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import parse_rows, synthetic_csv  # noqa: E402
+from data_analyzer import DataAnalyzer  # noqa: E402
+from fake_llm import FakeLLM  # noqa: E402
+from tracing import Trace  # noqa: E402
+
+
+# 预设问题: 每个问题对应按尝试顺序返回的代码, 最后一段重复使用
+SCRIPT = {
+    "分析Clothing随时间变化的总销售额趋势": [
+        "result = df[df['Category'] == 'Clothing'].groupby('Year')['Sales'].sum()\nprint(result)",
+    ],
+    "对Bikes进行同样的分析": [
+        "result = df[df['Category'] == 'Bikes'].groupby('Year')['Sales'].sum()\nprint(result)",
+    ],
+    "哪些年份Components比Accessories的总销售额高?": [
+        "pivot = df.pivot_table(index='Year', columns='Category', values='Sales', aggfunc='sum')\n"
+        "print(pivot[pivot['Components'] > pivot['Accessories']].index.tolist())",
+    ],
+    "各产品的平均评分是多少?": [
+        "print(df.groupby('Product')['Rating'].mean().sort_values(ascending=False))",
+    ],
+    # 第一次生成的代码列名错误, 触发重试
+    "销量最高的前5个产品?": [
+        "print(df.groupby('product')['Sales'].sum().nlargest(5))",
+        "print(df.groupby('Product')['Sales'].sum().nlargest(5))",
+    ],
+}
+
+EXPLANATION = "根据执行结果, 各年份的销售额如上所示。"
+
+
+class ScriptedCode:
+    """按问题和提问次数返回预设代码(供 FakeLLM 的 code_for 使用)"""
+
+    def __init__(self, script: Dict[str, List[str]]):
+        self.script = script
+        self.asked: Dict[str, int] = {}
+
+    def __call__(self, question: str) -> str:
+        codes = self.script[question]
+        count = self.asked.get(question, 0)
+        self.asked[question] = count + 1
+        return codes[min(count, len(codes) - 1)]
+
+    def reset(self):
+        self.asked.clear()
+
+
+def _stage_stats(trace: Trace) -> Dict[str, Dict[str, float]]:
+    """按阶段汇总耗时(秒)和内存峰值(字节)"""
+    stats: Dict[str, Dict[str, float]] = {}
+    for item in trace.spans[1:]:
+        if item.duration is None:
+            continue
+        entry = stats.setdefault(item.name, {"seconds": 0.0})
+        entry["seconds"] += item.duration
+        peak = item.attributes.get("peak_memory") or item.attributes.get("peak_rss")
+        if peak:
+            entry["peak_bytes"] = max(entry.get("peak_bytes", 0), peak)
+    return stats
+
+
+def _median_stats(runs: List[Dict[str, Dict[str, float]]]) -> Dict[str, Dict[str, float]]:
+    merged: Dict[str, Dict[str, float]] = {}
+    for name in runs[0]:
+        values = [run[name] for run in runs if name in run]
+        merged[name] = {"seconds": statistics.median(value["seconds"] for value in values)}
+        peaks = [value["peak_bytes"] for value in values if "peak_bytes" in value]
+        if peaks:
+            merged[name]["peak_bytes"] = max(peaks)
+    return merged
+
+
+@contextlib.contextmanager
+def _quiet(enabled: bool):
+    """屏蔽分析器的进度输出"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def bench_size(rows: int, args) -> Dict[str, Any]:
+    csv_path = synthetic_csv(rows, args.data_dir)
+    code_for = ScriptedCode(SCRIPT)
+    llm = FakeLLM(code_for, explanation=EXPLANATION)
+
+    load_trace = Trace("load", rows=rows)
+    start = time.perf_counter()
+    with _quiet(not args.verbose), load_trace.activate():
+        analyzer = DataAnalyzer(
+            csv_path, "fake", llm=llm, use_cache=False, chunksize=args.chunksize,
+            trace_memory=args.memory, explain=args.explain,
+        )
+    load_trace.finish()
+    load_seconds = time.perf_counter() - start
+
+    questions: Dict[str, Any] = {}
+    for question in SCRIPT:
+        runs = []
+        retries = 0
+        for _ in range(args.repeat):
+            code_for.reset()
+            with _quiet(not args.verbose):
+                analyzer.clear_history()
+                result = analyzer.generate_code(question)
+            if not result["success"]:
+                raise RuntimeError(f"预设问题执行失败: {question}\n{result['error']}")
+            retries = result["retry_count"]
+            runs.append({"total": {"seconds": result["trace"].duration}, **_stage_stats(result["trace"])})
+        questions[question] = {"retries": retries, "stages": _median_stats(runs)}
+
+    return {
+        "rows": rows,
+        "frame_bytes": int(analyzer.df.memory_usage(deep=True).sum()),
+        "load": {"total": {"seconds": load_seconds}, **_stage_stats(load_trace)},
+        "questions": questions,
+    }
+
+
+def _format_row(name: str, stats: Dict[str, float]) -> str:
+    peak = stats.get("peak_bytes")
+    peak_text = f"{peak / 1024 ** 2:.1f}" if peak else "-"
+    return f"  {name:<22}{stats['seconds'] * 1000:>12.2f}{peak_text:>14}"
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\n{'=' * 60}")
+    print(f"行数: {report['rows']:,} | DataFrame: {report['frame_bytes'] / 1024 ** 2:.1f} MB")
+    print(f"{'=' * 60}")
+    print(f"  {'加载阶段':<20}{'耗时(ms)':>12}{'内存峰值(MB)':>12}")
+    for name, stats in report["load"].items():
+        print(_format_row(name, stats))
+    for question, entry in report["questions"].items():
+        retry_note = f" (重试 {entry['retries']} 次)" if entry["retries"] else ""
+        print(f"\n  问题: {question}{retry_note}")
+        for name, stats in entry["stages"].items():
+            print(_format_row(name, stats))
+
+
+def _timings(reports: Dict[str, Any]) -> Dict[str, float]:
+    """展开为 {规模/阶段: 秒} 便于对比"""
+    flat: Dict[str, float] = {}
+    for size, report in reports.items():
+        for name, stats in report["load"].items():
+            flat[f"{size}/load/{name}"] = stats["seconds"]
+        for question, entry in report["questions"].items():
+            for name, stats in entry["stages"].items():
+                flat[f"{size}/{question}/{name}"] = stats["seconds"]
+    return flat
+
+
+def compare(reports: Dict[str, Any], baseline: Dict[str, Any], tolerance: float, min_seconds: float) -> List[str]:
+    """与基线对比, 返回变慢超过容差的阶段(忽略基线中耗时过短的阶段, 避免计时噪声)"""
+    current, previous = _timings(reports), _timings(baseline)
+    regressions = []
+    for key, seconds in sorted(current.items()):
+        before = previous.get(key)
+        if before is None or before < min_seconds:
+            continue
+        if seconds > before * (1 + tolerance):
+            regressions.append(f"{key}: {before * 1000:.2f} ms → {seconds * 1000:.2f} ms ({seconds / before:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DataAnalyzer 离线基准测试")
+    parser.add_argument("--sizes", default="10k,100k,1m", help="逗号分隔的行数, 支持 k/m 后缀, 最大可到 50m")
+    parser.add_argument("--repeat", type=int, default=3, help="每个问题的重复次数(取中位数)")
+    parser.add_argument("--chunksize", type=int, default=None, help="分块流式加载的每块行数 (默认: 一次性加载)")
+    parser.add_argument("--explain", default="sync", choices=["sync", "none"], help="解释模式 (默认: sync)")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="不记录内存峰值(tracemalloc会使加载和执行变慢)")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "excel_agent_bench"),
+                        help="合成CSV的缓存目录")
+    parser.add_argument("--output", default=None, help="结果JSON路径")
+    parser.add_argument("--baseline", default=None, help="对比的基线结果JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="相对基线允许变慢的比例 (默认: 0.2)")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="基线耗时低于该值的阶段不参与对比 (默认: 5)")
+    parser.add_argument("--verbose", action="store_true", help="显示分析器的加载与执行输出")
+    args = parser.parse_args()
+
+    reports: Dict[str, Any] = {}
+    for size in [item for item in args.sizes.split(",") if item.strip()]:
+        rows = parse_rows(size)
+        print(f"→ {size}: 准备合成数据 {rows:,} 行 ...")
+        reports[size.strip()] = bench_size(rows, args)
+        print_report(reports[size.strip()])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"memory": args.memory, "reports": reports}, f, ensure_ascii=False, indent=2)
+        print(f"\n✓ 结果已写入: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(reports, baseline["reports"], args.tolerance, args.min_ms / 1000)
+        if regressions:
+            print(f"\n⚠ {len(regressions)} 个阶段比基线慢 {args.tolerance:.0%} 以上:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"\n✓ 与基线相比没有超过 {args.tolerance:.0%} 的变慢")
+
+
+if __name__ == "__main__":
+    main()
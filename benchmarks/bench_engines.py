@@ -0,0 +1,159 @@
+"""
+查询引擎对比基准测试(脚本化LLM, 不依赖API Key与网络)
+
+使用方式:
+  python benchmarks/bench_engines.py --sizes 1m,10m
+  python benchmarks/bench_engines.py --sizes 50m --engines duckdb,polars --isolated
+  python benchmarks/bench_engines.py --output engines.json
+
+按行数生成与样例格式相同的未清洗CSV(与 bench_analyzer 共用 --data-dir 中的缓存), 对每个规模和引擎:
+- 加载: pandas 读取并清理整个CSV; duckdb/polars 分块写入列式存储, 只读取样本生成概要
+- 提问: 各引擎执行语义相同的预设代码(分组聚合、过滤、排序), 记录代码执行耗时;
+  --isolated 时在工作进程中执行并记录进程内存峰值(RSS, 包括引擎在Python堆之外的分配)
+未安装的引擎跳过
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_analyzer import _format_row, _median_stats, _quiet, _stage_stats  # noqa: E402
+from benchmarks.synthetic import parse_rows, synthetic_csv  # noqa: E402
+from data_analyzer import DataAnalyzer  # noqa: E402
+from fake_llm import FakeLLM  # noqa: E402
+from query_engine import ENGINES  # noqa: E402
+from tracing import Trace  # noqa: E402
+
+
+# 预设问题: 各引擎语义相同的代码
+SCRIPT = {
+    "各类别总销售额": {
+        "pandas": "print(df.groupby('Category')['Sales'].sum().sort_index())",
+        "duckdb": 'print(con.sql("SELECT Category, SUM(Sales) AS Sales FROM data GROUP BY Category ORDER BY Category").df())',
+        "polars": "print(lf.group_by('Category').agg(pl.col('Sales').sum()).sort('Category').collect().to_pandas())",
+    },
+    "Clothing各年的销售额": {
+        "pandas": "print(df[df['Category'] == 'Clothing'].groupby('Year')['Sales'].sum().sort_index())",
+        "duckdb": (
+            'print(con.sql("SELECT Year, SUM(Sales) AS Sales FROM data '
+            "WHERE Category = 'Clothing' GROUP BY Year ORDER BY Year\").df())"
+        ),
+        "polars": (
+            "print(lf.filter(pl.col('Category') == 'Clothing').group_by('Year')"
+            ".agg(pl.col('Sales').sum()).sort('Year').collect().to_pandas())"
+        ),
+    },
+    "平均评分最高的5个产品": {
+        "pandas": "print(df.groupby('Product')['Rating'].mean().nlargest(5))",
+        "duckdb": (
+            'print(con.sql("SELECT Product, AVG(Rating) AS Rating FROM data '
+            'GROUP BY Product ORDER BY Rating DESC LIMIT 5").df())'
+        ),
+        "polars": (
+            "print(lf.group_by('Product').agg(pl.col('Rating').mean())"
+            ".sort('Rating', descending=True).head(5).collect().to_pandas())"
+        ),
+    },
+}
+
+
+def _installed(engine: str) -> bool:
+    return engine == "pandas" or importlib.util.find_spec(engine) is not None
+
+
+def bench_engine(csv_path: str, engine: str, args, executor: Any = None) -> Dict[str, Any]:
+    questions = {}
+    llm = FakeLLM(lambda question: SCRIPT[question][engine])
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        os.environ["EXCEL_AGENT_CACHE_DIR"] = store_dir
+        load_trace = Trace("load", engine=engine)
+        start = time.perf_counter()
+        with _quiet(not args.verbose), load_trace.activate():
+            analyzer = DataAnalyzer(
+                csv_path, "fake", llm=llm, use_cache=False, chunksize=args.chunksize,
+                engine=engine, executor=executor, explain="none",
+            )
+        load_trace.finish()
+        load_seconds = time.perf_counter() - start
+
+        for question in SCRIPT:
+            runs = []
+            for _ in range(args.repeat):
+                with _quiet(not args.verbose):
+                    analyzer.clear_history()
+                    result = analyzer.generate_code(question)
+                if not result["success"]:
+                    raise RuntimeError(f"{engine} 执行预设问题失败: {question}\n{result['error']}")
+                runs.append(_stage_stats(result["trace"]))
+            questions[question] = _median_stats(runs)["execute"]
+
+    return {
+        "load": {"total": {"seconds": load_seconds}, **_stage_stats(load_trace)},
+        "questions": questions,
+    }
+
+
+def print_report(rows: int, reports: Dict[str, Any]):
+    print(f"\n{'=' * 60}")
+    print(f"行数: {rows:,}")
+    print(f"{'=' * 60}")
+    for engine, report in reports.items():
+        print(f"\n  [{engine}] {'耗时(ms)':>24}{'内存峰值(MB)':>12}")
+        print(_format_row("加载", report["load"]["total"]))
+        for question, stats in report["questions"].items():
+            print(_format_row(question, stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询引擎对比基准测试")
+    parser.add_argument("--sizes", default="1m", help="逗号分隔的行数, 支持 k/m 后缀")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="逗号分隔的引擎 (默认: 全部已安装的)")
+    parser.add_argument("--repeat", type=int, default=3, help="每个问题的重复次数(取中位数)")
+    parser.add_argument("--chunksize", type=int, default=None, help="写入列式存储/分块加载的每块行数")
+    parser.add_argument("--isolated", action="store_true", help="在工作进程中执行并记录进程内存峰值")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "excel_agent_bench"),
+                        help="合成CSV的缓存目录")
+    parser.add_argument("--output", default=None, help="结果JSON路径")
+    parser.add_argument("--verbose", action="store_true", help="显示分析器的加载与执行输出")
+    args = parser.parse_args()
+
+    engines = []
+    for engine in [item.strip() for item in args.engines.split(",") if item.strip()]:
+        if _installed(engine):
+            engines.append(engine)
+        else:
+            print(f"⚠ 未安装 {engine}, 跳过")
+
+    executor = None
+    if args.isolated:
+        from code_executor import ProcessCodeExecutor
+        executor = ProcessCodeExecutor(workers=1, timeout=3600, memory_limit_mb=None)
+
+    results: Dict[str, Any] = {}
+    try:
+        for size in [item.strip() for item in args.sizes.split(",") if item.strip()]:
+            rows = parse_rows(size)
+            print(f"→ {size}: 准备合成数据 {rows:,} 行 ...")
+            csv_path = synthetic_csv(rows, args.data_dir)
+            results[size] = {engine: bench_engine(csv_path, engine, args, executor) for engine in engines}
+            print_report(rows, results[size])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"isolated": args.isolated, "reports": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n✓ 结果已写入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+启动导入耗时基准测试(基于 python -X importtime)
+
+使用方式:
+  python benchmarks/bench_import.py
+  python benchmarks/bench_import.py --module cli_analyzer --repeat 5 --max-ms 1500
+
+在全新的子进程中导入指定模块, 汇总自身导入耗时, 列出耗时最多的依赖,
+并检查提供商SDK与matplotlib没有在启动时被导入(它们应在选中提供商/需要绘图时才导入);
+超出 --max-ms 或导入了禁止的模块时以非零状态退出, 可用于CI防止回退
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 启动时不应导入的重量级模块
+LAZY_MODULES = [
+    "langchain_openai",
+    "langchain_anthropic",
+    "langchain_google_genai",
+    "matplotlib",
+]
+
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure(module: str) -> Tuple[int, Dict[str, int]]:
+    """
+    在子进程中导入模块
+
+    Returns:
+        (模块累计导入耗时(微秒), {顶层包: 累计耗时(微秒)})
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    total = 0
+    packages: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        cumulative, name = int(match.group(2)), match.group(4)
+        if name == module:
+            total = cumulative
+        top = name.split(".")[0]
+        packages[top] = max(packages.get(top, 0), cumulative)
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动导入耗时基准测试")
+    parser.add_argument("--module", default="data_analyzer", help="要导入的模块")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数(取中位数)")
+    parser.add_argument("--top", type=int, default=10, help="列出耗时最多的依赖包个数")
+    parser.add_argument("--max-ms", type=float, default=None, help="导入耗时上限(毫秒), 超出时返回非零状态")
+    args = parser.parse_args()
+
+    runs: List[int] = []
+    packages: Dict[str, int] = {}
+    for _ in range(max(1, args.repeat)):
+        total, packages = measure(args.module)
+        runs.append(total)
+    median_ms = statistics.median(runs) / 1000
+
+    print(f"导入 {args.module}: 中位数 {median_ms:.0f} ms ({', '.join(f'{t / 1000:.0f}' for t in runs)} ms)\n")
+    print(f"{'依赖包':<28}{'累计耗时(ms)':>14}")
+    ranked = sorted((item for item in packages.items() if item[0] != args.module), key=lambda item: -item[1])
+    for name, cumulative in ranked[:args.top]:
+        print(f"{name:<28}{cumulative / 1000:>14.1f}")
+
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in packages]
+    if eager:
+        print(f"\n⚠ 启动时导入了应延迟加载的模块: {', '.join(eager)}")
+        failed = True
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print(f"\n⚠ 导入耗时 {median_ms:.0f} ms 超出上限 {args.max_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print("\n✓ 提供商SDK与matplotlib均未在启动时导入")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+基准测试用的合成数据
+与 data/大模型实习项目测试.csv 结构相同: Year, Category, Product, Sales, Rating
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+CATEGORIES = {
+    "Accessories": ["Bike Racks", "Bottles and Cages", "Helmets", "Locks", "Pumps"],
+    "Bikes": ["Mountain Bikes", "Road Bikes", "Touring Bikes"],
+    "Clothing": ["Bib-Shorts", "Caps", "Gloves", "Jerseys", "Shorts", "Socks", "Tights", "Vests"],
+    "Components": ["Brakes", "Chains", "Cranksets", "Forks", "Handlebars", "Wheels"],
+}
+
+
+def make_sales_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """生成已清洗(数值化)的合成销售数据"""
+    rng = np.random.default_rng(seed)
+    pairs = [(cat, prod) for cat, prods in CATEGORIES.items() for prod in prods]
+    idx = rng.integers(0, len(pairs), rows)
+    categories = np.array([p[0] for p in pairs], dtype=object)
+    products = np.array([p[1] for p in pairs], dtype=object)
+    return pd.DataFrame({
+        "Year": rng.integers(2015, 2021, rows),
+        "Category": categories[idx],
+        "Product": products[idx],
+        "Sales": rng.integers(1, 500, rows) * 100,
+        "Rating": rng.integers(1, 101, rows),
+    })
+
+
+def parse_rows(text: str) -> int:
+    """解析行数, 支持 k/m 后缀, 如 10k、1.5m、50m"""
+    text = text.strip().lower().replace("_", "")
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    number = text[:-1] if scale > 1 else text
+    return int(float(number) * scale)
+
+
+def write_sales_csv(path: str, rows: int, seed: int = 0, chunk_rows: int = 1_000_000) -> str:
+    """
+    写出与样例格式相同的未清洗CSV(Sales 为 " $20,000 " 货币文本, Rating 为 "75%" 百分比文本)
+
+    分块生成, 内存占用与总行数无关; 相同的 rows/seed 生成的文件内容相同
+    """
+    # Sales 为100的整数倍、Rating 为1~100, 取值有限, 用查表代替逐行格式化
+    sales_text = np.array([f" ${value * 100:,} " for value in range(500)], dtype=object)
+    rating_text = np.array([f"{value}%" for value in range(101)], dtype=object)
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        for index, start in enumerate(range(0, rows, chunk_rows)):
+            frame = make_sales_frame(min(chunk_rows, rows - start), seed=seed + index)
+            frame["Sales"] = sales_text[frame["Sales"].to_numpy() // 100]
+            frame["Rating"] = rating_text[frame["Rating"].to_numpy()]
+            frame.to_csv(f, index=False, header=index == 0)
+    return path
+
+
+def synthetic_csv(rows: int, directory: str, seed: int = 0) -> str:
+    """返回合成CSV路径, 不存在时生成(大文件生成较慢, 按行数缓存复用)"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"sales_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        tmp_path = path + ".tmp"
+        write_sales_csv(tmp_path, rows, seed)
+        os.replace(tmp_path, path)
+    return path
@@ -5,6 +5,7 @@
 
 import sys
 from data_analyzer import DataAnalyzer
+from query_engine import ENGINES
 
 
 def print_separator(char="=", length=80):
@@ -12,8 +13,39 @@ def print_separator(char="=", length=80):
     print(char * length)
 
 
-def print_result(result: dict):
-    """格式化打印分析结果"""
+def print_result(result: dict, streamed: bool = False, show_trace: bool = False):
+    """
+    格式化打印分析结果
+
+    Args:
+        streamed: 代码、执行结果和解释已由 print_execution 和流式回调打印, 只补充结尾信息
+        show_trace: 打印各阶段耗时明细
+    """
+    if streamed and result['success']:
+        print()
+    else:
+        print_execution(result)
+        if result['success']:
+            print(result['explanation'])
+    
+    if result['success']:
+        if result['retry_count'] > 0:
+            print(f"\nℹ️  经过 {result['retry_count'] + 1} 次尝试后成功")
+        tokens = result.get('tokens') or {}
+        if tokens.get('estimated_prompt_tokens'):
+            print(f"ℹ️  提示词约 {tokens['estimated_prompt_tokens']} tokens (压缩档位 {tokens['prompt_level']})")
+            if tokens.get('prompt_over_budget'):
+                print(f"⚠ 提示词压缩后仍超出预算 {tokens['prompt_over_budget']} tokens, 可调大 --prompt-budget")
+
+    if show_trace and result.get('trace') is not None:
+        print_separator("-")
+        print(result['trace'].format())
+    
+    print_separator("=")
+
+
+def print_execution(result: dict):
+    """打印问题、代码和执行结果; 成功时以解释标题结尾, 解释文本随后输出"""
     print_separator("=")
     print(f"📝 问题: {result['question']}")
     print_separator("-")
@@ -34,33 +66,47 @@ def print_result(result: dict):
         print("\n" + "=" * 80)
         print("💡 AI解释:")
         print("=" * 80)
-        print(result['explanation'])
-        
-        if result['retry_count'] > 0:
-            print(f"\nℹ️  经过 {result['retry_count'] + 1} 次尝试后成功")
     else:
         print("\n❌ 分析失败!")
         print(f"错误: {result['explanation']}")
         if result.get('code'):
             print("\n尝试的代码:")
             print(result['code'])
-    
-    print_separator("=")
 
 
-def run_interactive_mode(csv_path: str, llm_provider: str = "gemini"):
-    """运行交互式模式"""
+def run_interactive_mode(
+    csv_path: str = None,
+    llm_provider: str = None,
+    show_trace: bool = False,
+    session_id: str = None,
+    **analyzer_kwargs,
+):
+    """
+    运行交互式模式(analyzer_kwargs 透传给 DataAnalyzer; show_trace 时每个问题后打印各阶段耗时)
+
+    对话保存为会话(analyzer_kwargs 含 session_store 时); 只给出 session_id 时按会话记录恢复数据源和LLM,
+    llm_provider 为 None 时沿用会话中的提供商
+    """
     print_separator("=")
     print("🤖 智能数据分析助手 - 命令行版")
     print_separator("=")
-    print(f"CSV文件: {csv_path}")
-    print(f"LLM: {llm_provider}")
+    print(f"CSV文件: {csv_path or '(沿用会话)'}")
+    print(f"LLM: {llm_provider or '(沿用会话)'}")
+    if session_id:
+        print(f"会话: {session_id}")
     print_separator("=")
     
     try:
         # 初始化分析器
-        analyzer = DataAnalyzer(csv_path, llm_provider)
+        if csv_path is None:
+            if llm_provider:
+                analyzer_kwargs["llm_provider"] = llm_provider
+            analyzer = DataAnalyzer.resume(session_id, **analyzer_kwargs)
+        else:
+            analyzer = DataAnalyzer(csv_path, llm_provider or "qwen3", session_id=session_id, **analyzer_kwargs)
         print("\n✓ 数据加载成功!\n")
+        if analyzer.session_id:
+            print(f"会话ID: {analyzer.session_id} (使用 --session {analyzer.session_id} 继续本次对话)\n")
         
         # 显示数据集信息
         print(analyzer.get_dataset_info())
@@ -74,7 +120,7 @@ def run_interactive_mode(csv_path: str, llm_provider: str = "gemini"):
         print_separator("=")
         
         # 交互循环
-        question_count = 0
+        question_count = analyzer.memory.total_turns
         while True:
             print(f"\n问题 #{question_count + 1}:")
             question = input(">>> ").strip()
@@ -95,17 +141,35 @@ def run_interactive_mode(csv_path: str, llm_provider: str = "gemini"):
             
             if question.lower() == 'history':
                 print("\n对话历史:")
+                summaries = analyzer.memory.summaries
+                if summaries:
+                    print(f"\n更早的 {len(summaries)} 轮(摘要):")
+                    for line in summaries:
+                        print(f"  - {line}")
                 for i, hist in enumerate(analyzer.execution_history, 1):
                     print(f"\n{i}. {hist['question']}")
                     print(f"   结果: {hist['result'][:100]}...")
                 continue
             
-            # 执行分析
+            # 执行分析: 代码执行完立即打印结果, 解释随LLM输出逐段打印
             print("\n🤔 正在分析...\n")
-            result = analyzer.generate_code(question)
+            result = analyzer.generate_code(
+                question,
+                on_execution=print_execution,
+                on_explanation_token=(lambda text: print(text, end="", flush=True)) if analyzer.explain == "sync" else None,
+            )
+            if result['success'] and analyzer.explain == "none":
+                print("(未生成解释)", end="")
+            future = result.get('explanation_future')
+            if future is not None:
+                # 解释在后台生成, 不阻塞下一个问题; 完成后插入打印
+                print("(解释在后台生成, 完成后显示)", end="")
+                future.add_done_callback(
+                    lambda f, n=question_count + 1: print(f"\n\n💡 问题 #{n} 的解释:\n{f.result()}\n>>> ", end="", flush=True)
+                )
             
             # 打印结果
-            print_result(result)
+            print_result(result, streamed=True, show_trace=show_trace)
             
             question_count += 1
     
@@ -116,36 +180,63 @@ def run_interactive_mode(csv_path: str, llm_provider: str = "gemini"):
         sys.exit(1)
 
 
-def run_batch_mode(csv_path: str, questions: list, llm_provider: str = "gemini"):
-    """运行批处理模式(用于测试)"""
+def run_batch_mode(
+    csv_path: str,
+    questions: list,
+    llm_provider: str = "gemini",
+    workers: int = 1,
+    output_path: str = None,
+    show_trace: bool = False,
+    append: bool = False,
+    **analyzer_kwargs,
+):
+    """
+    运行批处理模式(analyzer_kwargs 透传给 DataAnalyzer; show_trace 时每个问题后打印各阶段耗时;
+    append 时结果追加到已有的结果文件, 否则覆盖)
+
+    questions 为字符串列表时视为同一条追问链按顺序执行;
+    为 load_questions 返回的字典列表时, 独立问题按 workers 并发执行
+    """
+    import asyncio
+    from batch_runner import run_batch
+
+    if questions and isinstance(questions[0], str):
+        questions = [
+            {"id": str(i), "question": q, "chain": "default"}
+            for i, q in enumerate(questions, 1)
+        ]
+
     print_separator("=")
     print("🤖 智能数据分析助手 - 批处理模式")
     print_separator("=")
     print(f"CSV文件: {csv_path}")
     print(f"LLM: {llm_provider}")
     print(f"问题数量: {len(questions)}")
+    print(f"并发数: {workers}")
+    if output_path:
+        print(f"结果文件: {output_path}{' (追加)' if append else ''}")
     print_separator("=")
     
     try:
         # 初始化分析器
-        analyzer = DataAnalyzer(csv_path, llm_provider)
+        analyzer = DataAnalyzer(csv_path, llm_provider, **analyzer_kwargs)
         print("\n✓ 数据加载成功!\n")
         
-        # 依次处理每个问题
-        for i, question in enumerate(questions, 1):
+        done = [0]
+
+        def on_result(record: dict, result: dict):
+            done[0] += 1
             print(f"\n\n{'='*80}")
-            print(f"处理问题 {i}/{len(questions)}")
+            print(f"完成问题 {done[0]}/{len(questions)} (id={record['id']}, 耗时 {record['latency']}s)")
             print('='*80)
-            
-            result = analyzer.generate_code(question)
-            print_result(result)
-            
-            # 简短暂停
-            import time
-            time.sleep(1)
+            print_result(result, show_trace=show_trace)
+
+        records = asyncio.run(run_batch(
+            analyzer, questions, workers=workers, output_path=output_path, on_result=on_result, append=append,
+        ))
         
         print("\n\n" + "="*80)
-        print("✓ 所有问题处理完成!")
+        print(f"✓ 所有问题处理完成! 成功 {sum(1 for r in records if r['success'])}/{len(records)}")
         print("="*80)
         
     except Exception as e:
@@ -155,35 +246,153 @@ def run_batch_mode(csv_path: str, questions: list, llm_provider: str = "gemini")
         sys.exit(1)
 
 
+def print_sessions(limit: int = 20):
+    """列出最近保存的会话"""
+    import time
+    from session_store import SessionStore
+
+    sessions = SessionStore().list(limit)
+    if not sessions:
+        print("没有保存的会话")
+        return
+    print(f"{'会话ID':<14}{'最后更新':<20}{'轮数':>6}  {'LLM':<10}数据源")
+    for item in sessions:
+        updated = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(item["updated_at"]))
+        print(f"{item['id']:<14}{updated:<20}{item['turns']:>6}  {item['provider'] or '-':<10}{item['source']}")
+
+
 def main():
     """主函数"""
     import argparse
     
     parser = argparse.ArgumentParser(description="智能数据分析助手")
-    parser.add_argument("csv_path", help="CSV文件路径")
+    parser.add_argument("csv_path", nargs="?", default=None, help="CSV文件路径 (使用 --session 恢复会话时可省略)")
     parser.add_argument(
         "--llm",
-        default="qwen3",
-        choices=["gemini", "gpt", "claude", "deepseek", "qwen3"],
-        help="LLM提供商 (默认: qwen3)",
+        default=None,
+        choices=["gemini", "gpt", "claude", "deepseek", "qwen3", "auto"],
+        help="LLM提供商, auto 按延迟和健康状况在已配置的提供商间自动路由 (默认: qwen3, 恢复会话时沿用会话设置)",
     )
     parser.add_argument("--mode", default="interactive", choices=["interactive", "batch"],
                         help="运行模式 (默认: interactive)")
     parser.add_argument("--test", action="store_true",
                         help="运行测试问题")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="分块流式加载的每块行数, 适用于超大CSV (默认: 一次性加载)")
+    parser.add_argument("--engine", default=None, choices=list(ENGINES),
+                        help="生成代码使用的查询引擎: pandas 或直接查询列式存储的 duckdb / polars "
+                             "(需安装对应的包; 默认: pandas, 恢复会话时沿用会话的引擎)")
+    parser.add_argument("--no-optimize-dtypes", action="store_true",
+                        help="加载后不压缩列类型(维度类数值列降为更窄的类型)")
+    parser.add_argument("--arrow-strings", action="store_true",
+                        help="压缩列类型时将其余文本列转为Arrow字符串(需要pyarrow)")
+    parser.add_argument("--categories", action="store_true",
+                        help="压缩列类型时将低基数文本列转为category (分组需 observed=True, 写入新值前需转为字符串)")
+    parser.add_argument("--no-cubes", action="store_true",
+                        help="不提供低基数维度的预计算聚合立方体(cubes.agg)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不使用磁盘缓存(清洗后的数据集、生成的代码、执行结果)")
+    parser.add_argument("--executor", default="inprocess", choices=["inprocess", "process"],
+                        help="代码执行后端: 当前进程或隔离的工作进程池 (默认: inprocess)")
+    parser.add_argument("--exec-timeout", type=float, default=60.0,
+                        help="进程执行后端的单次执行超时秒数 (默认: 60)")
+    parser.add_argument("--exec-memory-mb", type=int, default=4096,
+                        help="进程执行后端的单进程内存上限MB (默认: 4096)")
+    parser.add_argument("--questions", default=None,
+                        help="批处理问题文件(JSONL/CSV, 字段: question, 可选 id、chain)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="批处理同时进行的问题数 (默认: 4)")
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="PROVIDER=RPS",
+                        help="按提供商限制每秒LLM请求数, 可重复指定, 如 --rate-limit qwen3=2")
+    parser.add_argument("--output", default=None,
+                        help="批处理结果JSONL路径 (默认: <问题文件>.results.jsonl)")
+    parser.add_argument("--append", action="store_true",
+                        help="批处理结果追加到已有的结果文件 (默认: 覆盖)")
+    parser.add_argument("--explain", default="sync", choices=["sync", "async", "none"],
+                        help="结果解释: sync 生成后返回; async 先返回执行结果, 解释在后台生成; none 不生成 (默认: sync)")
+    parser.add_argument("--no-explain", action="store_true",
+                        help="不生成结果解释, 等同于 --explain none (适合批处理)")
+    parser.add_argument("--hedge-after", type=float, default=None,
+                        help="--llm auto 时, 请求超过该秒数未返回则同时请求次优提供商, 取先返回者")
+    parser.add_argument("--prompt-budget", type=int, default=None,
+                        help="代码生成提示词的token预算, 超出时压缩列描述和对话历史 (默认: 按模型取值)")
+    parser.add_argument("--trace", action="store_true",
+                        help="每个问题后打印各阶段耗时、LLM调用token和代码执行CPU时间/内存峰值")
+    parser.add_argument("--trace-file", default=None,
+                        help="追踪记录输出文件, 每个问题一行 (默认: 环境变量 EXCEL_AGENT_TRACE_FILE)")
+    parser.add_argument("--trace-format", default="jsonl", choices=["jsonl", "otlp"],
+                        help="追踪文件格式: jsonl 或 otlp(OpenTelemetry OTLP JSON) (默认: jsonl)")
+    parser.add_argument("--session", default=None,
+                        help="交互模式的会话ID: 继续之前保存的对话(省略CSV路径时沿用会话的数据源), 不存在时以该ID新建")
+    parser.add_argument("--sessions", action="store_true",
+                        help="列出最近保存的会话")
     
     args = parser.parse_args()
+
+    if args.sessions:
+        print_sessions()
+        return
+    if args.csv_path is None and not args.session:
+        parser.error("请指定CSV文件路径, 或使用 --session 恢复会话")
+
+    analyzer_kwargs = {
+        "chunksize": args.chunksize,
+        "use_cache": not args.no_cache,
+        "aggregate_cubes": not args.no_cubes,
+        "optimize_dtypes": not args.no_optimize_dtypes,
+        "arrow_strings": args.arrow_strings,
+        "categories": args.categories,
+        "prompt_budget": args.prompt_budget,
+        "explain": "none" if args.no_explain else args.explain,
+        "hedge_after": args.hedge_after,
+        "trace_path": args.trace_file,
+        "trace_format": args.trace_format,
+        "trace_memory": args.trace,
+    }
+    if args.engine:
+        analyzer_kwargs["engine"] = args.engine
+    if args.rate_limit:
+        from rate_limit import parse_rate_limits
+        analyzer_kwargs["rate_limiters"] = parse_rate_limits(args.rate_limit)
+    if args.executor == "process":
+        from code_executor import ProcessCodeExecutor
+        analyzer_kwargs["executor"] = ProcessCodeExecutor(
+            timeout=args.exec_timeout,
+            memory_limit_mb=args.exec_memory_mb,
+        )
     
-    if args.test or args.mode == "batch":
-        # 测试问题
+    if args.csv_path is None or not (args.questions or args.test or args.mode == "batch"):
+        # 交互模式的对话保存为会话
+        if not args.no_cache:
+            from session_store import SessionStore
+            analyzer_kwargs["session_store"] = SessionStore()
+        elif args.csv_path is None:
+            parser.error("--no-cache 时不保存会话, 无法恢复")
+        run_interactive_mode(args.csv_path, args.llm, show_trace=args.trace, session_id=args.session, **analyzer_kwargs)
+        return
+
+    llm_provider = args.llm or "qwen3"
+    if args.questions:
+        from batch_runner import default_output_path, load_questions
+        run_batch_mode(
+            args.csv_path,
+            load_questions(args.questions),
+            llm_provider,
+            workers=args.workers,
+            output_path=args.output or default_output_path(args.questions),
+            show_trace=args.trace,
+            append=args.append,
+            **analyzer_kwargs,
+        )
+    elif args.test or args.mode == "batch":
+        # 测试问题(相互关联, 按顺序执行)
         test_questions = [
             "分析Clothing随时间变化的总销售额趋势",
             "对Bikes进行同样的分析",
             "哪些年份Components比Accessories的总销售额高?"
         ]
-        run_batch_mode(args.csv_path, test_questions, args.llm)
-    else:
-        run_interactive_mode(args.csv_path, args.llm)
+        run_batch_mode(args.csv_path, test_questions, llm_provider, output_path=args.output, show_trace=args.trace,
+                       append=args.append, **analyzer_kwargs)
 
 
 if __name__ == "__main__":
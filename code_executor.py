@@ -0,0 +1,575 @@
+"""
+生成代码的执行后端
+- sandbox_frame / copy_on_write: 基于写时复制为生成代码提供隔离的df
+- capture_output: 按执行上下文隔离的输出捕获, 多线程/asyncio并发执行时互不串扰
+- ProcessCodeExecutor: 在预先启动的工作进程中执行代码，数据集以内存映射的Arrow文件共享，
+  支持执行超时和内存(RSS)上限，超限时终止并重建工作进程
+"""
+
+import ast
+import atexit
+import builtins
+import multiprocessing as mp
+import os
+import queue
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from io import BytesIO, StringIO
+from multiprocessing.reduction import ForkingPickler
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from query_engine import close_namespace, engine_namespace, to_pandas
+from tracing import annotate, current_span, record_span
+
+
+# matplotlib中文字体
+CHINESE_FONTS = ['SimHei', 'Microsoft YaHei', 'SimSun', 'KaiTi', 'Arial Unicode MS']
+
+# 未输出任何内容时，依次尝试读取的结果变量
+RESULT_VAR_NAMES = ['result', 'output', 'answer']
+
+
+def configure_matplotlib():
+    """设置非交互式后端并配置中文字体显示"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.rcParams['font.sans-serif'] = CHINESE_FONTS
+    plt.rcParams['axes.unicode_minus'] = False
+    return plt
+
+
+_pyplot = None
+_pyplot_lock = threading.Lock()
+
+
+def get_pyplot():
+    """首次需要绘图时才导入并配置matplotlib(导入pyplot约需半秒)"""
+    global _pyplot
+    if _pyplot is None:
+        with _pyplot_lock:
+            if _pyplot is None:
+                _pyplot = configure_matplotlib()
+    return _pyplot
+
+
+def pyplot_loaded() -> bool:
+    """matplotlib.pyplot是否已导入(未导入时不可能有待捕获的图形)"""
+    return "matplotlib.pyplot" in sys.modules
+
+
+class _LazyPyplot:
+    """注入执行环境的 plt 占位对象: 首次访问属性时才导入pyplot"""
+
+    def __getattr__(self, name):
+        return getattr(get_pyplot(), name)
+
+    def __repr__(self):
+        return "<lazy matplotlib.pyplot>"
+
+
+LAZY_PYPLOT = _LazyPyplot()
+
+
+def pyplot_for(code: str):
+    """按代码是否绘图提供 plt: 绘图代码预先配置好中文字体, 其余代码提供惰性占位"""
+    return get_pyplot() if uses_plotting(code) else LAZY_PYPLOT
+
+
+def _copy_on_write_option() -> bool:
+    """pandas 2.x是否支持通过 mode.copy_on_write 选项开启写时复制"""
+    try:
+        pd.get_option("mode.copy_on_write")
+        return True
+    except Exception:
+        return False
+
+
+# pandas 3.0起写时复制(Copy-on-Write)为默认行为; 2.x只在执行生成代码期间通过选项开启
+_PANDAS_3 = int(pd.__version__.split(".")[0]) >= 3
+_COW_OPTION = not _PANDAS_3 and _copy_on_write_option()
+COPY_ON_WRITE = _PANDAS_3 or _COW_OPTION
+
+_cow_lock = threading.Lock()
+_cow_depth = 0
+_cow_previous: Any = None
+
+
+@contextmanager
+def copy_on_write() -> Iterator[None]:
+    """
+    执行生成代码期间开启写时复制(pandas 3.0起无需处理)
+
+    pandas 2.x的选项是进程级的: 第一个进入的执行上下文开启, 最后一个退出时恢复原值,
+    并发执行期间同一进程中的其他pandas代码也处于写时复制模式
+    """
+    global _cow_depth, _cow_previous
+    if not _COW_OPTION:
+        yield
+        return
+    with _cow_lock:
+        if _cow_depth == 0:
+            _cow_previous = pd.get_option("mode.copy_on_write")
+            pd.set_option("mode.copy_on_write", True)
+        _cow_depth += 1
+    try:
+        yield
+    finally:
+        with _cow_lock:
+            _cow_depth -= 1
+            if _cow_depth == 0:
+                pd.set_option("mode.copy_on_write", _cow_previous)
+
+
+def sandbox_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    为生成代码提供与原数据隔离的df
+
+    写时复制模式下返回惰性副本, 只有被修改的列才会真正复制, 修改不会影响原数据
+    (pandas 2.x上需在 copy_on_write() 内创建和使用); 不支持写时复制的旧版pandas退回深拷贝
+    """
+    if not COPY_ON_WRITE:
+        return df.copy()
+    sandbox = df.copy(deep=False)
+    # 轴对象可被原地改名(如 df.index.name = ...), 单独复制一份浅副本
+    sandbox.index = sandbox.index.copy()
+    sandbox.columns = sandbox.columns.copy()
+    return sandbox
+
+
+# 当前执行上下文的输出缓冲区; 线程和asyncio任务各自独立
+_capture_buffer: ContextVar[Optional[StringIO]] = ContextVar("capture_buffer", default=None)
+_router_lock = threading.Lock()
+
+# pyplot的图形管理是进程级全局状态, 涉及绘图的代码需串行执行
+PLOT_LOCK = threading.RLock()
+_PLOT_PATTERN = re.compile(r'\bplt\b|\bmatplotlib\b|\bsns\b|\bseaborn\b|\.plot\b|\.hist\s*\(|\.boxplot\s*\(')
+
+
+class _RoutingStdout:
+    """sys.stdout 代理: 当前上下文处于捕获状态时写入其缓冲区, 否则写入原始输出"""
+
+    def __init__(self, original):
+        self._original = original
+
+    def write(self, text):
+        buffer = _capture_buffer.get()
+        return (buffer if buffer is not None else self._original).write(text)
+
+    def flush(self):
+        buffer = _capture_buffer.get()
+        if buffer is None:
+            self._original.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._original, name)
+
+
+def _install_stdout_router():
+    """一次性将 sys.stdout 替换为按上下文路由的代理(不再在每次执行时交换全局stdout)"""
+    with _router_lock:
+        if not isinstance(sys.stdout, _RoutingStdout):
+            sys.stdout = _RoutingStdout(sys.stdout)
+
+
+@contextmanager
+def capture_output() -> Iterator[StringIO]:
+    """捕获当前执行上下文中写入 sys.stdout 的内容, 其他线程/任务的输出不受影响"""
+    _install_stdout_router()
+    buffer = StringIO()
+    token = _capture_buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _capture_buffer.reset(token)
+
+
+def make_print(buffer: StringIO):
+    """注入到执行环境的print: 默认直接写入本次执行的缓冲区"""
+    def _print(*args, file=None, **kwargs):
+        builtins.print(*args, file=buffer if file is None else file, **kwargs)
+    return _print
+
+
+def uses_plotting(code: str) -> bool:
+    """代码是否可能用到matplotlib"""
+    return bool(_PLOT_PATTERN.search(code))
+
+
+def references_name(code: str, name: str) -> bool:
+    """代码中是否用到某个变量(无法解析时按文本匹配)"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return re.search(rf'\b{re.escape(name)}\b', code) is not None
+    return any(isinstance(node, ast.Name) and node.id == name for node in ast.walk(tree))
+
+
+def tables_used(code: str, names: List[str]) -> List[str]:
+    """
+    代码通过 tables['表名'] 或 tables.get('表名') 访问的表;
+    以变量作键、遍历等无法静态确定的方式使用 tables 时视为用到全部表
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return list(names)
+    parents = {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+    used = set()
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Name) and node.id == "tables"):
+            continue
+        parent = parents.get(node)
+        key = None
+        if isinstance(parent, ast.Subscript) and parent.value is node:
+            key = parent.slice
+        elif isinstance(parent, ast.Attribute) and parent.attr == "get":
+            call = parents.get(parent)
+            if isinstance(call, ast.Call) and call.args:
+                key = call.args[0]
+        if not (isinstance(key, ast.Constant) and isinstance(key.value, str)):
+            return list(names)
+        used.add(key.value)
+    return [name for name in names if name in used]
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    """读取进程常驻内存(RSS)，无法获取时返回None"""
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+def _load_dataset(path: str) -> pd.DataFrame:
+    """以内存映射方式读取Arrow IPC文件，数值列尽量零拷贝"""
+    import pyarrow as pa
+
+    source = pa.memory_map(path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def _run_in_worker(
+    code: str,
+    df: Optional[pd.DataFrame],
+    tables: Optional[Dict[str, pd.DataFrame]] = None,
+    engine: Optional[Tuple[str, str]] = None,
+    variables: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """在工作进程中执行代码，图形序列化为PNG字节"""
+    with copy_on_write():
+        return _run_sandboxed(code, df, tables, engine, variables)
+
+
+def _run_sandboxed(
+    code: str,
+    df: Optional[pd.DataFrame],
+    tables: Optional[Dict[str, pd.DataFrame]],
+    engine: Optional[Tuple[str, str]],
+    variables: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    local_vars = {
+        'pd': pd,
+        'np': __import__('numpy'),
+        'plt': pyplot_for(code),
+        'st': None,
+    }
+    if df is not None:
+        local_vars['df'] = sandbox_frame(df)
+    if tables is not None:
+        local_vars['tables'] = {name: sandbox_frame(frame) for name, frame in tables.items()}
+    if variables:
+        local_vars.update(variables)
+
+    cpu_start = time.process_time()
+    with capture_output() as captured_output:
+        local_vars['print'] = make_print(captured_output)
+        try:
+            if engine is not None:
+                local_vars.update(engine_namespace(*engine))
+            exec(code, local_vars)
+            output = captured_output.getvalue()
+            if not output.strip():
+                for var_name in RESULT_VAR_NAMES:
+                    if var_name in local_vars:
+                        output = str(to_pandas(local_vars[var_name]))
+                        break
+            success, error = True, ""
+        except BaseException as e:
+            output = ""
+            success, error = False, f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
+        finally:
+            close_namespace(local_vars)
+    cpu_time = time.process_time() - cpu_start
+
+    figures: List[bytes] = []
+    render_start = time.perf_counter()
+    if pyplot_loaded():
+        plt = get_pyplot()
+        if success:
+            for num in plt.get_fignums():
+                buffer = BytesIO()
+                plt.figure(num).savefig(buffer, format="png", bbox_inches="tight")
+                figures.append(buffer.getvalue())
+        plt.close('all')
+
+    return {
+        "success": success, "output": output, "error": error, "figures": figures,
+        "cpu_time": cpu_time, "render_time": time.perf_counter() - render_start if figures else None,
+    }
+
+
+def _worker_main(conn):
+    """工作进程主循环: 接收 (数据集路径, {表名: 路径}, (查询引擎, Parquet路径), 其他变量, 代码)，返回执行结果"""
+    frames: Dict[str, pd.DataFrame] = {}  # 路径 -> 已映射的数据集, 只保留最近一次执行用到的
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        path, table_paths, engine, variables, code = message
+        needed = {p for p in [path, *(table_paths or {}).values()] if p}
+        for stale in set(frames) - needed:
+            del frames[stale]
+        try:
+            for p in needed - set(frames):
+                frames[p] = _load_dataset(p)
+        except Exception as e:
+            # 读取失败(文件被删除、损坏等)作为执行失败返回, 工作进程继续可用
+            conn.send({
+                "success": False, "output": "", "error": f"数据集读取失败: {type(e).__name__}: {e}",
+                "figures": [], "cpu_time": 0.0, "render_time": None,
+            })
+            continue
+
+        tables = {name: frames[p] for name, p in table_paths.items()} if table_paths is not None else None
+        conn.send(_run_in_worker(code, frames.get(path), tables, engine, variables))
+
+
+def _exit_error(process) -> str:
+    """工作进程意外退出时的错误信息; 被SIGKILL终止(通常为系统内存不足)时给出提示"""
+    code = process.exitcode
+    hint = ", 可能内存不足" if code == -getattr(signal, "SIGKILL", 9) else ""
+    return f"RuntimeError: 执行进程意外退出(退出码 {code}{hint})"
+
+
+class _Worker:
+    """单个工作进程及其通信管道"""
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        try:
+            self.process.kill()
+        except Exception:
+            pass
+        self.process.join(timeout=5)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class ProcessCodeExecutor:
+    """
+    多进程代码执行后端
+
+    工作进程在创建时预先启动并常驻; 数据集写入临时Arrow文件后由各进程内存映射读取,
+    数据变化(传入不同的df对象)时重新发布。执行超时或内存超限会终止对应工作进程并补充新进程,
+    不影响调用方进程。
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        timeout: float = 60.0,
+        memory_limit_mb: Optional[int] = 4096,
+        start_method: str = "spawn",
+    ):
+        """
+        Args:
+            workers: 工作进程数，默认为CPU核数
+            timeout: 单次执行的最长时间(秒)
+            memory_limit_mb: 单个工作进程的RSS上限(MB)，None表示不限制
+            start_method: 进程启动方式(spawn / forkserver / fork)
+        """
+        self.timeout = timeout
+        self.memory_limit = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+        self._ctx = mp.get_context(start_method)
+        self._tmpdir = tempfile.mkdtemp(prefix="excel_agent_exec_")
+        self._publish_lock = threading.Lock()
+        self._published = OrderedDict()  # id(df) -> (weakref(df), Arrow文件路径)
+        self.max_datasets = 4
+
+        self._workers = queue.Queue()
+        for _ in range(workers or os.cpu_count() or 1):
+            self._workers.put(_Worker(self._ctx))
+        self._closed = False
+        atexit.register(self.shutdown)
+
+    def _publish(self, frames: List[pd.DataFrame]) -> List[str]:
+        """
+        将数据集写为Arrow IPC文件供工作进程内存映射, 返回各文件路径
+        (同一df只写一次; 超出 max_datasets 份时删除最久未用的, 本次用到的不删除)
+        """
+        import pyarrow as pa
+
+        with self._publish_lock:
+            paths = []
+            for df in frames:
+                entry = self._published.get(id(df))
+                if entry and entry[0]() is df:
+                    self._published.move_to_end(id(df))
+                    paths.append(entry[1])
+                    continue
+
+                fd, path = tempfile.mkstemp(suffix=".arrow", dir=self._tmpdir)
+                os.close(fd)
+                table = pa.Table.from_pandas(df)
+                with pa.OSFile(path, "wb") as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                self._published[id(df)] = (weakref.ref(df), path)
+                paths.append(path)
+
+            while len(self._published) > max(self.max_datasets, len(frames)):
+                _, (_, old_path) = self._published.popitem(last=False)
+                # 已映射该文件的工作进程不受影响(POSIX)，Windows上删除失败时留待shutdown清理
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+            return paths
+
+    def execute(
+        self,
+        code: str,
+        df: Optional[pd.DataFrame],
+        tables: Optional[Dict[str, pd.DataFrame]] = None,
+        engine: Optional[Tuple[str, str]] = None,
+        variables: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[bool, str, str, Any]:
+        """
+        在工作进程中执行代码
+
+        Args:
+            code: 生成的代码
+            df: 代码中的 df, None 表示代码没有用到
+            tables: 多表数据集中代码用到的表 {表名: DataFrame}, 在代码中以 tables 访问
+            engine: (查询引擎, Parquet路径), 工作进程按引擎直接查询列式存储(见 query_engine)
+            variables: 注入执行环境的其他变量(需可pickle, 如聚合立方体 cubes)
+
+        Returns:
+            (success, output, error, figure) - figure为最后一张图的PNG字节或None
+        """
+        if self._closed:
+            raise RuntimeError("执行器已关闭")
+
+        frames = ([df] if df is not None else []) + list((tables or {}).values())
+        paths = self._publish(frames)
+        dataset_path = paths.pop(0) if df is not None else None
+        table_paths = dict(zip(tables, paths)) if tables is not None else None
+        # 先在调用方序列化: 无法pickle的变量作为执行失败返回, 不占用也不损坏工作进程
+        try:
+            payload = ForkingPickler.dumps((dataset_path, table_paths, engine, variables, code))
+        except Exception as e:
+            return False, "", f"PicklingError: 注入执行环境的变量无法序列化: {type(e).__name__}: {e}", None
+        worker = self._workers.get()
+        healthy = False
+        # 在追踪中时采样工作进程的RSS, 记录执行期间的内存峰值
+        sample_rss = self.memory_limit or current_span() is not None
+        peak_rss = None
+        try:
+            worker.conn.send_bytes(payload)
+            deadline = time.monotonic() + self.timeout
+            while not worker.conn.poll(0.05):
+                if not worker.process.is_alive():
+                    return False, "", _exit_error(worker.process), None
+                if time.monotonic() > deadline:
+                    return False, "", f"TimeoutError: 代码执行超过{self.timeout:g}秒, 已终止", None
+                if sample_rss:
+                    rss = _rss_bytes(worker.process.pid)
+                    if rss is not None:
+                        peak_rss = max(peak_rss or 0, rss)
+                    if self.memory_limit and rss is not None and rss > self.memory_limit:
+                        return False, "", (
+                            f"MemoryError: 代码执行内存超过上限 {self.memory_limit // (1024 * 1024)}MB, 已终止"
+                        ), None
+
+            reply = worker.conn.recv()
+            healthy = True
+            if sample_rss:
+                rss = _rss_bytes(worker.process.pid)
+                if rss is not None:
+                    peak_rss = max(peak_rss or 0, rss)
+        except (EOFError, OSError) as e:
+            # 进程退出时管道先关闭, 等待进程结束后按退出码报告
+            worker.process.join(timeout=1)
+            if not worker.process.is_alive():
+                return False, "", _exit_error(worker.process), None
+            return False, "", f"RuntimeError: 与执行进程通信失败: {e}", None
+        finally:
+            if healthy and not self._closed:
+                self._workers.put(worker)
+            elif healthy:
+                worker.stop()
+            else:
+                # 异常的工作进程直接终止并补充新进程
+                worker.kill()
+                if not self._closed:
+                    self._workers.put(_Worker(self._ctx))
+
+        annotate(cpu_time=round(reply["cpu_time"], 6), peak_rss=peak_rss)
+        if reply["render_time"] is not None:
+            record_span("figure_render", reply["render_time"], figures=len(reply["figures"]))
+        figure = reply["figures"][-1] if reply["figures"] else None
+        return reply["success"], reply["output"], reply["error"], figure
+
+    def shutdown(self):
+        """停止全部工作进程并清理临时文件"""
+        if self._closed:
+            return
+        self._closed = True
+        while True:
+            try:
+                worker = self._workers.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
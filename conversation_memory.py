@@ -0,0 +1,210 @@
+"""
+有界对话记忆
+- 环形缓冲区只保留最近 max_turns 轮完整记录(问题、代码、结果、解释), 更早的轮次压缩为一行摘要
+- 超长执行结果落盘(按内容哈希命名的溢出文件), 记录中只保留开头部分和引用
+- 纠错反馈只保留最近一次的错误(截取traceback结尾), 不再无限追加
+长时间的会话(如Streamlit进程)内存占用因此有上限
+"""
+
+import hashlib
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from csv_streaming import get_store_dir
+
+
+# 默认保留的完整轮数与摘要条数
+MAX_TURNS = 20
+MAX_SUMMARIES = 50
+
+# 执行结果超过该长度时落盘, 记录中保留的开头长度
+MAX_RESULT_CHARS = 2000
+
+# 纠错反馈中保留的错误信息长度(traceback的关键信息在结尾)
+MAX_ERROR_CHARS = 4000
+
+# 摘要中问题与结果的最大长度
+SUMMARY_CHARS = 80
+
+# 溢出文件引用计数(同一进程内多个会话可能引用同一内容)
+_spill_refs: Dict[str, int] = {}
+_spill_lock = threading.Lock()
+
+
+def summarize_turn(entry: Dict[str, Any]) -> str:
+    """一轮对话的单行摘要: 问题 → 结果首行"""
+    question = " ".join(entry["question"].split())[:SUMMARY_CHARS]
+    lines = [line.strip() for line in (entry.get("result") or "").splitlines() if line.strip()]
+    outcome = lines[0][:SUMMARY_CHARS] if lines else "(无输出)"
+    return f"{question} → {outcome}"
+
+
+class ConversationMemory:
+    """一个会话的对话记忆"""
+
+    def __init__(
+        self,
+        max_turns: int = MAX_TURNS,
+        max_summaries: int = MAX_SUMMARIES,
+        max_result_chars: int = MAX_RESULT_CHARS,
+        spill_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            max_turns: 保留完整记录的最近轮数
+            max_summaries: 保留的更早轮次摘要条数
+            max_result_chars: 执行结果超过该长度时落盘, 记录中只保留开头部分
+            spill_dir: 溢出文件目录, 默认为数据存储目录下的 memory
+        """
+        if max_turns < 1:
+            raise ValueError("max_turns 至少为1")
+        self.max_turns = max_turns
+        self.max_summaries = max_summaries
+        self.max_result_chars = max_result_chars
+        self.spill_dir = spill_dir or os.path.join(get_store_dir(), "memory")
+        self._turns: Deque[Dict[str, Any]] = deque()
+        self._summaries: Deque[str] = deque(maxlen=max_summaries)
+        self.last_error: Optional[Dict[str, str]] = None
+        self.total_turns = 0
+        self._lock = threading.Lock()  # 后台解释线程会读取状态用于会话持久化
+
+    def fork(self) -> "ConversationMemory":
+        """配置相同的空记忆(用于独立会话)"""
+        return ConversationMemory(self.max_turns, self.max_summaries, self.max_result_chars, self.spill_dir)
+
+    @property
+    def turns(self) -> List[Dict[str, Any]]:
+        """最近的完整记录(按时间顺序), 每条包含 question/code/result/explanation"""
+        with self._lock:
+            return list(self._turns)
+
+    @property
+    def summaries(self) -> List[str]:
+        """已移出环形缓冲区的更早轮次摘要(按时间顺序)"""
+        with self._lock:
+            return list(self._summaries)
+
+    def add_turn(self, question: str, code: str, result: str, explanation: str) -> Dict[str, Any]:
+        """
+        记录一轮成功的问答, 返回记录(后台生成的解释完成后可直接更新其 explanation)
+
+        超长结果落盘, 记录中的 result 为开头部分, result_ref 为溢出文件的内容哈希
+        """
+        entry = {"question": question, "code": code, "result": result, "explanation": explanation}
+        if len(result) > self.max_result_chars:
+            entry["result_ref"] = self._spill(result)
+            entry["result"] = result[:self.max_result_chars] + f"\n...(共{len(result)}字符, 完整结果已另存)"
+
+        with self._lock:
+            self._turns.append(entry)
+            self.total_turns += 1
+            self.last_error = None
+            self._trim()
+        return entry
+
+    def record_error(self, code: str, error: str):
+        """记录最近一次执行失败, 供重试时反馈给LLM"""
+        if len(error) > MAX_ERROR_CHARS:
+            error = "..." + error[-MAX_ERROR_CHARS:]
+        self.last_error = {"code": code, "error": error}
+
+    def result_text(self, entry: Dict[str, Any]) -> str:
+        """记录的完整执行结果(溢出文件已被清理时返回保留的开头部分)"""
+        ref = entry.get("result_ref")
+        if not ref:
+            return entry["result"]
+        try:
+            with open(self._spill_path(ref), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return entry["result"]
+
+    def clear(self):
+        with self._lock:
+            for entry in self._turns:
+                self._release(entry)
+            self._turns.clear()
+            self._summaries.clear()
+            self.last_error = None
+            self.total_turns = 0
+
+    def state(self) -> Dict[str, Any]:
+        """可JSON序列化的记忆内容(溢出文件只保存引用), 见 load_state"""
+        with self._lock:
+            return {
+                "turns": [dict(entry) for entry in self._turns],
+                "summaries": list(self._summaries),
+                "total_turns": self.total_turns,
+            }
+
+    def load_state(self, state: Dict[str, Any]):
+        """恢复 state() 保存的内容, 按当前的容量上限截断"""
+        self.clear()
+        with self._lock:
+            self._summaries.extend(state.get("summaries", []))
+            for entry in state.get("turns", []):
+                entry = dict(entry)
+                if entry.get("result_ref"):
+                    self._retain(self._spill_path(entry["result_ref"]))
+                self._turns.append(entry)
+            self._trim()
+            self.total_turns = max(state.get("total_turns", 0), len(self._turns))
+
+    def stats(self) -> Dict[str, int]:
+        """当前占用: 完整轮数、摘要条数、落盘结果数及记录中文本的字符数"""
+        turns = self.turns
+        chars = sum(len(entry["code"]) + len(entry["result"]) + len(entry["explanation"] or "") for entry in turns)
+        return {
+            "turns": len(turns),
+            "summaries": len(self._summaries),
+            "spilled": sum(1 for entry in turns if entry.get("result_ref")),
+            "chars": chars,
+            "total_turns": self.total_turns,
+        }
+
+    def _trim(self):
+        """移出超出容量的最早轮次(调用方持有锁)"""
+        while len(self._turns) > self.max_turns:
+            entry = self._turns.popleft()
+            self._summaries.append(summarize_turn(entry))
+            self._release(entry)
+
+    def _spill_path(self, ref: str) -> str:
+        return os.path.join(self.spill_dir, f"{ref}.txt")
+
+    def _spill(self, text: str) -> str:
+        ref = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with _spill_lock:
+            path = self._spill_path(ref)
+            if not os.path.exists(path):
+                os.makedirs(self.spill_dir, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(tmp_path, path)
+        self._retain(path)
+        return ref
+
+    @staticmethod
+    def _retain(path: str):
+        with _spill_lock:
+            _spill_refs[path] = _spill_refs.get(path, 0) + 1
+
+    def _release(self, entry: Dict[str, Any]):
+        """记录被移出时删除不再被引用的溢出文件"""
+        ref = entry.get("result_ref")
+        if not ref:
+            return
+        path = self._spill_path(ref)
+        with _spill_lock:
+            count = _spill_refs.get(path, 0) - 1
+            if count > 0:
+                _spill_refs[path] = count
+                return
+            _spill_refs.pop(path, None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,191 @@
+"""
+CSV分块流式加载
+按块读取大CSV文件，逐块清理后写入磁盘上的列式存储(Parquet)，
+保证写入过程中的内存峰值与文件大小无关(之后由调用方决定整体读入内存, 还是由查询引擎直接查询列式存储)
+"""
+
+import hashlib
+import os
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+
+
+# 默认每块读取的行数
+DEFAULT_CHUNKSIZE = 200_000
+
+
+def get_store_dir() -> str:
+    """获取列式存储/缓存目录(可通过 EXCEL_AGENT_CACHE_DIR 配置)"""
+    store_dir = os.getenv("EXCEL_AGENT_CACHE_DIR", ".excel_agent_cache")
+    os.makedirs(store_dir, exist_ok=True)
+    return store_dir
+
+
+def default_store_path(source: Any) -> str:
+    """
+    根据数据源生成默认的Parquet存储路径: 文件名 + 数据源标识的哈希
+    (路径取绝对路径, 上传文件取内容), 不同目录下的同名文件互不覆盖
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    if isinstance(source, (str, os.PathLike)):
+        name = os.fspath(source)
+        digest.update(os.path.abspath(name).encode("utf-8"))
+    else:
+        name = getattr(source, "name", "upload")
+        digest.update(source.getvalue() if hasattr(source, "getvalue") else str(name).encode("utf-8"))
+    stem = os.path.splitext(os.path.basename(str(name)))[0] or "dataset"
+    return os.path.join(get_store_dir(), f"{stem}-{digest.hexdigest()}.parquet")
+
+
+def stream_csv_to_parquet(
+    source: Any,
+    store_path: str,
+    clean_chunk: Callable[[pd.DataFrame, Optional[Dict[str, str]]], Dict[str, str]],
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    progress_callback: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    分块读取CSV并写入Parquet文件
+
+    Args:
+        source: CSV文件路径或文件对象
+        store_path: 输出的Parquet文件路径
+        clean_chunk: 清理函数 clean_chunk(chunk, rules) -> rules，
+            首块时 rules 为 None，由其推断清理规则；后续各块沿用同一规则，保证列类型一致;
+            首块为整数的列在后续块中出现小数时放宽为float64, 首块全空的列取第一个有值的块的类型
+            (已写入的部分随之转换)
+        chunksize: 每块行数
+        progress_callback: 进度回调，参数为已加载的行数
+
+    Returns:
+        写入的总行数
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("分块加载需要 pyarrow，请先执行: pip install pyarrow")
+
+    tmp_path = store_path + ".tmp"
+    writer = None
+    schema = None
+    rules = None
+    rows_loaded = 0
+
+    try:
+        for chunk in pd.read_csv(source, chunksize=chunksize, low_memory=False):
+            rules = clean_chunk(chunk, rules)
+
+            if writer is None:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                # 首块中全为空的列无法推断类型, 先按空类型写入, 在第一个有值的块中确定类型
+                for i, field in enumerate(schema):
+                    if chunk[field.name].isna().all():
+                        schema = schema.set(i, pa.field(field.name, pa.null()))
+                writer = pq.ParquetWriter(tmp_path, schema, compression="snappy")
+
+            widened = _widen_schema(chunk, schema)
+            if widened is not None:
+                writer.close()
+                writer = _rewrite_with_schema(tmp_path, widened)
+                schema = widened
+            _conform_chunk(chunk, schema)
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            writer.write_table(table)
+
+            rows_loaded += len(chunk)
+            if progress_callback:
+                progress_callback(rows_loaded)
+            else:
+                print(f"\r  - 已加载行数: {rows_loaded}", end="", flush=True)
+
+        if writer is None:
+            raise ValueError("CSV文件为空")
+        writer.close()
+    except Exception:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if not progress_callback:
+        print()
+
+    os.replace(tmp_path, store_path)
+    return rows_loaded
+
+
+def _conform_chunk(chunk: pd.DataFrame, schema) -> None:
+    """将后续块的列类型对齐到首块推断出的schema(各块独立推断类型，可能不一致)"""
+    import pyarrow as pa
+
+    for field in schema:
+        col = field.name
+        if col not in chunk.columns:
+            continue
+        series = chunk[col]
+        if pa.types.is_null(field.type):
+            chunk[col] = pd.Series(None, index=chunk.index, dtype=object)
+        elif pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            if not (series.dtype == 'object' or pd.api.types.is_string_dtype(series.dtype)):
+                chunk[col] = series.astype(str).where(series.notna(), None)
+        elif pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            if not pd.api.types.is_numeric_dtype(series.dtype):
+                chunk[col] = pd.to_numeric(series, errors='coerce')
+
+
+def _widen_schema(chunk: pd.DataFrame, schema):
+    """
+    按本块放宽schema: 整数列出现小数(包括本块按文本读入、转为数值后的小数)时放宽为float64,
+    空类型的列(之前的块全为空)取本块推断的类型
+
+    Returns:
+        新的schema, 无需放宽时返回None
+    """
+    import pyarrow as pa
+
+    widened = schema
+    for i, field in enumerate(schema):
+        if field.name not in chunk.columns:
+            continue
+        series = chunk[field.name]
+        if pa.types.is_null(field.type):
+            if series.notna().any():
+                inferred = pa.Schema.from_pandas(chunk[[field.name]], preserve_index=False).field(field.name)
+                widened = widened.set(i, pa.field(field.name, inferred.type))
+            continue
+        if pa.types.is_integer(field.type) and not pd.api.types.is_integer_dtype(series.dtype):
+            if pd.api.types.is_float_dtype(series.dtype):
+                values = series.dropna()
+            elif not pd.api.types.is_numeric_dtype(series.dtype):
+                # 本块含无法解析的值时按文本读入, 写入时转为数值(无法解析的为缺失值), 在此按转换后的值判断
+                values = pd.to_numeric(series, errors='coerce').dropna()
+            else:
+                continue
+            # 整数值(含缺失值)仍可按整数列写入
+            if not (values == values.round()).all():
+                widened = widened.set(i, pa.field(field.name, pa.float64()))
+    return None if widened is schema else widened
+
+
+def _rewrite_with_schema(path: str, schema):
+    """按新的schema逐批重写已写入的Parquet文件(内存只保留一批), 返回可继续写入的writer"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    old_path = path + ".old"
+    os.replace(path, old_path)
+    writer = pq.ParquetWriter(path, schema, compression="snappy")
+    try:
+        source = pq.ParquetFile(old_path)
+        for batch in source.iter_batches():
+            writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+        source.close()
+    except Exception:
+        writer.close()
+        raise
+    finally:
+        os.remove(old_path)
+    return writer
@@ -3,188 +3,666 @@
 支持对话历史、代码生成、错误纠正和自然语言解释
 """
 
+import asyncio
+import contextvars
+import copy
 import os
 import re
 import sys
+import threading
+import time
 import traceback
-from io import StringIO
-from typing import Dict, List, Tuple, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import replace
+from typing import Callable, Dict, List, Tuple, Any, Optional
 
 import pandas as pd
 from dotenv import load_dotenv
 
-# 设置matplotlib非交互式后端，支持Streamlit环境
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
-# 配置中文字体显示
-plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'SimSun', 'KaiTi', 'Arial Unicode MS']
-plt.rcParams['axes.unicode_minus'] = False
-
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
+from aggregate_cube import AggregateCubes
+from code_executor import (
+    PLOT_LOCK,
+    RESULT_VAR_NAMES,
+    capture_output,
+    copy_on_write,
+    get_pyplot,
+    make_print,
+    pyplot_for,
+    pyplot_loaded,
+    references_name,
+    sandbox_frame,
+    tables_used,
+    uses_plotting,
+)
+from conversation_memory import ConversationMemory
+from csv_streaming import DEFAULT_CHUNKSIZE, default_store_path, stream_csv_to_parquet
+from dataset_cache import DatasetCache
+from dataset_catalog import SAMPLE_ROWS, DatasetCatalog, is_catalog_source
+from dataset_profile import DatasetProfile
+from dtype_optimizer import format_memory_report, optimize_dtypes
+from execution_cache import ExecutionCache, figure_bytes
+from llm_registry import get_client
+from prompt_builder import PromptBuilder, budget_for, estimate_tokens
+from query_engine import (
+    check_engine,
+    close_namespace,
+    engine_namespace,
+    example_code,
+    prompt_rules,
+    to_pandas,
+)
+from provider_router import (
+    FAILOVER_ERRORS,
+    ProviderRouter,
+    available_providers,
+    classify_error,
+    get_health,
+    rank_providers,
+)
+from response_cache import CodeCache, history_digest
+from session_store import SessionStore, StoredUpload, is_upload, new_session_id, source_name, source_stat
+from tracing import Trace, TraceExporter, increment, measure_resources, span
+from type_inference import KIND_LABELS, clean_dataframe, format_report
 
 try:
-    from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+    from langchain_core.messages import HumanMessage, SystemMessage
 except Exception:
-    from langchain.schema import HumanMessage, AIMessage, SystemMessage
+    from langchain.schema import HumanMessage, SystemMessage
 
 load_dotenv()
 
+# 当前提问的token用量累计字典(按线程/asyncio任务隔离)
+_current_tokens: ContextVar[Optional[Dict[str, int]]] = ContextVar("current_tokens", default=None)
+
+# 解释生成模式
+EXPLAIN_MODES = ("sync", "async", "none")
+
+# 后台生成解释的线程池, 所有分析器(会话)共用, 首次使用时创建
+_explain_pool: Optional[ThreadPoolExecutor] = None
+_explain_pool_lock = threading.Lock()
+
+
+def _get_explain_pool() -> ThreadPoolExecutor:
+    """共用的解释线程池; 线程数取 ThreadPoolExecutor 的默认值(解释生成以等待LLM响应为主)"""
+    global _explain_pool
+    with _explain_pool_lock:
+        if _explain_pool is None:
+            _explain_pool = ThreadPoolExecutor(thread_name_prefix="explain")
+        return _explain_pool
+
+# 已闭合的代码块(流式输出时据此提前结束读取)
+_CLOSED_CODE_BLOCK = re.compile(r'```(?:python)?[^\n]*\n(.*?)```', re.DOTALL)
+
+
+def _has_closed_code_block(text: str) -> bool:
+    return _CLOSED_CODE_BLOCK.search(text) is not None
+
+
+def _chunk_text(content: Any) -> str:
+    """提取消息内容中的文本(部分提供商以内容块列表返回)"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part if isinstance(part, str) else part.get("text", "")
+            for part in content
+            if isinstance(part, (str, dict))
+        )
+    return str(content or "")
+
 
 class DataAnalyzer:
     """数据分析器,支持对话历史和代码纠错"""
     
-    def __init__(self, csv_path: str, llm_provider: str = "gemini"):
+    def __init__(
+        self,
+        csv_path: str,
+        llm_provider: str = "gemini",
+        chunksize: Optional[int] = None,
+        progress_callback: Optional[Callable[[int], None]] = None,
+        use_cache: bool = True,
+        executor: Any = None,
+        llm: Any = None,
+        rate_limiters: Optional[Dict[str, Any]] = None,
+        code_cache: Any = None,
+        prompt_budget: Optional[int] = None,
+        streaming: bool = True,
+        explain: str = "sync",
+        hedge_after: Optional[float] = None,
+        trace_path: Optional[str] = None,
+        trace_format: str = "jsonl",
+        trace_memory: bool = False,
+        memory: Optional[ConversationMemory] = None,
+        session_store: Optional[SessionStore] = None,
+        session_id: Optional[str] = None,
+        engine: str = "pandas",
+        aggregate_cubes: bool = True,
+        optimize_dtypes: bool = True,
+        arrow_strings: bool = False,
+        categories: bool = False,
+        execution_cache: Any = None,
+    ):
         """
         初始化数据分析器
         
         Args:
-            csv_path: CSV文件路径
-            llm_provider: LLM提供商 (gemini, gpt, claude, deepseek, qwen3)
+            csv_path: CSV文件路径; 也可以是目录、多个文件的列表、Excel工作簿或 DatasetCatalog,
+                此时各文件/工作表注册为命名表(见 dataset_catalog), 生成的代码用到某张表时才加载
+            llm_provider: LLM提供商 (gemini, gpt, claude, deepseek, qwen3, auto - 按延迟和健康状况自动路由)
+            chunksize: 分块加载的每块行数; 设置后启用流式加载, 逐块清理并写入Parquet列式存储
+            progress_callback: 分块加载进度回调, 参数为已加载行数
+            use_cache: 是否使用磁盘缓存(清洗后的数据集、生成的代码、执行结果)
+            executor: 代码执行后端(如 ProcessCodeExecutor), 需提供 execute(code, df, tables=None); 默认在当前进程内执行
+            llm: 直接使用的LLM客户端(需提供 invoke), 传入时不再按 llm_provider 初始化, 主要用于测试
+            rate_limiters: 按提供商的限速器 {provider: RateLimiter}, 每次LLM调用前等待
+            code_cache: 生成代码的缓存(CodeCache), 默认在 use_cache 时使用本地持久化缓存
+            prompt_budget: 代码生成提示词的token预算, 默认按提供商取值(见 prompt_builder.PROVIDER_BUDGETS)
+            streaming: 是否流式读取LLM输出(代码块闭合即开始执行, 解释可逐段回调)
+            explain: 解释模式 - sync: 生成解释后返回; async: 执行成功即返回, 解释在后台生成; none: 不生成解释
+            hedge_after: llm_provider="auto" 时的对冲等待秒数, 请求超过该时间未返回时同时请求次优提供商
+            trace_path: 追踪记录的输出文件, 每个问题一行(默认读取环境变量 EXCEL_AGENT_TRACE_FILE, 未设置时不导出)
+            trace_format: 追踪文件格式 - jsonl 或 otlp(OpenTelemetry OTLP JSON)
+            trace_memory: 是否用tracemalloc记录代码执行的内存峰值(会使执行变慢)
+            memory: 对话记忆(ConversationMemory), 默认保留最近20轮完整记录, 更早的压缩为摘要
+            session_store: 会话存储(SessionStore), 设置后在加载数据和每个问题完成后保存会话状态
+            session_id: 会话ID, 默认生成新ID; 存储中已有该会话且数据源相同时恢复对话记忆,
+                数据未变化时直接引用列式存储(不重新读取CSV, DataFrame在首次执行代码时加载)
+            engine: 生成代码使用的查询引擎 - pandas: 内存中的 df; duckdb / polars: 以DuckDB关系 / Polars LazyFrame
+                直接查询列式存储, 数据不整体载入内存(需安装对应的包, 见 query_engine)
+            aggregate_cubes: 是否为低基数维度列提供预计算的聚合立方体 cubes(见 aggregate_cube),
+                生成的代码可直接查询分组汇总而不扫描数据; 只用于pandas引擎的单表数据集
+            optimize_dtypes: 加载后压缩列类型(维度类数值列无损降为更窄的类型, 见 dtype_optimizer)
+            arrow_strings: 压缩列类型时将其余文本列转为Arrow字符串(需要pyarrow)
+            categories: 压缩列类型时将低基数文本列转为category(提示词中说明 observed=True 等用法)
+            execution_cache: 代码执行结果的缓存(ExecutionCache), 默认在 use_cache 时使用本地持久化缓存;
+                相同的代码在未变化的数据上再次执行时直接返回缓存的输出和图形
         """
+        self.chunksize = chunksize
+        self.engine = check_engine(engine)
+        self.progress_callback = progress_callback
+        self.dataset_cache = DatasetCache() if use_cache and DatasetCache.is_available() else None
+        self.catalog = None  # 多表数据集
+        if is_catalog_source(csv_path):
+            self.catalog = csv_path if isinstance(csv_path, DatasetCatalog) else DatasetCatalog.from_sources(
+                csv_path, dataset_cache=self.dataset_cache
+            )
+            if self.catalog.dataset_cache is None:
+                # 传入的目录(如恢复会话时按记录重建的)没有磁盘缓存时使用分析器的缓存, 否则执行结果也无法缓存
+                self.catalog.dataset_cache = self.dataset_cache
+            csv_path = self.catalog.name
+            if self.engine != "pandas":
+                raise ValueError(f"多表数据集暂只支持pandas引擎, 不支持 {self.engine}")
         self.csv_path = csv_path
-        self.df = self._load_csv(csv_path)
-        self.llm = self._init_llm(llm_provider)
-        self.conversation_history = []
-        self.execution_history = []
+        self.cache_key = None  # 数据源指纹
+        self.store_path = None  # 数据的列式存储路径(分块加载或缓存)
+        self.clean_report = []  # 逐列清理报告
+        self.optimize_dtypes = optimize_dtypes
+        self.arrow_strings = arrow_strings
+        self.categories = categories
+        self.memory_report = None  # 列类型压缩前后的内存占用
+        self.executor = executor
+        self.rate_limiters = rate_limiters or {}
+        self.code_cache = code_cache if code_cache is not None else (CodeCache() if use_cache else None)
+        self.execution_cache = execution_cache if execution_cache is not None else (ExecutionCache() if use_cache else None)
+        self.prompt_budget = prompt_budget
+        self.streaming = streaming
+        self.explain = explain
+        self._explain_mode(explain)  # 校验解释模式
+        self.hedge_after = hedge_after
+        trace_path = trace_path or os.getenv("EXCEL_AGENT_TRACE_FILE")
+        self.trace_exporter = TraceExporter(trace_path, trace_format) if trace_path else None
+        self.trace_memory = trace_memory
+        self.memory = memory if memory is not None else ConversationMemory()
+        self.session_store = session_store if session_store is not None else (SessionStore() if session_id else None)
+        self.session_id = session_id or (new_session_id() if self.session_store else None)
+        self._df_lock = threading.Lock()
+        record = self._find_session(session_id)
+        if self.catalog is not None:
+            self._load_catalog()
+        elif record and self._restore_dataset(record):
+            pass
+        elif isinstance(csv_path, StoredUpload):
+            raise FileNotFoundError(f"上传文件 {csv_path} 的会话数据已被清理, 请重新上传")
+        elif self.engine != "pandas":
+            self._open_store(csv_path)
+        else:
+            self.df = self._load_csv(csv_path)
+            with self._load_stage("profile"):
+                self._profile = DatasetProfile.build(self.df)  # 加载时一次性计算数据集概要
+        self.cubes = self._init_cubes() if aggregate_cubes else None
+        if llm is not None:
+            self.llm = llm
+            self.current_provider = llm_provider.lower()
+        else:
+            self.llm = self._init_llm(llm_provider)
+        if record:
+            self.memory.load_state(record["state"].get("memory", {}))
+            print(f"✓ 已恢复会话 {self.session_id}: {self.memory.total_turns} 轮对话")
+        self._save_session()
+
+    @classmethod
+    def resume(cls, session_id: str, session_store: Optional[SessionStore] = None, **kwargs) -> "DataAnalyzer":
+        """
+        按会话ID恢复分析器(数据源和LLM提供商取自会话记录, 可用 llm_provider 覆盖)
+
+        Raises:
+            KeyError: 会话不存在
+            FileNotFoundError: 上传文件的会话引用的列式存储已被清理
+        """
+        session_store = session_store or SessionStore()
+        record = session_store.load(session_id)
+        if record is None:
+            raise KeyError(f"会话不存在: {session_id}")
+        kwargs.setdefault("llm_provider", record["provider"] or "gemini")
+        kwargs.setdefault("engine", record["state"].get("engine", "pandas"))
+        spec = record["state"].get("catalog")
+        if spec:
+            source = DatasetCatalog.from_spec(spec)
+        elif record["state"].get("dataset", {}).get("upload"):
+            # 上传的文件只能从会话引用的列式存储恢复
+            source = StoredUpload(record["source"])
+        else:
+            source = record["source"]
+        return cls(source, session_store=session_store, session_id=session_id, **kwargs)
+
+    @property
+    def execution_history(self) -> List[Dict[str, Any]]:
+        """对话记忆中最近的完整记录(question/code/result/explanation)"""
+        return self.memory.turns
         
+    def _source(self) -> Any:
+        """会话记录中的数据源: 多表数据集为目录本身"""
+        return self.catalog if self.catalog is not None else self.csv_path
+
+    def _source_name(self) -> str:
+        """会话记录中的数据源标识(上传文件需计算内容指纹, 只计算一次)"""
+        if getattr(self, "_source_id", None) is None:
+            self._source_id = source_name(self._source())
+        return self._source_id
+
+    def _find_session(self, session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        读取要恢复的会话记录; 会话不存在或数据源不同时返回None
+
+        数据源不同时改用新的会话ID, 避免覆盖原会话的记录
+        """
+        if not session_id:
+            return None
+        record = self.session_store.load(session_id)
+        if record is None:
+            return None
+        if record["source"] != self._source_name():
+            self.session_id = new_session_id()
+            print(f"⚠ 会话 {session_id} 的数据源为 {record['source']}, 将以新会话 {self.session_id} 开始对话")
+            return None
+        return record
+
+    def _restore_dataset(self, record: Dict[str, Any]) -> bool:
+        """引用会话保存的列式存储和数据集概要; 源文件已修改或存储已被清理时返回False(重新加载)"""
+        dataset = record["state"].get("dataset", {})
+        store_path = dataset.get("store_path")
+        if not store_path or not os.path.exists(store_path) or record["profile"] is None:
+            print("⚠ 会话的数据缓存已被清理, 重新加载数据")
+            return False
+        stat = source_stat(self.csv_path)
+        if stat is not None and stat != dataset.get("source_stat"):
+            print(f"⚠ 数据源在会话保存后已修改, 重新加载: {record['source']}")
+            return False
+
+        self.cache_key = dataset.get("cache_key")
+        self.store_path = store_path
+        self.clean_report = dataset.get("clean_report", [])
+        self.memory_report = dataset.get("memory_report")
+        self._df = None  # 首次访问 df 时从列式存储加载
+        self._profile = record["profile"]
+        print(f"✓ 从会话恢复数据: {record['source']} ({self._profile.rows} 行, 列式存储: {store_path})")
+        return True
+
+    def _load_catalog(self):
+        """多表数据集: 只读取各表的样本生成概要, 数据在代码用到时加载"""
+        with self._load_stage("catalog_profile"):
+            profiles = self.catalog.profiles()
+        print(f"✓ 已注册 {len(profiles)} 张表(按需加载):")
+        for name, profile in profiles.items():
+            print(f"  - {name}: 约{profile.rows}行, {len(profile.columns)}列")
+        self._df = None  # df 即默认表, 首次访问时加载
+        self._profile = None
+
+    def _init_cubes(self) -> Optional[AggregateCubes]:
+        """单表pandas数据集的聚合立方体: 首次使用时计算, 使用数据缓存时随缓存条目持久化"""
+        if self.catalog is not None or self.engine != "pandas":
+            return None
+        path = self.dataset_cache.cube_path(self.cache_key) if self.dataset_cache and self.cache_key else None
+        cubes = AggregateCubes(self.profile, lambda: self.df, path)
+        return cubes if cubes.available else None
+
+    def _load_stored_frame(self) -> pd.DataFrame:
+        """恢复的会话第一次用到数据时从列式存储加载"""
+        with self._load_stage("cache_load"):
+            df = self.dataset_cache.load(self.cache_key) if self.dataset_cache and self.cache_key else None
+            if df is None:
+                df = pd.read_parquet(self.store_path)
+        print(f"✓ 从列式存储加载数据: {self.store_path}")
+        return df
+
+    def _open_store(self, csv_path: Any):
+        """
+        查询引擎模式: 数据只写入(或引用已缓存的)列式存储, 不在内存中构建DataFrame;
+        概要基于开头的样本行, 行数取自Parquet元数据
+        """
+        import pyarrow.parquet as pq
+
+        meta = {}
+        store_path = None
+        if self.dataset_cache:
+            self.cache_key = self.dataset_cache.fingerprint(csv_path)
+            if self.cache_key:
+                store_path = self.dataset_cache.data_path(self.cache_key)
+                meta = self.dataset_cache.load_meta(self.cache_key)
+        if meta and os.path.exists(store_path):
+            self.clean_report = meta.get("clean_report", [])
+            print(f"✓ 从缓存引用列式存储: {csv_path}")
+        else:
+            meta = {}
+            store_path = store_path or default_store_path(csv_path)
+            chunksize = self.chunksize or DEFAULT_CHUNKSIZE
+            print(f"→ 写入列式存储 (每块 {chunksize} 行): {csv_path}")
+            with self._load_stage("stream_load"):
+                stream_csv_to_parquet(
+                    csv_path,
+                    store_path,
+                    clean_chunk=lambda chunk, rules: self._auto_clean_data(chunk, rules, verbose=rules is None),
+                    chunksize=chunksize,
+                    progress_callback=self.progress_callback,
+                )
+        self.store_path = store_path
+
+        with self._load_stage("profile"):
+            parquet = pq.ParquetFile(store_path)
+            batch = next(parquet.iter_batches(batch_size=SAMPLE_ROWS), None)
+            sample = batch.to_pandas() if batch is not None else parquet.schema_arrow.empty_table().to_pandas()
+            self._profile = replace(DatasetProfile.build(sample), rows=parquet.metadata.num_rows)
+        if not meta and self.cache_key:
+            self._save_to_cache(csv_path, sample)
+        self._df = None  # 代码用到 df 时才从列式存储加载
+        print(f"✓ 查询引擎 {self.engine}: {self._profile.rows} 行, {len(self._profile.columns)} 列, 列式存储: {store_path}")
+
     def _load_csv(self, csv_path: str) -> pd.DataFrame:
-        """加载CSV文件"""
+        """加载CSV文件(优先读取缓存)"""
         try:
-            df = pd.read_csv(csv_path, low_memory=False)
-            print(f"✓ 成功加载数据: {csv_path}")
-            print(f"  - 行数: {len(df)}")
-            print(f"  - 列数: {len(df.columns)}")
-            print(f"  - 列名: {', '.join(df.columns.tolist())}")
-            
-            # 自动检测并清理常见的格式问题
-            self._auto_clean_data(df)
-            
+            if self.dataset_cache:
+                self.cache_key = self.dataset_cache.fingerprint(csv_path)
+                if self.cache_key:
+                    with self._load_stage("cache_load"):
+                        df = self.dataset_cache.load(self.cache_key)
+                    if df is not None:
+                        meta = self.dataset_cache.load_meta(self.cache_key)
+                        self.store_path = self.dataset_cache.data_path(self.cache_key)
+                        self.clean_report = meta.get("clean_report", [])
+                        self.memory_report = meta.get("memory_report")
+                        print(f"✓ 从缓存加载数据: {csv_path}")
+                        print(f"  - 行数: {len(df)}")
+                        print(f"  - 列数: {len(df.columns)}")
+                        print(f"  - 列名: {', '.join(df.columns.tolist())}")
+                        if self.optimize_dtypes and self.memory_report is None:
+                            # 缓存写入时未压缩列类型
+                            with self._load_stage("optimize_dtypes"):
+                                self._optimize_dtypes(df)
+                        return df
+
+            if self.chunksize:
+                with self._load_stage("stream_load"):
+                    df = self._load_csv_streaming(csv_path)
+            else:
+                with self._load_stage("read_csv"):
+                    df = pd.read_csv(csv_path, low_memory=False)
+                print(f"✓ 成功加载数据: {csv_path}")
+                print(f"  - 行数: {len(df)}")
+                print(f"  - 列数: {len(df.columns)}")
+                print(f"  - 列名: {', '.join(df.columns.tolist())}")
+                
+                # 自动检测并清理常见的格式问题
+                with self._load_stage("clean"):
+                    self._auto_clean_data(df)
+
+            if self.optimize_dtypes:
+                with self._load_stage("optimize_dtypes"):
+                    self._optimize_dtypes(df)
+            with self._load_stage("cache_save"):
+                self._save_to_cache(csv_path, df)
             return df
         except Exception as e:
             raise Exception(f"无法加载CSV文件 {csv_path}: {str(e)}")
+
+    @contextmanager
+    def _load_stage(self, name: str):
+        """加载阶段的追踪(在 Trace.activate() 中构造分析器时记录耗时、CPU时间与内存峰值)"""
+        with span(name), measure_resources(memory=self.trace_memory):
+            yield
+
+    def _load_csv_streaming(self, csv_path: str) -> pd.DataFrame:
+        """
+        分块流式加载CSV: 逐块清理后写入Parquet, 再从列式存储整体读入内存
+
+        分块只降低解析和清理阶段的内存峰值(不同时持有原始文本列和清理后的列),
+        pandas引擎最终仍持有完整的DataFrame; 数据超出内存时使用 engine="duckdb" / "polars"
+        直接查询列式存储(见 _open_store)
+        """
+        print(f"→ 分块加载数据 (每块 {self.chunksize} 行): {csv_path}")
+        if self.cache_key:
+            # 直接写入缓存目录, 避免再复制一份
+            store_path = self.dataset_cache.data_path(self.cache_key)
+        else:
+            store_path = default_store_path(csv_path)
+        rows = stream_csv_to_parquet(
+            csv_path,
+            store_path,
+            clean_chunk=lambda chunk, rules: self._auto_clean_data(chunk, rules, verbose=rules is None),
+            chunksize=self.chunksize,
+            progress_callback=self.progress_callback,
+        )
+        self.store_path = store_path
+
+        df = pd.read_parquet(store_path)
+        print(f"✓ 成功加载数据: {csv_path}")
+        print(f"  - 行数: {rows}")
+        print(f"  - 列数: {len(df.columns)}")
+        print(f"  - 列名: {', '.join(df.columns.tolist())}")
+        print(f"  - 列式存储: {store_path}")
+        return df
+
+    def _optimize_dtypes(self, df: pd.DataFrame):
+        """压缩列类型(原地修改)并记录前后的内存占用"""
+        self.memory_report = optimize_dtypes(df, arrow_strings=self.arrow_strings, categories=self.categories)
+        if self.memory_report["columns"]:
+            print(f"  - 内存优化: {format_memory_report(self.memory_report)}")
+
+    def _save_to_cache(self, csv_path: str, df: pd.DataFrame):
+        """将清洗后的数据写入缓存, 失败不影响正常加载"""
+        if not (self.dataset_cache and self.cache_key):
+            return
+        extra = {"clean_report": self.clean_report, "memory_report": self.memory_report}
+        try:
+            if self.store_path == self.dataset_cache.data_path(self.cache_key):
+                self.dataset_cache.commit(self.cache_key, df, csv_path, extra=extra)
+            else:
+                self.store_path = self.dataset_cache.save(self.cache_key, df, csv_path, extra=extra)
+        except Exception as e:
+            print(f"⚠ 写入数据缓存失败: {e}")
     
     def _init_llm(self, provider: str):
-        """根据提供商名称初始化LLM客户端"""
+        """根据提供商名称初始化LLM客户端; "auto" 使用按健康状况路由的多提供商客户端"""
         provider_key = provider.lower()
 
-        if provider_key == "gemini":
-            llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0)
-        elif provider_key == "gpt":
-            llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-        elif provider_key == "claude":
-            llm = ChatAnthropic(model_name="claude-3-opus-20240229", temperature=0)
-        elif provider_key == "deepseek":
-            api_key = os.getenv("DEEPSEEK_API_KEY")
-            if not api_key:
-                raise ValueError("未找到 DEEPSEEK_API_KEY, 请在 .env 中配置 DeepSeek API Key")
-            base_url = os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com")
-            model_name = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
-            llm = ChatOpenAI(model=model_name, temperature=0, api_key=api_key, base_url=base_url)
-        elif provider_key in {"qwen", "qwen3"}:
-            api_key = os.getenv("QWEN_API_KEY")
-            if not api_key:
-                raise ValueError("未找到 QWEN_API_KEY, 请在 .env 中配置 Qwen API Key")
-            base_url = os.getenv("QWEN_API_BASE", "https://dashscope.aliyuncs.com/compatible-mode/v1")
-            model_name = os.getenv("QWEN_MODEL", "qwen-plus")
-            llm = ChatOpenAI(model=model_name, temperature=0, api_key=api_key, base_url=base_url)
+        if provider_key == "auto":
+            providers = available_providers()
+            if not providers:
+                raise ValueError("未找到任何LLM提供商的API Key, 请在 .env 中配置")
+            llm = ProviderRouter(
+                providers,
+                client_factory=self._create_client,
+                hedge_after=self.hedge_after,
+                rate_limiters=self.rate_limiters,
+            )
+            print(f"✓ 使用LLM路由: {', '.join(providers)}")
         else:
-            raise ValueError(f"不支持的LLM提供商: {provider}")
+            llm = self._create_client(provider_key)
+            print(f"✓ 使用LLM: {provider}")
 
         # 记录当前提供商，供错误回退判断
         self.current_provider = provider_key
-        print(f"✓ 使用LLM: {provider}")
         return llm
+
+    @staticmethod
+    def _create_client(provider_key: str):
+        """获取单个提供商的LLM客户端(进程级共享, 重复切换不会重建连接)"""
+        return get_client(provider_key)
     
-    def _auto_clean_data(self, df: pd.DataFrame):
-        """自动清理数据格式问题"""
-        cleaned_cols = []
-        
-        for col in df.columns:
-            # 检查是否包含货币符号
-            if df[col].dtype == 'object':
-                sample = str(df[col].iloc[0]) if len(df) > 0 else ""
-                
-                # 清理货币格式 (如 $1,000)
-                if '$' in sample or ',' in sample:
-                    try:
-                        df[col] = df[col].astype(str).str.replace('$', '', regex=False)
-                        df[col] = df[col].str.replace(',', '', regex=False)
-                        df[col] = df[col].str.strip()
-                        # 避免 FutureWarning: 不再传递 errors='ignore'
-                        try:
-                            df[col] = pd.to_numeric(df[col])
-                        except Exception:
-                            # 失败则采用安全降级为 NaN
-                            df[col] = pd.to_numeric(df[col], errors='coerce')
-                        cleaned_cols.append(f"{col} (移除$和,)")
-                    except:
-                        pass
-                
-                # 清理百分比格式 (如 75%)
-                elif '%' in sample:
-                    try:
-                        df[col] = df[col].astype(str).str.replace('%', '', regex=False)
-                        df[col] = df[col].str.strip()
-                        try:
-                            df[col] = pd.to_numeric(df[col])
-                        except Exception:
-                            df[col] = pd.to_numeric(df[col], errors='coerce')
-                        cleaned_cols.append(f"{col} (移除%)")
-                    except:
-                        pass
-        
-        if cleaned_cols:
-            print(f"  - 自动清理列: {', '.join(cleaned_cols)}")
+    def _auto_clean_data(
+        self,
+        df: pd.DataFrame,
+        rules: Optional[Dict[str, str]] = None,
+        verbose: bool = True,
+    ) -> Dict[str, str]:
+        """
+        自动清理数据格式问题(货币、百分比、千分位数字、日期)
+
+        Args:
+            df: 待清理的数据框(原地修改)
+            rules: 已有的清理规则 {列名: 格式}; 为None时在整列范围内采样推断
+            verbose: 是否打印清理信息并记录清理报告
+
+        Returns:
+            实际使用的清理规则, 分块加载时后续各块沿用该规则
+        """
+        rules, report = clean_dataframe(df, rules)
+
+        if verbose:
+            self.clean_report = report
+            if report:
+                print(f"  - 自动清理列: {format_report(report)}")
+        return rules
+
+    def _describe_cleaning(self) -> str:
+        """描述已完成的预处理, 用于提示词"""
+        if self.catalog is not None:
+            return "各表已按推断的格式预处理过(见各表的已清洗说明)"
+        compacted = ""
+        if self.memory_report and self.memory_report["columns"]:
+            # 列类型以压缩后的为准(与数据集信息中的类型一致)
+            columns = self.memory_report["columns"]
+            hints = ["整数相乘等可能超出范围的计算先 astype('int64')"]
+            if any(item["to_dtype"] == "category" for item in columns):
+                hints.insert(0, "category列分组时加 observed=True(否则会列出筛选掉的类别), 写入新值、填充缺失值或拼接字符串前先 astype(str)")
+            compacted = (
+                "; 为节省内存, " + ",".join(f"{item['column']}为{item['to_dtype']}" for item in columns)
+                + f" ({'; '.join(hints)})"
+            )
+        if not self.clean_report:
+            return "数据未做格式转换,使用前请检查列类型" + compacted
+        parts = [
+            f"{item['column']}列已从{KIND_LABELS.get(item['kind'], item['kind'])}格式转为"
+            f"{self.profile.dtypes.get(item['column'], item['to_dtype'])}"
+            for item in self.clean_report
+        ]
+        return "数据已经预处理过:" + ",".join(parts) + compacted
     
+    @property
+    def df(self) -> pd.DataFrame:
+        if self._df is None:
+            if self.catalog is not None:
+                # 默认表由目录按最近使用保留, 不在此另外持有
+                return self.catalog.load(self.catalog.default)
+            with self._df_lock:
+                if self._df is None:
+                    self._df = self._load_stored_frame()
+        return self._df
+
+    @df.setter
+    def df(self, value: pd.DataFrame):
+        # 数据变化时概要随之失效; 替换后的数据没有可比较的版本, 不再缓存执行结果
+        if "_df" in self.__dict__:
+            self._data_replaced = True
+        self._df = value
+        self._profile = None
+
+    @property
+    def profile(self) -> DatasetProfile:
+        """数据集概要(按需计算并缓存, 替换 df 后重新计算)"""
+        if self._profile is None:
+            # 多表数据集为默认表基于样本的概要
+            self._profile = self.catalog.profile(self.catalog.default) if self.catalog else DatasetProfile.build(self.df)
+        return self._profile
+
+    @property
+    def schema_hash(self) -> str:
+        """数据结构指纹(代码缓存的作用域), 多表数据集包含全部表; 不同查询引擎生成的代码互不复用"""
+        schema = self.catalog.schema_hash if self.catalog else self.profile.schema_hash
+        return schema if self.engine == "pandas" else f"{self.engine}:{schema}"
+
     def get_dataset_info(self) -> str:
         """获取数据集信息（精简版，避免超长提示词）"""
-        info = f"""
-数据集信息:
-- 文件路径: {self.csv_path}
-- 行数: {len(self.df)}
-- 列数: {len(self.df.columns)}
-- 列名和类型:
-"""
-        for col in self.df.columns:
-            info += f"  * {col}: {self.df[col].dtype}\n"
-        
-        # 仅显示前3行且限制宽度，避免超长token
-        info += f"\n前5行数据示例:\n{self.df.head(5).to_string(max_cols=10, max_colwidth=30)}\n"
-        
-        return info
+        if self.catalog is not None:
+            return self.catalog.prompt_text()
+        return self.profile.prompt_text(self.csv_path)
     
-    def generate_code(self, question: str, max_retries: int = 3) -> Dict[str, Any]:
+    def generate_code(
+        self,
+        question: str,
+        max_retries: int = 3,
+        on_execution: Optional[Callable[[Dict[str, Any]], None]] = None,
+        on_explanation_token: Optional[Callable[[str], None]] = None,
+        explain: Optional[str] = None,
+    ) -> Dict[str, Any]:
         """
         生成Python代码来回答问题,支持自动纠错
         
         Args:
             question: 用户问题
             max_retries: 最大重试次数
+            on_execution: 代码执行成功后、生成解释前的回调, 参数为已包含代码和执行结果的result
+            on_explanation_token: 解释文本的流式回调, 每收到一段文本调用一次
+            explain: 本次提问的解释模式, 默认使用构造时的设置(见 EXPLAIN_MODES)
             
         Returns:
-            包含代码、执行结果、解释等信息的字典
+            包含代码、执行结果、解释等信息的字典; result["trace"] 为本次提问的追踪记录(tracing.Trace)
         """
-        result = {
-            "question": question,
-            "code": "",
-            "execution_result": "",
-            "explanation": "",
-            "error": None,
-            "retry_count": 0,
-            "success": False,
-            "figure": None  # 新增: 保存matplotlib图形对象
-        }
-        
-        def _format_insufficient_balance(provider: str, raw_msg: str) -> str:
-            return (
-                f"当前模型提供商({provider})返回余额或配额不足(可能是402)。\n"
-                f"请检查账户余额或更换其他模型提供商。\n"
-                f"原始错误: {raw_msg}"
-            )
+        result = self._new_result(question)
+        with result["trace"].activate():
+            self._generate(result, max_retries, on_execution, on_explanation_token, explain)
+        self._finish_trace(result)
+        return result
+
+    def _generate(
+        self,
+        result: Dict[str, Any],
+        max_retries: int,
+        on_execution: Optional[Callable[[Dict[str, Any]], None]],
+        on_explanation_token: Optional[Callable[[str], None]],
+        explain: Optional[str],
+    ):
+        """generate_code 的主体, 结果写入 result"""
+        question = result["question"]
+        _current_tokens.set(result["tokens"])
+        context = self._cache_context()
+
+        # 优先复用缓存的代码(仍需执行验证, 失败则透明地回到LLM生成)
+        cached = self._lookup_cached_code(question, context)
+        if cached:
+            success, output, error, fig = self._execute_code(cached["code"])
+            if success:
+                result["code"] = cached["code"]
+                result["cache_hit"] = cached["match"]
+                self._record_execution(result, output, fig, on_execution)
+                explanation = self._cached_explanation(cached, output, on_explanation_token)
+                if explanation:
+                    self._record_success(result, explanation)
+                else:
+                    self._explain_and_record(result, None, on_explanation_token, explain)
+                return
+            self._discard_cached_code(cached, error)
 
         for attempt in range(max_retries):
             result["retry_count"] = attempt
@@ -193,27 +671,16 @@ class DataAnalyzer:
             try:
                 code = self._generate_code_with_llm(question, attempt)
             except Exception as e:
-                err_msg = str(e)
-                if self._is_insufficient_balance_error(err_msg):
-                    fallback = self._choose_fallback_provider(exclude=getattr(self, "current_provider", None))
-                    if fallback:
-                        print(f"⚠ LLM调用失败(可能余额不足)。尝试切换到备用提供商: {fallback}")
-                        try:
-                            self.llm = self._init_llm(fallback)
-                            code = self._generate_code_with_llm(question, attempt if attempt == 0 else 0)
-                            result["explanation"] = f"已自动切换到备用提供商: {fallback}"
-                        except Exception as e2:
-                            result["error"] = _format_insufficient_balance(fallback, str(e2))
-                            result["explanation"] = result["error"]
-                            return result
-                    else:
-                        result["error"] = _format_insufficient_balance(getattr(self, "current_provider", "当前"), err_msg)
-                        result["explanation"] = result["error"]
-                        return result
-                else:
-                    result["error"] = err_msg
-                    result["explanation"] = f"LLM调用失败: {err_msg}"
-                    return result
+                fallback = self._switch_to_fallback(e, result)
+                if not fallback:
+                    return
+                try:
+                    code = self._generate_code_with_llm(question, attempt if attempt == 0 else 0)
+                    result["explanation"] = f"已自动切换到备用提供商: {fallback}"
+                except Exception as e2:
+                    result["error"] = self._format_insufficient_balance(fallback, str(e2))
+                    result["explanation"] = result["error"]
+                    return
 
             result["code"] = code
 
@@ -221,89 +688,620 @@ class DataAnalyzer:
             success, output, error, fig = self._execute_code(code)
 
             if success:
-                result["execution_result"] = output
-                result["success"] = True
-                result["figure"] = fig  # 保存图形对象
-                
+                self._record_execution(result, output, fig, on_execution)
                 # 生成自然语言解释
-                try:
-                    explanation = self._generate_explanation(question, code, output)
-                except Exception as e:
-                    explanation = f"结果生成成功，但解释生成失败: {str(e)}"
-                result["explanation"] = explanation
-
-                # 保存到历史记录
-                self._save_to_history(question, code, output, explanation)
-                return result
-            else:
-                # 代码执行失败,记录错误
-                result["error"] = error
-                print(f"\n⚠ 第 {attempt + 1} 次尝试失败: {error[:200]}")
-                if attempt < max_retries - 1:
-                    # 将错误反馈给LLM,让其纠错
-                    print("→ 正在请求LLM纠正错误...")
-                    self._add_error_to_context(code, error)
+                self._explain_and_record(result, context, on_explanation_token, explain)
+                return
+
+            self._record_failure(result, code, error, attempt, max_retries)
 
         # 所有尝试都失败
         result["explanation"] = f"抱歉,经过{max_retries}次尝试后仍无法生成正确的代码。最后的错误是: {result['error']}"
+
+    async def agenerate_code(
+        self,
+        question: str,
+        max_retries: int = 3,
+        on_execution: Optional[Callable[[Dict[str, Any]], None]] = None,
+        on_explanation_token: Optional[Callable[[str], None]] = None,
+        explain: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        generate_code 的异步版本: LLM调用使用 ainvoke, 代码执行放到线程池中, 不阻塞事件循环
+
+        同一个分析器实例共享对话历史, 并发提问时请为每个会话使用独立的 DataAnalyzer
+        """
+        result = self._new_result(question)
+        with result["trace"].activate():
+            await self._agenerate(result, max_retries, on_execution, on_explanation_token, explain)
+        self._finish_trace(result)
         return result
+
+    async def _agenerate(
+        self,
+        result: Dict[str, Any],
+        max_retries: int,
+        on_execution: Optional[Callable[[Dict[str, Any]], None]],
+        on_explanation_token: Optional[Callable[[str], None]],
+        explain: Optional[str],
+    ):
+        """agenerate_code 的主体, 结果写入 result"""
+        question = result["question"]
+        _current_tokens.set(result["tokens"])
+        loop = asyncio.get_running_loop()
+        context = self._cache_context()
+
+        cached = self._lookup_cached_code(question, context)
+        if cached:
+            success, output, error, fig = await loop.run_in_executor(
+                None, contextvars.copy_context().run, self._execute_code, cached["code"]
+            )
+            if success:
+                result["code"] = cached["code"]
+                result["cache_hit"] = cached["match"]
+                self._record_execution(result, output, fig, on_execution)
+                explanation = self._cached_explanation(cached, output, on_explanation_token)
+                if explanation:
+                    self._record_success(result, explanation)
+                else:
+                    await self._aexplain_and_record(result, None, on_explanation_token, explain)
+                return
+            self._discard_cached_code(cached, error)
+
+        for attempt in range(max_retries):
+            result["retry_count"] = attempt
+
+            try:
+                code = await self._agenerate_code_with_llm(question, attempt)
+            except Exception as e:
+                fallback = self._switch_to_fallback(e, result)
+                if not fallback:
+                    return
+                try:
+                    code = await self._agenerate_code_with_llm(question, attempt if attempt == 0 else 0)
+                    result["explanation"] = f"已自动切换到备用提供商: {fallback}"
+                except Exception as e2:
+                    result["error"] = self._format_insufficient_balance(fallback, str(e2))
+                    result["explanation"] = result["error"]
+                    return
+
+            result["code"] = code
+
+            success, output, error, fig = await loop.run_in_executor(None, contextvars.copy_context().run, self._execute_code, code)
+
+            if success:
+                self._record_execution(result, output, fig, on_execution)
+                await self._aexplain_and_record(result, context, on_explanation_token, explain)
+                return
+
+            self._record_failure(result, code, error, attempt, max_retries)
+
+        result["explanation"] = f"抱歉,经过{max_retries}次尝试后仍无法生成正确的代码。最后的错误是: {result['error']}"
+
+    def _new_result(self, question: str) -> Dict[str, Any]:
+        """创建空的分析结果字典"""
+        return {
+            "question": question,
+            "code": "",
+            "execution_result": "",
+            "explanation": "",
+            "error": None,
+            "retry_count": 0,
+            "success": False,
+            "figure": None,  # 新增: 保存matplotlib图形对象
+            # 本次提问累计的token用量; estimated_prompt_tokens 为代码生成提示词的估计值, prompt_level 为最高压缩档位,
+            # prompt_over_budget 为压缩后仍超出预算的最大token数,
+            # estimated_calls 为没有返回用量(流式读取提前结束)、prompt_tokens/completion_tokens 中按文本估算的LLM调用次数
+            "tokens": {
+                "prompt_tokens": 0, "completion_tokens": 0,
+                "estimated_prompt_tokens": 0, "prompt_level": 0, "prompt_over_budget": 0, "estimated_calls": 0,
+            },
+            "cache_hit": None,  # 命中代码缓存时为 "exact" 或 "semantic"
+            "trace": Trace("generate_code", question=question),  # 各阶段耗时、LLM调用与执行资源用量
+        }
+
+    def _finish_trace(self, result: Dict[str, Any]):
+        """结束本次提问的追踪; 解释在后台生成时, 等解释完成后再导出"""
+        trace = result["trace"]
+        trace.finish(
+            success=result["success"],
+            retry_count=result["retry_count"],
+            cache_hit=result["cache_hit"],
+            provider=self.active_provider,
+        )
+        if not self.trace_exporter:
+            self._summarize_tokens(result)
+        future = result.get("explanation_future")
+        if future is not None:
+            future.add_done_callback(lambda _: self._question_done(result))
+        else:
+            self._question_done(result)
+
+    def _question_done(self, result: Dict[str, Any]):
+        """提问(含后台解释)全部完成: 导出追踪并保存会话"""
+        if self.trace_exporter:
+            self._export_trace(result)
+        self._save_session()
+
+    @staticmethod
+    def _summarize_tokens(result: Dict[str, Any]):
+        tokens = result["tokens"]
+        result["trace"].root.set(prompt_tokens=tokens["prompt_tokens"], completion_tokens=tokens["completion_tokens"])
+
+    def _export_trace(self, result: Dict[str, Any]):
+        self._summarize_tokens(result)
+        try:
+            self.trace_exporter.export(result["trace"])
+        except Exception as e:
+            print(f"⚠ 写入追踪记录失败: {e}")
+
+    @staticmethod
+    def _record_execution(
+        result: Dict[str, Any], output: str, fig: Any, on_execution: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        """记录成功的执行结果, 并在生成解释前通知调用方"""
+        result["execution_result"] = output
+        result["success"] = True
+        result["figure"] = fig  # 保存图形对象
+        if on_execution:
+            on_execution(result)
+
+    def _record_success(self, result: Dict[str, Any], explanation: str, context: Optional[str] = None) -> Dict[str, Any]:
+        """记录解释并保存到历史记录(返回历史条目); 传入 context 时将LLM生成的代码写入缓存"""
+        result["explanation"] = explanation
+        self._cache_code(result, context)
+        return self._save_to_history(result["question"], result["code"], result["execution_result"], explanation)
+
+    def _cache_code(self, result: Dict[str, Any], context: Optional[str]):
+        if context is None or not self.code_cache:
+            return
+        try:
+            self.code_cache.put(
+                self.schema_hash, result["question"], context,
+                result["code"], result["execution_result"], result["explanation"] or None,
+            )
+        except Exception as e:
+            print(f"⚠ 写入代码缓存失败: {e}")
+
+    def _explain_mode(self, explain: Optional[str]) -> str:
+        mode = explain or self.explain
+        if mode not in EXPLAIN_MODES:
+            raise ValueError(f"未知的解释模式: {mode}, 可选: {', '.join(EXPLAIN_MODES)}")
+        return mode
+
+    def _explain_and_record(
+        self, result: Dict[str, Any], context: Optional[str], on_token: Optional[Callable[[str], None]], explain: Optional[str]
+    ):
+        """
+        按解释模式生成解释并记录
+        sync: 等待解释生成; async: 立即返回, 解释在后台线程生成, result["explanation_future"] 为 concurrent.futures.Future;
+        none: 不生成解释
+        """
+        mode = self._explain_mode(explain)
+        if mode == "sync":
+            self._record_success(result, self._explain(result["question"], result["code"], result["execution_result"], on_token), context)
+            return
+
+        entry = self._record_success(result, "", context if mode == "none" else None)
+        if mode == "async":
+            future = _get_explain_pool().submit(
+                contextvars.copy_context().run,  # 后台线程中的token用量仍计入本次提问
+                self._explain, result["question"], result["code"], result["execution_result"],
+                self._accumulate_explanation(result, on_token),
+            )
+            future.add_done_callback(lambda f: self._attach_explanation(result, entry, f.result(), context))
+            result["explanation_future"] = future
+
+    async def _aexplain_and_record(
+        self, result: Dict[str, Any], context: Optional[str], on_token: Optional[Callable[[str], None]], explain: Optional[str]
+    ):
+        """_explain_and_record 的异步版本; async 模式下 result["explanation_future"] 为 asyncio.Task"""
+        mode = self._explain_mode(explain)
+        if mode == "sync":
+            explanation = await self._aexplain(result["question"], result["code"], result["execution_result"], on_token)
+            self._record_success(result, explanation, context)
+            return
+
+        entry = self._record_success(result, "", context if mode == "none" else None)
+        if mode == "async":
+            task = asyncio.ensure_future(self._aexplain(
+                result["question"], result["code"], result["execution_result"],
+                self._accumulate_explanation(result, on_token),
+            ))
+            task.add_done_callback(
+                lambda t: None if t.cancelled() else self._attach_explanation(result, entry, t.result(), context)
+            )
+            result["explanation_future"] = task
+
+    @staticmethod
+    def _accumulate_explanation(result: Dict[str, Any], on_token: Optional[Callable[[str], None]]) -> Callable[[str], None]:
+        """后台生成解释时, 已收到的文本实时写入 result["explanation"], 界面可轮询展示"""
+        def on_text(text: str):
+            result["explanation"] += text
+            if on_token:
+                on_token(text)
+        return on_text
+
+    def _attach_explanation(self, result: Dict[str, Any], entry: Dict[str, Any], explanation: str, context: Optional[str]):
+        """后台解释完成: 更新结果、历史条目和代码缓存"""
+        result["explanation"] = explanation
+        entry["explanation"] = explanation
+        self._cache_code(result, context)
+
+    def _explain(self, question: str, code: str, output: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """生成解释, 失败时返回提示文本"""
+        with span("explanation"):
+            try:
+                return self._generate_explanation(question, code, output, on_token)
+            except Exception as e:
+                return f"结果生成成功，但解释生成失败: {str(e)}"
+
+    async def _aexplain(self, question: str, code: str, output: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        with span("explanation"):
+            try:
+                return await self._agenerate_explanation(question, code, output, on_token)
+            except Exception as e:
+                return f"结果生成成功，但解释生成失败: {str(e)}"
+
+    @staticmethod
+    def _cached_explanation(cached: Dict[str, Any], output: str, on_token: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """执行结果与缓存一致时复用缓存的解释"""
+        if not cached["explanation"] or cached["output"] != output:
+            return None
+        if on_token:
+            on_token(cached["explanation"])
+        return cached["explanation"]
+
+    def _cache_context(self) -> str:
+        """代码缓存键中的对话上下文部分(最近几轮的问题和代码)"""
+        return history_digest(self.execution_history)
+
+    def _lookup_cached_code(self, question: str, context: str) -> Optional[Dict[str, Any]]:
+        if not self.code_cache:
+            return None
+        try:
+            with span("cache_lookup") as stage:
+                cached = self.code_cache.get(self.schema_hash, question, context)
+                stage.set(hit=cached["match"] if cached else None)
+        except Exception as e:
+            print(f"⚠ 读取代码缓存失败: {e}")
+            return None
+        if cached:
+            print(f"✓ 命中代码缓存({cached['match']})")
+        return cached
+
+    def _discard_cached_code(self, cached: Dict[str, Any], error: str):
+        """缓存的代码执行失败时删除该条目"""
+        print(f"⚠ 缓存的代码执行失败, 改为调用LLM重新生成: {error[:200]}")
+        try:
+            self.code_cache.invalidate(cached["key"])
+        except Exception:
+            pass
+
+    def _record_failure(self, result: Dict[str, Any], code: str, error: str, attempt: int, max_retries: int):
+        """代码执行失败,记录错误并反馈给LLM"""
+        result["error"] = error
+        print(f"\n⚠ 第 {attempt + 1} 次尝试失败: {error[:200]}")
+        if attempt < max_retries - 1:
+            # 将错误反馈给LLM,让其纠错
+            print("→ 正在请求LLM纠正错误...")
+            self._add_error_to_context(code, error)
+
+    @staticmethod
+    def _format_insufficient_balance(provider: str, raw_msg: str) -> str:
+        return (
+            f"当前模型提供商({provider})返回余额或配额不足(可能是402)。\n"
+            f"请检查账户余额或更换其他模型提供商。\n"
+            f"原始错误: {raw_msg}"
+        )
+
+    def _switch_to_fallback(self, error: Exception, result: Dict[str, Any]) -> Optional[str]:
+        """
+        LLM调用失败时, 若为余额不足、限流或服务不可用, 则切换到当前最健康的备用提供商
+        (使用提供商路由时, 路由器已在内部完成切换, 不再回退)
+
+        Returns:
+            切换后的提供商名称; 无法回退时返回None, 并已将错误写入result
+        """
+        err_msg = str(error)
+        kind = classify_error(error)
+        if kind not in FAILOVER_ERRORS or isinstance(self.llm, ProviderRouter):
+            result["error"] = err_msg
+            result["explanation"] = f"LLM调用失败: {err_msg}"
+            return None
+
+        current = getattr(self, "current_provider", "当前")
+        fallback = self._choose_fallback_provider(exclude=current)
+        if not fallback:
+            result["error"] = self._format_insufficient_balance(current, err_msg) if kind == "payment" else err_msg
+            result["explanation"] = result["error"] if kind == "payment" else f"LLM调用失败: {err_msg}"
+            return None
+
+        reason = {"payment": "可能余额不足", "rate_limit": "被限流", "unavailable": "服务不可用"}[kind]
+        print(f"⚠ LLM调用失败({reason})。尝试切换到备用提供商: {fallback}")
+        try:
+            self.llm = self._init_llm(fallback)
+        except Exception as e2:
+            result["error"] = self._format_insufficient_balance(fallback, str(e2))
+            result["explanation"] = result["error"]
+            return None
+        return fallback
+
+    @property
+    def active_provider(self) -> Optional[str]:
+        """最近一次实际响应的提供商(使用路由时为路由器选中的提供商)"""
+        if isinstance(self.llm, ProviderRouter):
+            return self.llm.last_provider or getattr(self, "current_provider", None)
+        return getattr(self, "current_provider", None)
+
+    @contextmanager
+    def _track_health(self):
+        """单一提供商模式下记录调用延迟和错误, 回退时据此选择提供商(路由器自行统计)"""
+        if isinstance(self.llm, ProviderRouter):
+            yield
+            return
+        health = get_health(getattr(self, "current_provider", None) or "unknown")
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            health.record_failure(classify_error(e))
+            raise
+        health.record_success(time.perf_counter() - start)
+
+    def _invoke_llm(self, messages: List[Any]) -> Any:
+        """同步调用当前LLM"""
+        limiter = self.rate_limiters.get(getattr(self, "current_provider", None))
+        if limiter:
+            limiter.acquire()
+        with span("llm", streamed=False) as stage:
+            with self._track_health():
+                response = self.llm.invoke(messages)
+            stage.set(provider=self.active_provider)
+            self._record_usage(response)
+        return response
+
+    async def _ainvoke_llm(self, messages: List[Any]) -> Any:
+        """异步调用当前LLM; 客户端不支持 ainvoke 时放到线程中执行"""
+        limiter = self.rate_limiters.get(getattr(self, "current_provider", None))
+        if limiter:
+            await limiter.aacquire()
+        with span("llm", streamed=False) as stage:
+            with self._track_health():
+                if hasattr(self.llm, "ainvoke"):
+                    response = await self.llm.ainvoke(messages)
+                else:
+                    response = await asyncio.to_thread(self.llm.invoke, messages)
+            stage.set(provider=self.active_provider)
+            self._record_usage(response)
+        return response
+
+    def _can_stream(self) -> bool:
+        return self.streaming and hasattr(self.llm, "stream")
+
+    def _stream_llm(
+        self,
+        messages: List[Any],
+        on_text: Optional[Callable[[str], None]] = None,
+        until: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """
+        流式调用当前LLM
+
+        Args:
+            on_text: 每收到一段文本时的回调
+            until: 以已收到的全部文本为参数, 返回True时提前结束(不再等待剩余输出)
+
+        Returns:
+            收到的全部文本
+        """
+        limiter = self.rate_limiters.get(getattr(self, "current_provider", None))
+        if limiter:
+            limiter.acquire()
+        text = ""
+        usage_seen = False
+        start = time.perf_counter()
+        with span("llm", streamed=True) as stage, self._track_health():
+            stream = self.llm.stream(messages)
+            try:
+                for chunk in stream:
+                    usage_seen = self._record_usage(chunk) or usage_seen
+                    delta = _chunk_text(chunk.content)
+                    if not delta:
+                        continue
+                    if not text:
+                        stage.set(first_token=round(time.perf_counter() - start, 6))
+                    text += delta
+                    if on_text:
+                        on_text(delta)
+                    if until and "`" in delta and until(text):
+                        break
+            finally:
+                # 提前结束时关闭生成器, 中断底层的HTTP流
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+                stage.set(provider=self.active_provider)
+            if not usage_seen:
+                self._record_estimated_usage(messages, text, stage)
+        return text
+
+    async def _astream_llm(
+        self,
+        messages: List[Any],
+        on_text: Optional[Callable[[str], None]] = None,
+        until: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """_stream_llm 的异步版本; 客户端不支持 astream 时退回 ainvoke"""
+        if not hasattr(self.llm, "astream"):
+            response = await self._ainvoke_llm(messages)
+            text = _chunk_text(response.content)
+            if on_text and text:
+                on_text(text)
+            return text
+
+        limiter = self.rate_limiters.get(getattr(self, "current_provider", None))
+        if limiter:
+            await limiter.aacquire()
+        text = ""
+        usage_seen = False
+        start = time.perf_counter()
+        with span("llm", streamed=True) as stage, self._track_health():
+            stream = self.llm.astream(messages)
+            try:
+                async for chunk in stream:
+                    usage_seen = self._record_usage(chunk) or usage_seen
+                    delta = _chunk_text(chunk.content)
+                    if not delta:
+                        continue
+                    if not text:
+                        stage.set(first_token=round(time.perf_counter() - start, 6))
+                    text += delta
+                    if on_text:
+                        on_text(delta)
+                    if until and "`" in delta and until(text):
+                        break
+            finally:
+                aclose = getattr(stream, "aclose", None)
+                if aclose:
+                    await aclose()
+                stage.set(provider=self.active_provider)
+            if not usage_seen:
+                self._record_estimated_usage(messages, text, stage)
+        return text
+
+    @staticmethod
+    def _record_usage(response: Any) -> bool:
+        """
+        累计本次提问的token用量(LangChain的 usage_metadata), 同时记入当前LLM调用的追踪
+
+        Returns:
+            响应是否带有用量
+        """
+        metadata = getattr(response, "usage_metadata", None)
+        if not metadata:
+            return False
+        DataAnalyzer._add_usage(metadata.get("input_tokens", 0) or 0, metadata.get("output_tokens", 0) or 0)
+        return True
+
+    @staticmethod
+    def _record_estimated_usage(messages: List[Any], text: str, stage: Any):
+        """
+        流式调用没有收到用量时(用量只在最后一段返回, 代码块闭合后提前结束读取就收不到)按文本估算token,
+        并在追踪中标记 estimated
+        """
+        prompt_tokens = sum(estimate_tokens(_chunk_text(getattr(message, "content", ""))) for message in messages)
+        DataAnalyzer._add_usage(prompt_tokens, estimate_tokens(text))
+        stage.set(estimated=True)
+        usage = _current_tokens.get()
+        if usage is not None:
+            usage["estimated_calls"] += 1
+
+    @staticmethod
+    def _add_usage(prompt_tokens: int, completion_tokens: int):
+        usage = _current_tokens.get()
+        increment("prompt_tokens", prompt_tokens)
+        increment("completion_tokens", completion_tokens)
+        if usage is not None:
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
     
     def _generate_code_with_llm(self, question: str, attempt: int = 0) -> str:
-        """使用LLM生成Python代码"""
+        """使用LLM生成Python代码(流式输出时代码块一闭合即返回)"""
+        with span("code_generation", attempt=attempt):
+            messages = self._build_code_messages(question, attempt)
+            if self._can_stream():
+                content = self._stream_llm(messages, until=_has_closed_code_block)
+            else:
+                content = self._invoke_llm(messages).content
+            return self._parse_code_response(content, messages, question)
+
+    async def _agenerate_code_with_llm(self, question: str, attempt: int = 0) -> str:
+        """使用LLM异步生成Python代码"""
+        with span("code_generation", attempt=attempt):
+            messages = self._build_code_messages(question, attempt)
+            if self._can_stream():
+                content = await self._astream_llm(messages, until=_has_closed_code_block)
+            else:
+                content = (await self._ainvoke_llm(messages)).content
+            return self._parse_code_response(content, messages, question)
+
+    def _build_code_messages(self, question: str, attempt: int = 0) -> List[Any]:
+        """构建代码生成的提示消息(按当前提供商的token预算压缩)"""
         
         # 构建系统提示
-        system_prompt = f"""你是一个专业的Python数据分析助手。你需要生成Python代码来回答用户的数据分析问题。
+        def render(dataset_info: str) -> str:
+            return f"""你是一个专业的Python数据分析助手。你需要生成Python代码来回答用户的数据分析问题。
                 数据集信息:
-                {self.get_dataset_info()}
+                {dataset_info}
 
                 重要规则:
                 1. 生成的代码必须是完整的、可执行的Python代码
-                2. 数据框变量名必须使用 'df'
-                3. df已经加载好了,不需要重新读取CSV
-                4. 数据已经预处理过:Sales列已转为数值(移除$和,),Rating列已转为数值(移除%)
+                {self._describe_variables()}
+                4. {self._describe_cleaning()}
                 5. 代码应该打印出最终结果,使用print()函数
                 6. 只返回Python代码,不要包含任何解释文字
                 7. 代码必须放在```python 和 ``` 之间
-                8. 确保代码能处理可能的NaN值
+                8. 确保代码能处理可能的NaN值{self._describe_cubes()}
 
                 示例代码格式:
                 ```python
                 # 数据清理和分析代码
-                result = df.groupby('Category')['Sales'].sum()
-                print(result)
+                {self._example_code()}
                 ```
                 """
         
         # 如果是重试,添加错误反馈
-        if attempt > 0 and self.conversation_history:
-            last_message = self.conversation_history[-1]
-            if isinstance(last_message, dict) and "error" in last_message:
-                system_prompt += f"\n\n上一次代码执行失败,错误信息:\n{last_message['error']}\n\n请修正错误,生成正确的代码。"
+        error = None
+        if attempt > 0 and self.memory.last_error:
+            error = self.memory.last_error["error"]
         
-        # 添加对话历史上下文
-        if self.execution_history:
-            system_prompt += "\n\n对话历史:\n"
-            for i, hist in enumerate(self.execution_history[-5:], 1):  # 只保留最近5轮
-                system_prompt += f"\n问题{i}: {hist['question']}\n"
-                system_prompt += f"代码: {hist['code'][:200]}...\n"
-                system_prompt += f"结果: {hist['result'][:200]}...\n"
+        budget = self.prompt_budget or budget_for(getattr(self, "current_provider", None))
+        builder = PromptBuilder(self.profile, budget, self.csv_path, catalog=self.catalog)
+        with span("prompt_build") as stage:
+            system_prompt, stats = builder.build(question, render, self.execution_history, error, self.memory.summaries)
+            stage.set(estimated_tokens=stats["estimated_tokens"], level=stats["level"], budget=budget)
+            if stats["over_budget"]:
+                stage.set(over_budget=stats["over_budget"])
+        usage = _current_tokens.get()
+        if usage is not None:
+            usage["estimated_prompt_tokens"] += stats["estimated_tokens"]
+            usage["prompt_level"] = max(usage["prompt_level"], stats["level"])
+            usage["prompt_over_budget"] = max(usage["prompt_over_budget"], stats["over_budget"])
         
-        messages = [
+        return [
             SystemMessage(content=system_prompt),
             HumanMessage(content=f"请生成Python代码来回答以下问题:\n\n{question}")
         ]
-        
-        response = self.llm.invoke(messages)
-        code = response.content
-        
-        # 提取代码块
-        code = self._extract_code(code)
+
+    def _describe_variables(self) -> str:
+        """提示词中数据变量的规则(第2、3条)"""
+        if self.catalog is not None:
+            return (
+                f"2. 各表通过 tables['表名'] 访问(pandas DataFrame), df 即 tables['{self.catalog.default}']\n"
+                "                3. 所有表都已经可以直接使用,不需要重新读取文件; 只访问回答问题需要的表"
+            )
+        return prompt_rules(self.engine)
+
+    def _describe_cubes(self) -> str:
+        """提示词中聚合立方体的规则(第9条), 没有立方体时为空"""
+        if self.cubes is None:
+            return ""
+        return f"\n                9. {self.cubes.prompt_text()}"
+
+    def _example_code(self) -> str:
+        """提示词中的示例代码(按查询引擎)"""
+        return example_code(self.engine).replace("\n", "\n                ")
+
+    def _parse_code_response(self, content: str, messages: List[Any], question: str) -> str:
+        """从LLM响应文本中提取代码, 为空时报错"""
+        code = self._extract_code(content)
 
         if not code.strip():
-            prompt_length = len(system_prompt) + len(question)
+            prompt_tokens = estimate_tokens(messages[0].content) + estimate_tokens(question)
             raise RuntimeError(
-                f"LLM未返回任何代码内容。可能原因: 提示词过长({prompt_length}字符)、配额限制或模型拒绝。"
-                f"原始响应前200字符: {response.content[:200] if response.content else '<空>'}"
+                f"LLM未返回任何代码内容。可能原因: 提示词过长(约{prompt_tokens} tokens)、配额限制或模型拒绝。"
+                f"原始响应前200字符: {content[:200] if content else '<空>'}"
             )
 
         return code
@@ -328,94 +1326,168 @@ class DataAnalyzer:
         return text.strip()
 
     def _is_insufficient_balance_error(self, msg: str) -> bool:
-        msg_low = msg.lower()
-        return (
-            "insufficient" in msg_low and ("balance" in msg_low or "quota" in msg_low)
-        ) or (" 402" in msg_low) or ("code: 402" in msg_low) or ("payment" in msg_low and "required" in msg_low)
+        return classify_error(msg) == "payment"
 
     def _choose_fallback_provider(self, exclude: Optional[str] = None) -> Optional[str]:
-        """根据环境变量可用性选择一个后备LLM提供商，排除当前提供商"""
-        candidates = []
-        if os.getenv("GOOGLE_API_KEY"):
-            candidates.append("gemini")
-        if os.getenv("OPENAI_API_KEY"):
-            candidates.append("gpt")
-        if os.getenv("ANTHROPIC_API_KEY"):
-            candidates.append("claude")
-        if os.getenv("DEEPSEEK_API_KEY"):
-            candidates.append("deepseek")
-        if os.getenv("QWEN_API_KEY"):
-            candidates.append("qwen3")
-
-        # 去重并排除
-        uniq = [c for c in candidates if c != exclude]
-        # 简单策略: 优先 gemini -> gpt -> claude -> deepseek -> qwen3
-        priority = ["gemini", "gpt", "claude", "deepseek", "qwen3"]
-        for p in priority:
-            if p in uniq:
-                return p
-        return None
+        """在已配置API Key的提供商中选择当前最健康的一个(延迟、错误率、熔断状态)，排除当前提供商"""
+        ranked = rank_providers(available_providers(), exclude=exclude)
+        return ranked[0] if ranked else None
 
     def _execute_code(self, code: str) -> Tuple[bool, str, str, Any]:
         """
         执行Python代码
 
         Returns:
-            (success, output, error, figure) - figure是matplotlib图形对象或None
+            (success, output, error, figure) - figure是matplotlib图形对象(进程执行后端为PNG字节)或None
         """
-        
-        # 检测是否在Streamlit环境
+        with span("execute", backend="inline" if self.executor is None else "process") as stage:
+            key = self._execution_key(code)
+            cached = self.execution_cache.get(key) if key else None
+            if cached:
+                print(f"✓ 命中执行结果缓存({cached['tier']})")
+                stage.set(success=True, hit=cached["tier"])
+                return True, cached["output"], "", cached["figure"]
+
+            success, output, error, figure = self._run_code(code)
+            stage.set(success=success)
+            if success and key:
+                self._cache_execution(key, output, figure)
+            return success, output, error, figure
+
+    def _data_version(self, code: str) -> Optional[str]:
+        """代码用到的数据的版本(数据源指纹); 数据被替换或没有指纹时返回None"""
+        if getattr(self, "_data_replaced", False):
+            return None
+        if self.catalog is not None:
+            names = tables_used(code, self.catalog.names) if references_name(code, "tables") else []
+            if references_name(code, "df"):
+                names.append(self.catalog.default)
+            return self.catalog.version(list(set(names))) if names else "catalog"
+        return self.cache_key
+
+    def _execution_key(self, code: str) -> Optional[str]:
+        """执行结果缓存的键; 未启用缓存、数据没有版本或代码结果不确定时返回None"""
+        if not self.execution_cache:
+            return None
+        version = self._data_version(code)
+        if not version:
+            return None
+        # 执行环境: 查询引擎、列名与列类型(反映类型压缩的结果)、类型压缩设置、是否返回图形(Streamlit或进程执行后端)
+        figures = "streamlit" in sys.modules or self.executor is not None
+        settings = (
+            f"optimize_dtypes={self.optimize_dtypes}|arrow_strings={self.arrow_strings}|categories={self.categories}"
+        )
+        context = f"{self.engine}|{self.schema_hash}|{settings}|figures={figures}"
+        return self.execution_cache.make_key(code, version, context)
+
+    def _cache_execution(self, key: str, output: str, figure: Any):
+        """缓存成功的执行结果(图形保存为PNG字节), 失败不影响分析"""
         try:
-            import streamlit as st
-            is_streamlit = True
-        except ImportError:
-            st = None
-            is_streamlit = False
+            if figure is not None and not isinstance(figure, bytes):
+                with PLOT_LOCK:
+                    figure = figure_bytes(figure)
+            self.execution_cache.put(key, output, figure)
+        except Exception as e:
+            print(f"⚠ 写入执行结果缓存失败: {e}")
+
+    def _run_code(self, code: str) -> Tuple[bool, str, str, Any]:
+        """在当前进程或执行后端中执行代码, 返回值同 _execute_code"""
+        
+        # 检测是否在Streamlit环境(仅看是否已导入, 避免在CLI中导入streamlit)
+        st = sys.modules.get("streamlit")
+        is_streamlit = st is not None
         
         # Streamlit环境下移除plt.show()，避免清空图形
         if is_streamlit:
             code = re.sub(r'plt\s*\.\s*show\s*\(\s*\)', '# plt.show() removed for Streamlit', code, flags=re.IGNORECASE)
+
+        # 多表数据集只加载代码用到的表, 查询引擎模式和只查询聚合立方体的代码只在用到 df 时加载
+        # (在捕获输出之前加载, 加载提示不混入执行结果)
+        uses_cubes = self.cubes is not None and references_name(code, "cubes")
+        uses_df = references_name(code, "df") or (
+            self.catalog is None and self.engine == "pandas" and not uses_cubes
+        )
+        if uses_cubes:
+            self.cubes.base()
+        tables = None
+        if self.catalog is not None:
+            tables = {name: self.catalog.load(name) for name in tables_used(code, self.catalog.names)}
+        engine = (self.engine, self.store_path) if self.engine != "pandas" else None
+        if self.executor is not None:
+            return self.executor.execute(
+                code, self.df if uses_df else None, tables=tables, engine=engine,
+                variables={"cubes": self.cubes} if uses_cubes else None,
+            )
         
         # 准备执行环境
         local_vars = {
-            'df': self.df.copy(),
             'pd': pd,
             'np': __import__('numpy'),
-            'plt': plt,
+            'plt': pyplot_for(code),
             'st': st,
         }
+        df = self.df if uses_df else None
+        if self.catalog is not None:
+            local_vars['tables'] = self.catalog.tables()
+        if engine is not None:
+            local_vars.update(engine_namespace(*engine))
+        if uses_cubes:
+            local_vars['cubes'] = self.cubes
 
-        # 捕获输出
-        old_stdout = sys.stdout
-        sys.stdout = captured_output = StringIO()
+        # 按执行上下文捕获输出(不交换全局sys.stdout, 并发执行互不干扰);
+        # pyplot为全局状态, 绘图代码串行执行; df 的隔离副本在写时复制开启期间创建和使用
+        plot_lock = PLOT_LOCK if uses_plotting(code) else nullcontext()
+        with plot_lock, copy_on_write(), capture_output() as captured_output:
+            if df is not None:
+                local_vars['df'] = sandbox_frame(df)
+            local_vars['print'] = make_print(captured_output)
+            try:
+                with measure_resources(memory=self.trace_memory):
+                    exec(code, local_vars)
 
-        try:
-            exec(code, local_vars)
+                output = captured_output.getvalue()
 
-            output = captured_output.getvalue()
+                if not output.strip():
+                    for var_name in RESULT_VAR_NAMES:
+                        if var_name in local_vars:
+                            output = str(to_pandas(local_vars[var_name]))
+                            break
+                
+                # 捕获matplotlib图形对象(pyplot未导入说明没有绘图)
+                figure = None
+                if is_streamlit and pyplot_loaded() and get_pyplot().get_fignums():
+                    figure = get_pyplot().gcf()
+                
+                return True, output, "", figure
 
-            if not output.strip():
-                for var_name in ['result', 'output', 'answer']:
-                    if var_name in local_vars:
-                        output = str(local_vars[var_name])
-                        break
+            except Exception as e:
+                error_msg = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
+                return False, "", error_msg, None
+            finally:
+                close_namespace(local_vars)
+    
+    def _generate_explanation(self, question: str, code: str, result: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """生成自然语言解释; 提供 on_token 时流式输出"""
+        messages = self._build_explanation_messages(question, code, result)
+        if on_token and self._can_stream():
+            return self._stream_llm(messages, on_text=on_token)
+        content = self._invoke_llm(messages).content
+        if on_token:
+            on_token(content)
+        return content
 
-            sys.stdout = old_stdout
-            
-            # 捕获matplotlib图形对象
-            figure = None
-            if is_streamlit and plt.get_fignums():
-                figure = plt.gcf()
-            
-            return True, output, "", figure
+    async def _agenerate_explanation(self, question: str, code: str, result: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """异步生成自然语言解释"""
+        messages = self._build_explanation_messages(question, code, result)
+        if on_token and self._can_stream():
+            return await self._astream_llm(messages, on_text=on_token)
+        content = (await self._ainvoke_llm(messages)).content
+        if on_token:
+            on_token(content)
+        return content
 
-        except Exception as e:
-            sys.stdout = old_stdout
-            error_msg = f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
-            return False, "", error_msg, None
-    
-    def _generate_explanation(self, question: str, code: str, result: str) -> str:
-        """生成自然语言解释"""
+    def _build_explanation_messages(self, question: str, code: str, result: str) -> List[Any]:
+        """构建结果解释的提示消息"""
         
         prompt = f"""基于以下信息,用自然语言解释分析结果:
                 问题: {question}
@@ -426,44 +1498,62 @@ class DataAnalyzer:
                 请用清晰、简洁的中文解释这个结果,回答用户的问题。不要重复代码,只需要解释结果的含义。
                 """
         
-        messages = [
+        return [
             SystemMessage(content="你是一个数据分析助手,擅长用自然语言解释数据分析结果。"),
             HumanMessage(content=prompt)
         ]
-        
-        response = self.llm.invoke(messages)
-        return response.content
     
-    def _save_to_history(self, question: str, code: str, result: str, explanation: str):
-        """保存到历史记录"""
-        self.execution_history.append({
-            "question": question,
-            "code": code,
-            "result": result,
-            "explanation": explanation
-        })
-        
-        self.conversation_history.append(
-            HumanMessage(content=question)
-        )
-        self.conversation_history.append(
-            AIMessage(content=f"代码:\n{code}\n\n结果:\n{result}\n\n解释:\n{explanation}")
-        )
+    def _save_to_history(self, question: str, code: str, result: str, explanation: str) -> Dict[str, Any]:
+        """保存到对话记忆, 返回新增的执行历史条目"""
+        return self.memory.add_turn(question, code, result, explanation)
     
     def _add_error_to_context(self, code: str, error: str):
-        """将错误信息添加到对话上下文"""
-        self.conversation_history.append({
-            "code": code,
-            "error": error,
-            "type": "error_feedback"
-        })
+        """记录执行错误, 重试时反馈给LLM(只保留最近一次)"""
+        self.memory.record_error(code, error)
+    
+    def fork_session(self) -> "DataAnalyzer":
+        """创建共享数据、LLM客户端和执行后端的新会话(对话历史独立), 无需重新加载数据"""
+        if self.catalog is None and self.engine == "pandas":
+            _ = self.df  # 恢复的会话先加载数据, 使各会话共用同一份
+        session = copy.copy(self)
+        session.memory = self.memory.fork()
+        session.session_id = None  # 派生会话不持久化, 避免覆盖原会话
+        return session
     
     def clear_history(self):
         """清空对话历史"""
-        self.conversation_history = []
-        self.execution_history = []
+        self.memory.clear()
+        self._save_session()
         print("✓ 对话历史已清空")
 
+    def _save_session(self):
+        """保存会话状态(数据集引用、概要、对话记忆、提供商), 失败不影响分析"""
+        if not (self.session_store and self.session_id):
+            return
+        spec = self.catalog.spec() if self.catalog is not None else None
+        if self.catalog is not None and spec is None:
+            return  # 上传的文件无法在恢复时重新注册
+        state = {
+            "catalog": spec,
+            "dataset": {
+                "cache_key": self.cache_key,
+                "store_path": self.store_path,
+                "clean_report": self.clean_report,
+                "memory_report": self.memory_report,
+                "source_stat": source_stat(self._source()),
+                "upload": is_upload(self._source()),
+            },
+            "memory": self.memory.state(),
+            "engine": self.engine,
+        }
+        try:
+            self.session_store.save(
+                self.session_id, self._source_name(), getattr(self, "current_provider", None),
+                state, profile=self.profile,
+            )
+        except Exception as e:
+            print(f"⚠ 保存会话失败: {e}")
+
 
 def clean_sales_data(df: pd.DataFrame, sales_column: str = 'Sales') -> pd.DataFrame:
     """清理销售数据(移除$和,符号)"""
@@ -0,0 +1,210 @@
+"""
+清洗后数据集的磁盘缓存
+以文件指纹(路径、大小、修改时间、内容哈希)为键，将清洗后的DataFrame存为Parquet，
+源文件变化时指纹随之变化，旧缓存自动失效；缓存目录按LRU策略限制总大小
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from csv_streaming import get_store_dir
+
+
+# 清洗逻辑变化时递增，使旧版本的缓存全部失效
+CACHE_VERSION = 5
+
+# 内容哈希的采样块大小(文件头、中、尾各取一块)，避免每次启动都全量读取大文件
+_SAMPLE_BLOCK = 1024 * 1024
+
+
+class DatasetCache:
+    """基于Parquet的清洗后数据集缓存，带LRU容量淘汰"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            cache_dir: 缓存目录，默认使用 EXCEL_AGENT_CACHE_DIR
+            max_bytes: 缓存目录容量上限，默认读取 EXCEL_AGENT_CACHE_MAX_MB (2048MB)
+        """
+        self.cache_dir = cache_dir or get_store_dir()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if max_bytes is None:
+            max_bytes = int(os.getenv("EXCEL_AGENT_CACHE_MAX_MB", "2048")) * 1024 * 1024
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def is_available() -> bool:
+        """缓存依赖 pyarrow 读写Parquet"""
+        try:
+            import pyarrow  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def fingerprint(self, source: Any) -> Optional[str]:
+        """
+        计算数据源指纹
+
+        路径: 绝对路径 + 大小 + 修改时间 + 采样内容哈希
+        上传文件对象: 文件名 + 全量内容哈希(内容已在内存中)
+        无法识别的数据源返回None(不缓存)
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"v{CACHE_VERSION}".encode())
+
+        if isinstance(source, (str, os.PathLike)):
+            path = os.path.abspath(os.fspath(source))
+            stat = os.stat(path)
+            digest.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8"))
+            with open(path, "rb") as f:
+                for offset in (0, max(stat.st_size // 2 - _SAMPLE_BLOCK // 2, 0), max(stat.st_size - _SAMPLE_BLOCK, 0)):
+                    f.seek(offset)
+                    digest.update(f.read(_SAMPLE_BLOCK))
+        elif hasattr(source, "getvalue"):
+            data = source.getvalue()
+            digest.update(f"{getattr(source, 'name', '')}|{len(data)}".encode("utf-8"))
+            digest.update(data)
+        else:
+            return None
+
+        return digest.hexdigest()
+
+    def data_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def cube_path(self, key: str) -> str:
+        """该数据集的聚合立方体(见 aggregate_cube), 随缓存条目一起删除"""
+        return os.path.join(self.cache_dir, f"{key}.cube.parquet")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, key: str) -> Optional[pd.DataFrame]:
+        """读取缓存；未命中或缓存损坏时返回None"""
+        data_path = self.data_path(key)
+        meta_path = self._meta_path(key)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            df = pd.read_parquet(data_path)
+            # 还原推断出的列类型(Parquet无法表达的类型以元数据为准)
+            for col, dtype in meta.get("dtypes", {}).items():
+                if col in df.columns and str(df[col].dtype) != dtype:
+                    try:
+                        df[col] = df[col].astype(dtype)
+                    except Exception:
+                        pass
+        except Exception as e:
+            print(f"⚠ 缓存读取失败, 将重新加载: {e}")
+            self._remove(key)
+            return None
+
+        # 更新访问时间, 作为LRU淘汰依据
+        now = time.time()
+        os.utime(data_path, (now, now))
+        return df
+
+    def load_meta(self, key: str) -> Dict[str, Any]:
+        """读取缓存条目的元数据"""
+        try:
+            with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def save(self, key: str, df: pd.DataFrame, source: Any = None, extra: Optional[Dict[str, Any]] = None) -> str:
+        """写入缓存(Parquet + 元数据)，返回Parquet路径"""
+        data_path = self.data_path(key)
+        tmp_path = data_path + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, data_path)
+        self.commit(key, df, source, extra)
+        return data_path
+
+    def commit(self, key: str, df: pd.DataFrame, source: Any = None, extra: Optional[Dict[str, Any]] = None):
+        """
+        为已写好的Parquet文件登记元数据(分块加载直接写入 data_path 后调用)，
+        并清理同一数据源的旧版本缓存、执行容量淘汰
+        """
+        source_name = self._source_name(source)
+        meta = {
+            "source": source_name,
+            "rows": len(df),
+            "columns": df.columns.tolist(),
+            "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
+            "created_at": time.time(),
+        }
+        if extra:
+            meta.update(extra)
+        with open(self._meta_path(key), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        if source_name:
+            for other_key, other_meta in self._entries():
+                if other_key != key and other_meta.get("source") == source_name:
+                    self._remove(other_key)
+        self.evict()
+
+    def evict(self):
+        """缓存目录超出容量上限时，按最近访问时间淘汰最旧的条目"""
+        entries = []
+        total = 0
+        for key, _ in self._entries():
+            data_path = self.data_path(key)
+            try:
+                size = os.path.getsize(data_path) + os.path.getsize(self._meta_path(key))
+                last_access = os.path.getmtime(data_path)
+            except OSError:
+                continue
+            entries.append((last_access, key, size))
+            total += size
+
+        entries.sort()
+        # 至少保留最新的一个条目
+        while total > self.max_bytes and len(entries) > 1:
+            _, key, size = entries.pop(0)
+            self._remove(key)
+            total -= size
+
+    def clear(self):
+        """清空全部缓存"""
+        for key, _ in self._entries():
+            self._remove(key)
+
+    def _entries(self) -> List[tuple]:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            try:
+                with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                    meta: Dict[str, Any] = json.load(f)
+            except Exception:
+                meta = {}
+            entries.append((key, meta))
+        return entries
+
+    def _remove(self, key: str):
+        for path in (self.data_path(key), self._meta_path(key), self.cube_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _source_name(source: Any) -> Optional[str]:
+        """同一数据源的新版本替换旧缓存; 上传文件按内容区分(同名的上传可能是不同文件, 会话仍引用旧条目), 只参与容量淘汰"""
+        if isinstance(source, (str, os.PathLike)):
+            return os.path.abspath(os.fspath(source))
+        if hasattr(source, "getvalue"):
+            return None
+        return getattr(source, "name", None)
@@ -0,0 +1,547 @@
+"""
+多表数据集目录
+将多个CSV(同名前缀的分区文件合并为一张表)和Excel工作簿的各个工作表注册为命名表:
+- 注册时只读取每张表(每个分区)开头的样本行, 推断清洗规则并生成概要(列类型、取值示例), 供提示词描述各表结构
+- 生成的代码通过 tables['表名'] 访问某张表时才完整读取并清洗: 各分区分别推断格式, 再按全部分区的规则
+  对齐列类型后合并(同一列在各分区中类型一致)
+- 已加载的表按最近使用保留, 总内存超过上限时释放最久未用的表
+内存占用因此只与问题实际用到的表有关
+"""
+
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from code_executor import sandbox_frame
+from dataset_profile import DatasetProfile
+from type_inference import clean_dataframe, convert_column, format_report
+
+
+CSV_SUFFIXES = (".csv",)
+EXCEL_SUFFIXES = (".xlsx", ".xlsm", ".xls")
+
+# 注册时每张表读取的样本行数(多个分区时平均分到各分区, 每个分区至少 MIN_PARTITION_SAMPLE 行)
+SAMPLE_ROWS = 2000
+MIN_PARTITION_SAMPLE = 100
+
+# 已加载表的默认内存上限(MB), 可用 EXCEL_AGENT_TABLE_CACHE_MB 配置
+DEFAULT_MAX_LOADED_MB = 4096
+
+# 分区文件名结尾的日期/序号(如 sales_2024_01、sales-part3), 去掉后相同的文件合并为一张表
+_PARTITION_SUFFIX = re.compile(r'(?:[_\-. ]+part)?[_\-. ]*\d[\d_\-. ]*$', re.IGNORECASE)
+
+
+def _name_of(source: Any) -> str:
+    return os.fspath(source) if isinstance(source, (str, os.PathLike)) else str(getattr(source, "name", "upload"))
+
+
+def _identity(source: Any) -> str:
+    """数据源的稳定标识: 文件绝对路径或上传文件名"""
+    return os.path.abspath(os.fspath(source)) if isinstance(source, (str, os.PathLike)) else _name_of(source)
+
+
+def _suffix(source: Any) -> str:
+    return os.path.splitext(_name_of(source))[1].lower()
+
+
+def _stem(source: Any) -> str:
+    return os.path.splitext(os.path.basename(_name_of(source)))[0] or "table"
+
+
+def _readable(source: Any) -> Any:
+    """路径原样返回; 上传的文件对象每次读取都从头开始"""
+    if hasattr(source, "getvalue"):
+        return io.BytesIO(source.getvalue())
+    return source
+
+
+def _file_state(source: Any) -> Optional[Tuple[int, int]]:
+    """路径数据源的 (大小, 修改时间); 上传的文件对象内容不变, 为None; 文件不存在时抛出OSError"""
+    if not isinstance(source, (str, os.PathLike)):
+        return None
+    stat = os.stat(source)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _excel_import_error(source: Any) -> ImportError:
+    """缺少Excel读取依赖时的提示(.xls 需要 xlrd, 其余需要 openpyxl)"""
+    package = "xlrd" if _suffix(source) == ".xls" else "openpyxl"
+    return ImportError(f"读取 {_suffix(source)} 文件需要 {package}，请先执行: pip install {package}")
+
+
+def _dtype_kind(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+        return "numeric"
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return "datetime"
+    return "text"
+
+
+def _clean_partitions(
+    parts: List[pd.DataFrame], rules: Optional[Dict[str, str]] = None
+) -> Tuple[pd.DataFrame, Dict[str, str], List[Dict[str, Any]]]:
+    """
+    逐个分区推断并清洗(原地修改), 对齐各分区的列类型后合并
+
+    某个分区推断出的格式(如货币)同样应用于其他分区中仍为文本的同名列; 对齐后同一列在各分区中
+    仍为不同种类(数值/日期/文本)时统一转为文本, 避免合并出混合类型的列
+
+    Args:
+        parts: 各分区的原始数据
+        rules: 必须应用的已有规则 {列名: 格式}(如注册时由样本推断的规则)
+
+    Returns:
+        (合并后的数据, 合并后的规则, 清洗报告) - 报告中每列一项, failed 为各分区之和
+    """
+    merged = dict(rules or {})
+    report: Dict[Any, Dict[str, Any]] = {}
+    for part in parts:
+        part_rules, part_report = clean_dataframe(part)
+        for col, kind in part_rules.items():
+            merged.setdefault(col, kind)
+        for item in part_report:
+            if item["column"] in report:
+                report[item["column"]]["failed"] += item["failed"]
+            else:
+                report[item["column"]] = dict(item)
+
+    for col, kind in merged.items():
+        for part in parts:
+            if col not in part.columns or _dtype_kind(part[col]) != "text":
+                continue
+            original = part[col]
+            converted = convert_column(original, kind)
+            failed = int((converted.isna() & original.notna()).sum())
+            if col in report:
+                report[col]["failed"] += failed
+            else:
+                report[col] = {
+                    "column": col, "kind": kind, "from_dtype": str(original.dtype),
+                    "to_dtype": str(converted.dtype), "failed": failed,
+                }
+            part[col] = converted
+
+    columns = {col for part in parts for col in part.columns}
+    for col in columns:
+        if len({_dtype_kind(part[col]) for part in parts if col in part.columns}) > 1:
+            for part in parts:
+                if col in part.columns:
+                    part[col] = part[col].map(str, na_action="ignore").astype(object)
+
+    df = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+    return df, merged, list(report.values())
+
+
+def is_catalog_source(source: Any) -> bool:
+    """数据源是否需要按多表目录加载(目录、多个文件、Excel工作簿或 DatasetCatalog)"""
+    if isinstance(source, DatasetCatalog):
+        return True
+    if isinstance(source, (list, tuple)):
+        return True
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        return True
+    return _suffix(source) in EXCEL_SUFFIXES
+
+
+@dataclass
+class TableInfo:
+    """一张已注册的表"""
+
+    name: str
+    sources: List[Any]  # CSV分区(按文件名排序); Excel为单个工作簿
+    sheet: Optional[str] = None
+    rules: Optional[Dict[str, str]] = None  # 由样本推断的清洗规则
+    clean_report: List[Dict[str, Any]] = field(default_factory=list)
+    profile: Optional[DatasetProfile] = None  # 基于样本的概要, rows 为估计的总行数
+    # 各分区的指纹及计算时的文件状态 (状态, 指纹列表); 文件大小和修改时间未变时沿用
+    fingerprints: Optional[Tuple[List[Any], List[str]]] = field(default=None, repr=False)
+
+    @property
+    def is_excel(self) -> bool:
+        return self.sheet is not None
+
+
+class DatasetCatalog:
+    """命名表的目录, 按需加载"""
+
+    def __init__(
+        self,
+        sample_rows: int = SAMPLE_ROWS,
+        max_loaded_mb: Optional[int] = None,
+        dataset_cache: Any = None,
+    ):
+        """
+        Args:
+            sample_rows: 注册时每张表读取的样本行数
+            max_loaded_mb: 已加载表的内存上限(MB), 默认读取 EXCEL_AGENT_TABLE_CACHE_MB (4096MB)
+            dataset_cache: 清洗后整表的磁盘缓存(DatasetCache), 再次启动时不必重新读取和清洗
+        """
+        self.sample_rows = sample_rows
+        if max_loaded_mb is None:
+            max_loaded_mb = int(os.getenv("EXCEL_AGENT_TABLE_CACHE_MB", str(DEFAULT_MAX_LOADED_MB)))
+        self.max_loaded_bytes = max_loaded_mb * 1024 * 1024
+        self.dataset_cache = dataset_cache
+        self._tables: Dict[str, TableInfo] = {}
+        self._loaded: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_sources(cls, sources: Any, **kwargs) -> "DatasetCatalog":
+        """
+        由文件、目录或它们的列表创建目录
+
+        目录展开为其中的CSV和Excel文件; 去掉结尾日期/序号后同名的多个CSV合并为一张表,
+        Excel工作簿的每个工作表各为一张表
+        """
+        catalog = cls(**kwargs)
+        if isinstance(sources, (str, os.PathLike)) or not isinstance(sources, Iterable):
+            sources = [sources]
+
+        files: List[Any] = []
+        for source in sources:
+            if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+                files.extend(
+                    os.path.join(source, name) for name in sorted(os.listdir(source))
+                    if _suffix(name) in CSV_SUFFIXES + EXCEL_SUFFIXES
+                )
+            else:
+                files.append(source)
+
+        csv_groups: Dict[str, List[Any]] = {}
+        for source in files:
+            suffix = _suffix(source)
+            if suffix in EXCEL_SUFFIXES:
+                catalog.add_workbook(source)
+            elif suffix in CSV_SUFFIXES:
+                csv_groups.setdefault(_PARTITION_SUFFIX.sub("", _stem(source)) or _stem(source), []).append(source)
+            else:
+                raise ValueError(f"不支持的文件类型: {_name_of(source)} (支持 CSV、Excel)")
+
+        for base, group in csv_groups.items():
+            if len(group) == 1:
+                catalog.add_table(_stem(group[0]), group)
+            else:
+                catalog.add_table(base, sorted(group, key=_name_of))
+        if not catalog._tables:
+            raise ValueError("没有找到可加载的CSV或Excel文件")
+        return catalog
+
+    def add_table(self, name: str, sources: List[Any], sheet: Optional[str] = None) -> str:
+        """注册一张表(CSV分区列表, 或Excel工作簿及工作表名), 返回最终表名(重名时加序号)"""
+        unique = name
+        index = 2
+        while unique in self._tables:
+            unique = f"{name}_{index}"
+            index += 1
+        self._tables[unique] = TableInfo(unique, list(sources), sheet)
+        return unique
+
+    def add_workbook(self, source: Any) -> List[str]:
+        """注册Excel工作簿的全部工作表; 只有一个工作表时以文件名为表名, 否则为 文件名.工作表名"""
+        try:
+            sheets = pd.ExcelFile(_readable(source)).sheet_names
+        except ImportError:
+            raise _excel_import_error(source)
+        stem = _stem(source)
+        if len(sheets) == 1:
+            return [self.add_table(stem, [source], sheets[0])]
+        return [self.add_table(f"{stem}.{sheet}", [source], sheet) for sheet in sheets]
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._tables)
+
+    @property
+    def default(self) -> str:
+        """默认表(第一张), 生成的代码中 df 即为该表"""
+        return self.names[0]
+
+    @property
+    def name(self) -> str:
+        """目录的标识(会话记录中的数据源名称)"""
+        digest = hashlib.sha256()
+        for info in self._tables.values():
+            digest.update(f"{info.name}|{info.sheet}|{'|'.join(_identity(s) for s in info.sources)}\n".encode("utf-8"))
+        shown = ", ".join(self.names[:3]) + (" ..." if len(self._tables) > 3 else "")
+        return f"catalog[{shown}]#{digest.hexdigest()[:12]}"
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tables
+
+    def info(self, name: str) -> TableInfo:
+        if name not in self._tables:
+            raise KeyError(f"没有名为 {name!r} 的表, 可用的表: {', '.join(self.names)}")
+        return self._tables[name]
+
+    # ---- 概要(只读样本) ----
+
+    def profile(self, name: str) -> DatasetProfile:
+        """表的概要: 基于开头的样本行, 行数为估计的总行数"""
+        info = self.info(name)
+        with self._lock:
+            if info.profile is None:
+                per_part = max(self.sample_rows // len(info.sources), MIN_PARTITION_SAMPLE)
+                parts = [self._read(info, source=source, nrows=per_part) for source in info.sources]
+                sample, info.rules, info.clean_report = _clean_partitions(parts)
+                rows = self._count_rows(info)
+                profile = DatasetProfile.build(sample)
+                info.profile = replace(profile, rows=rows if rows is not None else profile.rows)
+            return info.profile
+
+    def profiles(self) -> Dict[str, DatasetProfile]:
+        return {name: self.profile(name) for name in self._tables}
+
+    @property
+    def schema_hash(self) -> str:
+        """全部表的表名与结构指纹"""
+        digest = hashlib.sha256()
+        for name in self._tables:
+            digest.update(f"{name}:{self.profile(name).schema_hash}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _count_rows(self, info: TableInfo) -> Optional[int]:
+        """估计总行数而不解析数据: CSV按换行数(引号内的换行会多计), Excel取工作表尺寸"""
+        if info.is_excel:
+            try:
+                from openpyxl import load_workbook
+                workbook = load_workbook(_readable(info.sources[0]), read_only=True)
+                try:
+                    return max(workbook[info.sheet].max_row - 1, 0)
+                finally:
+                    workbook.close()
+            except Exception:
+                return None
+
+        total = 0
+        for source in info.sources:
+            if hasattr(source, "getvalue"):
+                data = source.getvalue()
+                lines = data.count(b"\n") + (0 if data.endswith(b"\n") else 1)
+            else:
+                lines = 0
+                last = b"\n"
+                with open(source, "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        lines += block.count(b"\n")
+                        last = block[-1:]
+                if last != b"\n":
+                    lines += 1
+            total += max(lines - 1, 0)  # 表头
+        return total
+
+    # ---- 完整加载(按需) ----
+
+    def load(self, name: str) -> pd.DataFrame:
+        """完整读取并清洗一张表(已加载时直接返回), 返回的对象由目录持有, 调用方不应原地修改"""
+        info = self.info(name)
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+
+            self.profile(name)  # 样本推断的规则在完整加载时同样应用
+            key = self._cache_key(info)
+            df = self.dataset_cache.load(key) if key else None
+            if df is None:
+                parts = [self._read(info, source=source) for source in info.sources]
+                df, _, _ = _clean_partitions(parts, info.rules)
+                if key:
+                    try:
+                        self.dataset_cache.save(key, df)
+                    except Exception as e:
+                        print(f"⚠ 写入数据缓存失败: {e}")
+            print(f"✓ 已加载表 {name}: {len(df)} 行")
+
+            self._loaded[name] = df
+            self._sizes[name] = int(df.memory_usage(deep=True).sum())
+            self._evict(keep=name)
+            return df
+
+    def loaded(self) -> Dict[str, int]:
+        """已加载的表及其内存占用(字节)"""
+        with self._lock:
+            return {name: self._sizes[name] for name in self._loaded}
+
+    def release(self, name: Optional[str] = None):
+        """释放已加载的表(默认全部), 下次访问时重新加载"""
+        with self._lock:
+            for key in [name] if name else list(self._loaded):
+                self._loaded.pop(key, None)
+                self._sizes.pop(key, None)
+
+    def _evict(self, keep: str):
+        """已加载表的总内存超过上限时, 释放最久未用的表(调用方持有锁)"""
+        total = sum(self._sizes.values())
+        for name in list(self._loaded):
+            if total <= self.max_loaded_bytes:
+                break
+            if name == keep:
+                continue
+            self._loaded.pop(name)
+            total -= self._sizes.pop(name)
+
+    def _read(self, info: TableInfo, source: Any = None, nrows: Optional[int] = None) -> pd.DataFrame:
+        source = info.sources[0] if source is None else source
+        if info.is_excel:
+            try:
+                return pd.read_excel(_readable(source), sheet_name=info.sheet, nrows=nrows)
+            except ImportError:
+                raise _excel_import_error(source)
+        return pd.read_csv(_readable(source), nrows=nrows, low_memory=False)
+
+    def _fingerprints(self, info: TableInfo) -> Optional[List[str]]:
+        """
+        各分区的指纹(调用方持有锁)
+
+        只在首次使用或分区文件的大小/修改时间变化时重新计算(每次执行代码都会查询数据版本);
+        数据源无法识别或分区文件不存在时返回None
+        """
+        try:
+            stat = [_file_state(source) for source in info.sources]
+            if info.fingerprints is None or info.fingerprints[0] != stat:
+                fingerprints = [self.dataset_cache.fingerprint(source) for source in info.sources]
+                info.fingerprints = (stat, fingerprints)
+        except OSError:
+            info.fingerprints = None
+            return None
+        fingerprints = info.fingerprints[1]
+        return None if None in fingerprints else fingerprints
+
+    def _cache_key(self, info: TableInfo) -> Optional[str]:
+        """整表的缓存键: 各分区指纹 + 工作表名 + 清洗规则"""
+        if not self.dataset_cache:
+            return None
+        with self._lock:
+            fingerprints = self._fingerprints(info)
+        if fingerprints is None:
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        for fingerprint in fingerprints:
+            digest.update(fingerprint.encode())
+        digest.update(f"|{info.sheet}|{sorted((info.rules or {}).items())}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def version(self, names: List[str]) -> Optional[str]:
+        """
+        若干张表的数据版本(各表缓存键的组合); 未使用数据缓存、数据源无法识别或分区文件不存在时返回None
+        (此时不缓存执行结果, 文件缺失的错误在加载该表时报告)
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for name in sorted(names):
+            key = self._cache_key(self.info(name))
+            if key is None:
+                return None
+            digest.update(f"{name}={key}|".encode("utf-8"))
+        return digest.hexdigest()
+
+    # ---- 提示词与会话 ----
+
+    def prompt_text(self, question: str = "", head_rows: int = 3, detailed_tables: Optional[int] = None) -> str:
+        """
+        各表的结构描述
+
+        Args:
+            question: 用户问题, 用于挑选详细描述的表
+            head_rows: 每张详细描述的表附带的示例行数
+            detailed_tables: 详细描述(列类型、取值示例)的表数, 其余表只列出列名; None表示全部
+        """
+        names = self.names
+        if detailed_tables is not None and len(names) > detailed_tables:
+            detailed = set(self.rank_tables(question)[:detailed_tables])
+        else:
+            detailed = set(names)
+
+        info = f"\n共{len(names)}张表, 通过 tables['表名'] 访问, df 即 tables['{self.default}']:\n"
+        brief = []
+        for name in names:
+            profile = self.profile(name)
+            table = self._tables[name]
+            origin = f"{len(table.sources)}个分区文件" if len(table.sources) > 1 else _name_of(table.sources[0])
+            if table.sheet is not None:
+                origin += f" 工作表 {table.sheet}"
+            if name not in detailed:
+                brief.append(f"  * {name} (约{profile.rows}行): {', '.join(profile.columns)}")
+                continue
+            info += f"\n表 {name} ({origin}, 约{profile.rows}行, {len(profile.columns)}列):\n"
+            for col in profile.columns:
+                info += profile.column_line(col) + "\n"
+            if table.clean_report:
+                info += f"  已清洗: {format_report(table.clean_report)}\n"
+            if head_rows:
+                info += f"  前{head_rows}行:\n{profile.head.head(head_rows).to_string(max_cols=10, max_colwidth=30)}\n"
+        if brief:
+            info += "\n其余表(仅列名):\n" + "\n".join(brief) + "\n"
+        return info
+
+    def rank_tables(self, question: str) -> List[str]:
+        """按与问题的相关度排序(表名出现在问题中 > 列名出现 > 取值出现), 同分保持注册顺序"""
+        text = question.lower()
+        scores = {}
+        for name in self.names:
+            profile = self.profile(name)
+            score = 10 if name.lower() in text else 0
+            score += 2 * sum(1 for col in profile.columns if len(col) >= 2 and col.lower() in text)
+            score += sum(
+                1 for values in profile.samples.values() for value in values
+                if len(value) >= 2 and value.lower() in text
+            )
+            scores[name] = score
+        return sorted(self.names, key=lambda name: -scores[name])
+
+    def spec(self) -> Optional[List[Dict[str, Any]]]:
+        """可JSON序列化的注册信息(用于会话恢复); 含上传文件对象时为None"""
+        spec = []
+        for info in self._tables.values():
+            if not all(isinstance(source, (str, os.PathLike)) for source in info.sources):
+                return None
+            spec.append({
+                "name": info.name,
+                "sources": [_identity(source) for source in info.sources],
+                "sheet": info.sheet,
+            })
+        return spec
+
+    @classmethod
+    def from_spec(cls, spec: List[Dict[str, Any]], **kwargs) -> "DatasetCatalog":
+        catalog = cls(**kwargs)
+        for item in spec:
+            catalog.add_table(item["name"], item["sources"], item.get("sheet"))
+        return catalog
+
+    def tables(self) -> "TableMapping":
+        """供生成代码使用的只读表映射(访问时加载)"""
+        return TableMapping(self)
+
+
+class TableMapping(Mapping):
+    """tables['表名'] 在第一次访问时加载该表, 每次返回与目录中数据隔离的副本(写时复制)"""
+
+    def __init__(self, catalog: DatasetCatalog):
+        self._catalog = catalog
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        return sandbox_frame(self._catalog.load(name))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._catalog.names)
+
+    def __len__(self) -> int:
+        return len(self._catalog)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._catalog
+
+    def __repr__(self) -> str:
+        return f"tables({', '.join(self._catalog.names)})"
@@ -0,0 +1,113 @@
+"""
+数据集概要
+加载数据时一次性计算列类型、统计摘要、基数、取值示例和结构指纹,
+供提示词构建与界面概览面板复用, 避免每次调用LLM或每次页面刷新都扫描全量数据
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+import pandas as pd
+
+
+# 每列保留的取值示例个数
+SAMPLE_VALUES = 5
+
+# 概览面板展示的前几行
+HEAD_ROWS = 10
+
+
+def schema_hash(df: pd.DataFrame) -> str:
+    """数据集结构指纹(列名与类型)"""
+    schema = "|".join(f"{col}:{dtype}" for col, dtype in df.dtypes.items())
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class DatasetProfile:
+    """数据集概要(只读快照, 数据变化时整体重建)"""
+
+    rows: int
+    columns: List[str]
+    dtypes: Dict[str, str]
+    null_counts: Dict[str, int]
+    cardinality: Dict[str, int]
+    samples: Dict[str, List[str]]
+    head: pd.DataFrame
+    describe: pd.DataFrame
+    schema_hash: str
+    text_columns: List[str] = field(default_factory=list)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, sample_values: int = SAMPLE_VALUES, head_rows: int = HEAD_ROWS) -> "DatasetProfile":
+        """扫描一次数据集生成概要"""
+        cardinality: Dict[str, int] = {}
+        samples: Dict[str, List[str]] = {}
+        text_columns: List[str] = []
+        for col in df.columns:
+            series = df[col]
+            if (
+                series.dtype == 'object'
+                or pd.api.types.is_string_dtype(series.dtype)
+                or isinstance(series.dtype, pd.CategoricalDtype)
+            ):
+                text_columns.append(col)
+            try:
+                uniques = series.dropna().unique()
+            except TypeError:
+                # 不可哈希的值(如列表)无法统计基数
+                continue
+            cardinality[col] = len(uniques)
+            samples[col] = [str(value) for value in uniques[:sample_values]]
+
+        try:
+            describe = df.describe()
+        except ValueError:
+            describe = pd.DataFrame()
+
+        return cls(
+            rows=len(df),
+            columns=[str(col) for col in df.columns],
+            dtypes={str(col): str(dtype) for col, dtype in df.dtypes.items()},
+            null_counts={str(col): int(count) for col, count in df.isna().sum().items()},
+            cardinality={str(col): count for col, count in cardinality.items()},
+            samples={str(col): values for col, values in samples.items()},
+            head=df.head(head_rows).copy(),
+            describe=describe,
+            schema_hash=schema_hash(df),
+            text_columns=[str(col) for col in text_columns],
+        )
+
+    def dtype_frame(self) -> pd.DataFrame:
+        """列名/数据类型/非空值/不同值个数 表格(类型已转为字符串, 可直接展示)"""
+        return pd.DataFrame({
+            '列名': self.columns,
+            '数据类型': [self.dtypes[col] for col in self.columns],
+            '空值数': [self.null_counts.get(col, 0) for col in self.columns],
+            '不同值个数': [self.cardinality.get(col) for col in self.columns],
+        })
+
+    def column_line(self, col: str) -> str:
+        """提示词中单列的描述; 文本列附带基数与取值示例"""
+        line = f"  * {col}: {self.dtypes[col]}"
+        if col in self.text_columns and col in self.cardinality:
+            line += f" ({self.cardinality[col]}个不同值, 如: {', '.join(self.samples[col])})"
+        return line
+
+    def prompt_text(self, source: Any = None, head_rows: int = 5) -> str:
+        """用于提示词的数据集描述"""
+        info = f"""
+数据集信息:
+- 文件路径: {source}
+- 行数: {self.rows}
+- 列数: {len(self.columns)}
+- 列名和类型:
+"""
+        for col in self.columns:
+            info += self.column_line(col) + "\n"
+
+        # 仅显示前几行且限制宽度，避免超长token
+        if head_rows:
+            info += f"\n前{head_rows}行数据示例:\n{self.head.head(head_rows).to_string(max_cols=10, max_colwidth=30)}\n"
+        return info
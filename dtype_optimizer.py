@@ -0,0 +1,138 @@
+"""
+加载后的内存优化
+维度类数值列(取值少且数值小, 如年份、评分)无损降为更窄的类型, 低基数文本列可选转为 category,
+其余文本列可选转为Arrow字符串, 并返回逐列报告与优化前后的内存占用
+
+category 会改变生成代码的行为(pandas 2.x 的 groupby 默认列出所有类别, 写入新值、拼接字符串会报错),
+因此默认不转换, 启用时提示词中说明用法
+"""
+
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+# 不同值个数占非空行数的比例不超过该值的文本列转为 category
+MAX_CATEGORY_RATIO = 0.5
+
+# 不同值个数不超过该值的数值列视为维度(如年份、评分)才降为更窄的类型;
+# 度量列(如销售额、数量)保持64位, 避免相乘等逐元素运算在窄类型中溢出或损失精度
+MAX_DIMENSION_VALUES = 1000
+
+# 降为int32的整数列的最大绝对值: 两个这样的列相乘仍在int32范围内
+MAX_NARROW_INT = 46340
+
+# 行数少于该值时不做优化(节省的内存可以忽略)
+MIN_ROWS = 1000
+
+
+def _is_plain_text(series: pd.Series) -> bool:
+    dtype = series.dtype
+    return dtype == 'object' or (pd.api.types.is_string_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype))
+
+
+def _is_arrow_string(dtype: Any) -> bool:
+    return getattr(dtype, "storage", None) == "pyarrow" or isinstance(dtype, getattr(pd, "ArrowDtype", ()))
+
+
+def _is_dimension(series: pd.Series) -> bool:
+    return series.nunique() <= MAX_DIMENSION_VALUES
+
+
+def _downcast_int(series: pd.Series) -> pd.Series:
+    """维度类整数列 → int32(不再更窄), 数值较大或取值较多的列保持原类型"""
+    if series.empty or series.dtype.itemsize <= np.dtype(np.int32).itemsize:
+        return series
+    if max(abs(int(series.min())), abs(int(series.max()))) > MAX_NARROW_INT or not _is_dimension(series):
+        return series
+    return series.astype(np.int32)
+
+
+def _downcast_float(series: pd.Series) -> pd.Series:
+    """维度类 float64 → float32, 只在所有值都能精确表示时转换"""
+    if series.dtype != np.float64 or not _is_dimension(series):
+        return series
+    narrowed = series.astype(np.float32)
+    if ((narrowed.astype(np.float64) == series) | series.isna()).all():
+        return narrowed
+    return series
+
+
+def _convert(series: pd.Series, arrow_strings: bool, categories: bool, max_category_ratio: float) -> pd.Series:
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return series
+    if pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+        return _downcast_int(series)
+    if pd.api.types.is_float_dtype(dtype) and isinstance(dtype, np.dtype):
+        return _downcast_float(series)
+    if _is_plain_text(series):
+        non_null = int(series.notna().sum())
+        try:
+            unique = series.nunique(dropna=True)
+        except TypeError:
+            return series  # 不可哈希的值
+        if categories and non_null and unique <= non_null * max_category_ratio:
+            return series.astype("category")
+        if arrow_strings and not _is_arrow_string(dtype) and pd.api.types.infer_dtype(series, skipna=True) == "string":
+            return series.astype("string[pyarrow]")
+    return series
+
+
+def optimize_dtypes(
+    df: pd.DataFrame,
+    arrow_strings: bool = False,
+    categories: bool = False,
+    max_category_ratio: float = MAX_CATEGORY_RATIO,
+) -> Dict[str, Any]:
+    """
+    压缩数据框的列类型(原地修改)
+
+    Args:
+        df: 清洗后的数据框
+        arrow_strings: 是否将其余纯文本列转为Arrow字符串(需要pyarrow)
+        categories: 是否将低基数文本列转为 category
+        max_category_ratio: 转为 category 的最大 不同值个数/非空行数
+
+    Returns:
+        {"before", "after", "columns"} - before/after 为优化前后的内存占用(字节),
+        columns 为逐列报告 {"column", "from_dtype", "to_dtype", "before", "after"}
+    """
+    before = df.memory_usage(deep=True, index=False)
+    columns: List[Dict[str, Any]] = []
+    if len(df) >= MIN_ROWS:
+        if arrow_strings:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                print("⚠ 未安装pyarrow, 不转换为Arrow字符串")
+                arrow_strings = False
+        for col in df.columns:
+            original = df[col]
+            converted = _convert(original, arrow_strings, categories, max_category_ratio)
+            if converted is original or converted.dtype == original.dtype:
+                continue
+            df[col] = converted
+            columns.append({
+                "column": str(col),
+                "from_dtype": str(original.dtype),
+                "to_dtype": str(converted.dtype),
+                "before": int(before[col]),
+                "after": int(converted.memory_usage(deep=True, index=False)),
+            })
+    total_before = int(before.sum())
+    total_after = total_before - sum(item["before"] - item["after"] for item in columns)
+    return {"before": total_before, "after": total_after, "columns": columns}
+
+
+def format_memory_report(report: Dict[str, Any]) -> str:
+    """将内存优化报告格式化为简短文本"""
+    before, after = report["before"], report["after"]
+    saved = 1 - after / before if before else 0
+    text = f"{before / 1024 ** 2:.1f}MB → {after / 1024 ** 2:.1f}MB (-{saved:.0%})"
+    if report["columns"]:
+        text += ": " + ", ".join(
+            f"{item['column']} ({item['from_dtype']} → {item['to_dtype']})" for item in report["columns"]
+        )
+    return text
@@ -0,0 +1,213 @@
+"""
+代码执行结果缓存
+以 规范化代码(AST)哈希 + 数据版本 为键缓存成功执行的输出文本和图形(PNG字节):
+- 内存层: 进程内按LRU保留最近的结果, 重复执行约为微秒级
+- 磁盘层: 持久化在本地SQLite中, 支持过期时间(TTL)和按最近访问时间的容量淘汰(LRU)
+结果依赖随机数、当前时间、外部文件或界面组件的代码(见 is_cacheable)不缓存
+"""
+
+import ast
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+from csv_streaming import get_store_dir
+
+
+# 导入这些模块的代码结果不确定或有副作用
+_UNSAFE_MODULES = {
+    "random", "time", "datetime", "uuid", "secrets", "os", "sys", "subprocess", "shutil",
+    "pathlib", "socket", "requests", "urllib", "glob", "io",
+}
+
+# 引用这些名称的代码: 读写文件、交互输入、直接渲染Streamlit组件
+_UNSAFE_NAMES = {"open", "input", "eval", "exec", "st", "__import__"} | _UNSAFE_MODULES
+
+# 调用这些方法的代码: 当前时间、随机抽样、写文件
+_UNSAFE_ATTRIBUTES = {
+    "now", "today", "utcnow", "random", "rand", "randn", "randint", "choice", "shuffle", "permutation",
+    "sample", "default_rng", "savefig", "to_csv", "to_excel", "to_parquet", "to_pickle", "to_json",
+    "to_feather", "to_sql", "write_csv", "write_parquet", "read_csv", "read_excel", "read_parquet",
+}
+
+
+def is_cacheable(code: str) -> bool:
+    """代码的结果是否只取决于代码本身和数据(无法解析的代码不缓存)"""
+    try:
+        return _is_cacheable_tree(ast.parse(code))
+    except SyntaxError:
+        return False
+
+
+def _is_cacheable_tree(tree: ast.AST) -> bool:
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            if any(alias.name.split(".")[0] in _UNSAFE_MODULES for alias in node.names):
+                return False
+        elif isinstance(node, ast.ImportFrom):
+            if (node.module or "").split(".")[0] in _UNSAFE_MODULES:
+                return False
+        elif isinstance(node, ast.Name) and node.id in _UNSAFE_NAMES:
+            return False
+        elif isinstance(node, ast.Attribute) and node.attr in _UNSAFE_ATTRIBUTES:
+            return False
+    return True
+
+
+def figure_bytes(figure: Any) -> Optional[bytes]:
+    """图形的PNG字节(进程执行后端已是字节)"""
+    if figure is None or isinstance(figure, bytes):
+        return figure
+    buffer = BytesIO()
+    figure.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+class ExecutionCache:
+    """代码执行结果的两级缓存(内存 + 磁盘)"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = 7 * 24 * 3600,
+        max_entries: int = 1000,
+        max_bytes: int = 256 * 1024 ** 2,
+        memory_entries: int = 64,
+        memory_bytes: int = 32 * 1024 ** 2,
+    ):
+        """
+        Args:
+            path: SQLite文件路径, 默认放在缓存目录下; 传入 ":memory:" 时不持久化
+            ttl: 条目有效期(秒)
+            max_entries: 磁盘层最多保留的条目数
+            max_bytes: 磁盘层输出和图形的总字节数上限, 超出时淘汰最久未访问的条目
+            memory_entries: 内存层最多保留的条目数
+            memory_bytes: 内存层的总字节数上限
+        """
+        self.path = path or os.path.join(get_store_dir(), "execution_cache.sqlite")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self._memory: "OrderedDict[str, Tuple[str, Optional[bytes], float, int]]" = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS execution_cache (
+                    key TEXT PRIMARY KEY,
+                    output TEXT NOT NULL,
+                    figure BLOB,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_execution_cache_access ON execution_cache(last_access)")
+
+    @staticmethod
+    def make_key(code: str, data_version: str, context: str = "") -> Optional[str]:
+        """
+        缓存键: 规范化代码 + 数据版本 + 执行环境(如查询引擎、是否捕获图形)
+        代码解析为AST后序列化, 注释、空白、换行与引号风格不影响键
+
+        Returns:
+            键; 代码不可缓存时返回None
+        """
+        if not data_version:
+            return None
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return None
+        if not _is_cacheable_tree(tree):
+            return None
+        normalized = ast.dump(tree, annotate_fields=False, include_attributes=False)
+        raw = f"{normalized}\0{data_version}\0{context}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        查找缓存的执行结果
+
+        Returns:
+            {"output", "figure", "tier": "memory" | "disk"} 或 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[2] > now - self.ttl:
+                self._memory.move_to_end(key)
+                return {"output": entry[0], "figure": entry[1], "tier": "memory"}
+            row = self._conn.execute(
+                "SELECT output, figure, created_at FROM execution_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE execution_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._remember(key, row[0], row[1], row[2])
+        return {"output": row[0], "figure": row[1], "tier": "disk"}
+
+    def put(self, key: str, output: str, figure: Optional[bytes] = None):
+        """写入(或覆盖)执行结果"""
+        now = time.time()
+        size = len(output.encode("utf-8")) + len(figure or b"")
+        with self._lock:
+            self._remember(key, output, figure, now)
+            if size > self.max_bytes:
+                return
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO execution_cache (key, output, figure, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, output, figure, size, now, now),
+                )
+                self._evict(now)
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._memory.clear()
+            self._memory_size = 0
+            self._conn.execute("DELETE FROM execution_cache")
+
+    def _remember(self, key: str, output: str, figure: Optional[bytes], created_at: float):
+        """写入内存层, 按条目数和总字节数淘汰最久未访问的条目(调用方持有锁)"""
+        size = len(output) + len(figure or b"")
+        if size > self.memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= previous[3]
+        self._memory[key] = (output, figure, created_at, size)
+        self._memory_size += size
+        while len(self._memory) > self.memory_entries or self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= evicted[3]
+
+    def _evict(self, now: float):
+        """删除过期条目, 并按最近访问时间淘汰超出条目数或总字节数的条目(调用方持有锁)"""
+        self._conn.execute("DELETE FROM execution_cache WHERE created_at <= ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM execution_cache WHERE key IN ("
+            "SELECT key FROM execution_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM execution_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM execution_cache ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM execution_cache WHERE key = ?", (key,))
+            total -= size
@@ -0,0 +1,127 @@
+"""
+离线测试用的脚本化LLM
+按预设规则返回代码或解释, 不访问网络, 接口与LangChain聊天模型的 invoke/stream 一致
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional
+
+
+class FakeResponse:
+    """模拟LangChain的AIMessage; usage_metadata 为 input_tokens/output_tokens 用量"""
+
+    def __init__(self, content: str, usage_metadata: Optional[Dict[str, int]] = None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+class FakeAPIError(Exception):
+    """模拟提供商返回的HTTP错误(如 402 余额不足、429 限流、503 不可用)"""
+
+    MESSAGES = {
+        402: "Insufficient Balance",
+        429: "Rate limit reached, please retry after 1 seconds",
+        500: "Internal server error",
+        503: "Service unavailable",
+    }
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        super().__init__(f"Error code: {status_code} - {self.MESSAGES.get(status_code, 'error')}")
+
+
+class FakeLLM:
+    """
+    脚本化LLM
+
+    Args:
+        code_for: 根据用户问题返回代码(不含代码块标记)的函数
+        explanation: 解释请求返回的固定文本
+        latency: 每次调用模拟的网络延迟(秒)
+        trailer: 代码块之后附加的说明文字(模拟模型在代码后继续输出)
+        chunk_size: 流式输出时每段的字符数, 流式调用的延迟按段数平均分摊
+        errors: 按调用顺序依次使用的HTTP错误码(None表示该次正常返回), 用完后均正常返回;
+            如 [429, None] 表示首次调用限流, itertools.repeat(402) 表示始终余额不足
+    """
+
+    def __init__(
+        self,
+        code_for: Callable[[str], str],
+        explanation: str = "这是分析结果的解释。",
+        latency: float = 0.0,
+        trailer: str = "",
+        chunk_size: int = 8,
+        errors: Optional[Iterable[Optional[int]]] = None,
+    ):
+        self.code_for = code_for
+        self.explanation = explanation
+        self.latency = latency
+        self.trailer = trailer
+        self.chunk_size = chunk_size
+        self._errors = iter(errors) if errors is not None else None
+        self.calls = 0
+        self.streamed_chunks = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages: List[Any], **kwargs) -> FakeResponse:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def ainvoke(self, messages: List[Any], **kwargs) -> FakeResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages)
+
+    def stream(self, messages: List[Any], **kwargs) -> Iterator[FakeResponse]:
+        response = self._respond(messages)
+        pieces = self._pieces(response.content)
+        for index, piece in enumerate(pieces):
+            if self.latency:
+                time.sleep(self.latency / len(pieces))
+            with self._lock:
+                self.streamed_chunks += 1
+            yield self._chunk(response, pieces, index)
+
+    async def astream(self, messages: List[Any], **kwargs) -> AsyncIterator[FakeResponse]:
+        response = self._respond(messages)
+        pieces = self._pieces(response.content)
+        for index, piece in enumerate(pieces):
+            if self.latency:
+                await asyncio.sleep(self.latency / len(pieces))
+            with self._lock:
+                self.streamed_chunks += 1
+            yield self._chunk(response, pieces, index)
+
+    def _pieces(self, text: str) -> List[str]:
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+
+    @staticmethod
+    def _chunk(response: FakeResponse, pieces: List[str], index: int) -> FakeResponse:
+        # 与LangChain一致, token用量只出现在最后一段(提前结束读取时不会收到)
+        return FakeResponse(pieces[index], response.usage_metadata if index == len(pieces) - 1 else None)
+
+    def _respond(self, messages: List[Any]) -> FakeResponse:
+        with self._lock:
+            self.calls += 1
+            status = next(self._errors, None) if self._errors is not None else None
+        if status is not None:
+            raise FakeAPIError(status)
+        question = last_question(messages)
+        if question is not None:
+            content = f"```python\n{self.code_for(question)}\n```{self.trailer}"
+        else:
+            content = self.explanation
+        # 按约4个字符一个token估算用量
+        prompt_chars = sum(len(str(getattr(message, "content", ""))) for message in messages)
+        return FakeResponse(content, {"input_tokens": prompt_chars // 4, "output_tokens": max(1, len(content) // 4)})
+
+
+def last_question(messages: List[Any]) -> Optional[str]:
+    """从代码生成请求中提取用户问题"""
+    last = messages[-1].content if messages else ""
+    if "请生成Python代码来回答以下问题" in last:
+        return last.split("\n\n", 1)[-1]
+    return None
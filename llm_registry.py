@@ -0,0 +1,221 @@
+"""
+进程级LLM客户端注册表
+按 (提供商, 模型, Base URL, API Key指纹) 缓存客户端, 所有分析器与会话共用:
+- 切换回用过的提供商不再重新创建客户端, HTTP连接池与TLS会话得以保留
+- OpenAI兼容接口(gpt/deepseek/qwen3)同一 Base URL 共用一个 httpx 连接池
+- 同步调用在所有线程间共用一个实例; 异步调用每个事件循环一个实例
+  (异步连接绑定创建它的事件循环, 跨循环复用会报 "Event loop is closed")
+各提供商的SDK在首次创建其客户端时才导入(导入全部SDK需要数秒)
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# 共享连接池的大小
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+
+# 提供商别名
+_ALIASES = {"qwen": "qwen3"}
+
+# OpenAI兼容接口的提供商
+_OPENAI_COMPATIBLE = {"gpt", "deepseek", "qwen3"}
+
+
+def provider_config(provider: str) -> Dict[str, Optional[str]]:
+    """
+    读取提供商的模型、Base URL 和 API Key
+
+    Returns:
+        {"provider", "model", "base_url", "api_key"}
+    """
+    provider = _ALIASES.get(provider.lower(), provider.lower())
+    if provider == "gemini":
+        return {"provider": provider, "model": "gemini-1.5-pro", "base_url": None, "api_key": os.getenv("GOOGLE_API_KEY")}
+    if provider == "gpt":
+        return {"provider": provider, "model": "gpt-3.5-turbo", "base_url": None, "api_key": os.getenv("OPENAI_API_KEY")}
+    if provider == "claude":
+        return {"provider": provider, "model": "claude-3-opus-20240229", "base_url": None, "api_key": os.getenv("ANTHROPIC_API_KEY")}
+    if provider == "deepseek":
+        api_key = os.getenv("DEEPSEEK_API_KEY")
+        if not api_key:
+            raise ValueError("未找到 DEEPSEEK_API_KEY, 请在 .env 中配置 DeepSeek API Key")
+        return {
+            "provider": provider,
+            "model": os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
+            "base_url": os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com"),
+            "api_key": api_key,
+        }
+    if provider == "qwen3":
+        api_key = os.getenv("QWEN_API_KEY")
+        if not api_key:
+            raise ValueError("未找到 QWEN_API_KEY, 请在 .env 中配置 Qwen API Key")
+        return {
+            "provider": provider,
+            "model": os.getenv("QWEN_MODEL", "qwen-plus"),
+            "base_url": os.getenv("QWEN_API_BASE", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
+            "api_key": api_key,
+        }
+    raise ValueError(f"不支持的LLM提供商: {provider}")
+
+
+def client_key(config: Dict[str, Optional[str]]) -> Tuple[str, str, Optional[str], str]:
+    """注册表键; 包含API Key指纹, 更换Key后会创建新客户端"""
+    api_key = config.get("api_key") or ""
+    fingerprint = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else ""
+    return config["provider"], config["model"], config.get("base_url"), fingerprint
+
+
+class PooledClient:
+    """
+    可在线程与事件循环间安全共享的LLM客户端
+    提供与LangChain聊天模型相同的 invoke/ainvoke/stream/astream 接口
+    """
+
+    def __init__(self, config: Dict[str, Optional[str]], factory: Callable[[bool], Any]):
+        """
+        Args:
+            config: provider_config 返回的配置
+            factory: factory(for_async) 创建底层聊天模型
+        """
+        self.provider = config["provider"]
+        self.model = config["model"]
+        self.base_url = config.get("base_url")
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._sync_client: Any = None
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+    def __repr__(self) -> str:
+        return f"PooledClient(provider={self.provider!r}, model={self.model!r})"
+
+    def sync_client(self) -> Any:
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = self._factory(False)
+            return self._sync_client
+
+    def async_client(self) -> Any:
+        """当前事件循环对应的客户端"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = self._factory(True)
+            return client
+
+    def invoke(self, messages: List[Any], **kwargs) -> Any:
+        return self.sync_client().invoke(messages, **kwargs)
+
+    def stream(self, messages: List[Any], **kwargs):
+        return self.sync_client().stream(messages, **kwargs)
+
+    async def ainvoke(self, messages: List[Any], **kwargs) -> Any:
+        return await self.async_client().ainvoke(messages, **kwargs)
+
+    async def astream(self, messages: List[Any], **kwargs):
+        async for chunk in self.async_client().astream(messages, **kwargs):
+            yield chunk
+
+
+class ClientRegistry:
+    """客户端注册表(线程安全)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str, Optional[str], str], PooledClient] = {}
+        self._http_clients: Dict[Optional[str], Any] = {}
+        self._async_http_clients: Dict[Optional[str], "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]"] = {}
+        self.created = 0
+
+    def get(self, provider: str) -> PooledClient:
+        """获取(必要时创建)提供商的共享客户端"""
+        config = provider_config(provider)
+        key = client_key(config)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = PooledClient(config, lambda for_async: self._build(config, for_async))
+            return client
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def clear(self):
+        """丢弃所有客户端并关闭共享的同步连接池(异步连接池随事件循环回收)"""
+        with self._lock:
+            http_clients = list(self._http_clients.values())
+            self._clients.clear()
+            self._http_clients.clear()
+            self._async_http_clients.clear()
+        for http_client in http_clients:
+            try:
+                http_client.close()
+            except Exception:
+                pass
+
+    def _build(self, config: Dict[str, Optional[str]], for_async: bool) -> Any:
+        provider = config["provider"]
+        self.created += 1
+        if provider == "gemini":
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            return ChatGoogleGenerativeAI(model=config["model"], temperature=0)
+        if provider == "claude":
+            from langchain_anthropic import ChatAnthropic
+            return ChatAnthropic(model_name=config["model"], temperature=0)
+        if provider in _OPENAI_COMPATIBLE:
+            from langchain_openai import ChatOpenAI
+            kwargs: Dict[str, Any] = {"model": config["model"], "temperature": 0}
+            if config.get("base_url"):
+                kwargs.update(api_key=config["api_key"], base_url=config["base_url"])
+            if for_async:
+                kwargs["http_async_client"] = self._async_http_client(config.get("base_url"))
+            else:
+                kwargs["http_client"] = self._http_client(config.get("base_url"))
+            return ChatOpenAI(**kwargs)
+        raise ValueError(f"不支持的LLM提供商: {provider}")
+
+    def _http_client(self, base_url: Optional[str]) -> Any:
+        """同一 Base URL 共用的同步连接池"""
+        import httpx
+
+        with self._lock:
+            client = self._http_clients.get(base_url)
+            if client is None:
+                client = self._http_clients[base_url] = httpx.Client(limits=_limits(), timeout=None)
+            return client
+
+    def _async_http_client(self, base_url: Optional[str]) -> Any:
+        """同一 Base URL、同一事件循环共用的异步连接池"""
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            per_loop = self._async_http_clients.setdefault(base_url, weakref.WeakKeyDictionary())
+            client = per_loop.get(loop)
+            if client is None:
+                client = per_loop[loop] = httpx.AsyncClient(limits=_limits(), timeout=None)
+            return client
+
+
+def _limits():
+    import httpx
+
+    return httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+
+
+_REGISTRY = ClientRegistry()
+
+
+def get_client(provider: str) -> PooledClient:
+    """进程级共享的LLM客户端"""
+    return _REGISTRY.get(provider)
+
+
+def get_registry() -> ClientRegistry:
+    return _REGISTRY
@@ -0,0 +1,229 @@
+"""
+按token预算组装代码生成提示词
+完整描述超出预算时逐级压缩: 先精简数据示例和对话历史, 再按与问题的相关度排序列,
+只详细描述最相关的列, 其余列按类型折叠为列名摘要; 仍超出时去掉对话历史,
+最紧凑档位仍超出预算(提示正文本身过长)时给出警告并在统计中记录超出量
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dataset_profile import DatasetProfile
+
+
+# 各提供商代码生成提示词的token预算(系统提示 + 问题)
+PROVIDER_BUDGETS = {
+    "gemini": 16000,
+    "gpt": 12000,
+    "claude": 12000,
+    "deepseek": 12000,
+    "qwen3": 8000,
+}
+DEFAULT_BUDGET = 8000
+
+_CJK = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+_NAME_PARTS = re.compile(r'[^0-9a-zA-Z\u3400-\u9fff]+|(?<=[a-z])(?=[A-Z])')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计token数: 中日韩字符约1个token, 其余字符约4个一个token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def budget_for(provider: Optional[str]) -> int:
+    """提供商的提示词预算, 可用环境变量 EXCEL_AGENT_PROMPT_BUDGET 统一覆盖"""
+    override = os.getenv("EXCEL_AGENT_PROMPT_BUDGET")
+    if override:
+        return int(override)
+    return PROVIDER_BUDGETS.get((provider or "").lower(), DEFAULT_BUDGET)
+
+
+def rank_columns(question: str, profile: DatasetProfile) -> List[str]:
+    """按与问题的相关度对列排序(列名出现在问题中 > 列名片段匹配 > 取值出现在问题中), 同分保持原顺序"""
+    text = question.lower()
+    parts = {col: {part.lower() for part in _NAME_PARTS.split(col) if len(part) >= 2} for col in profile.columns}
+    # 半数以上列名共有的片段(如统一前缀)没有区分度, 不参与匹配
+    frequency: Dict[str, int] = {}
+    for col_parts in parts.values():
+        for part in col_parts:
+            frequency[part] = frequency.get(part, 0) + 1
+    common = {part for part, count in frequency.items() if count > max(1, len(profile.columns) // 2)}
+
+    scores = {}
+    for col in profile.columns:
+        name = col.lower()
+        score = 10 if name and name in text else 0
+        score += 2 * sum(1 for part in parts[col] - common if part in text)
+        score += 3 * sum(1 for value in profile.samples.get(col, []) if len(value) >= 2 and value.lower() in text)
+        scores[col] = score
+    return sorted(profile.columns, key=lambda col: -scores[col])
+
+
+@dataclass
+class _Level:
+    """一档压缩参数"""
+    detailed_columns: Optional[int]  # 详细描述的列数, None表示全部
+    head_rows: int
+    history_turns: int
+    history_chars: int
+    include_results: bool
+    error_chars: int
+    summary_lines: int  # 更早轮次摘要的条数
+    detailed_tables: Optional[int]  # 多表数据集中详细描述的表数, None表示全部
+
+
+# 由宽松到紧凑的压缩档位, 依次尝试直到不超出预算
+LEVELS = [
+    _Level(None, 5, 5, 200, True, 4000, 10, None),
+    _Level(None, 3, 3, 200, True, 2000, 5, 8),
+    _Level(40, 3, 2, 150, False, 1500, 3, 4),
+    _Level(15, 0, 1, 100, False, 1000, 0, 2),
+    _Level(5, 0, 0, 0, False, 500, 0, 1),
+    _Level(0, 0, 0, 0, False, 300, 0, 1),
+]
+
+
+class PromptBuilder:
+    """代码生成提示词构建器"""
+
+    def __init__(self, profile: DatasetProfile, budget: int, source: Any = None, catalog: Any = None):
+        """
+        Args:
+            profile: 数据集概要
+            budget: token预算
+            source: 数据来源(写入提示词的文件路径)
+            catalog: 多表数据集(DatasetCatalog), 提供时描述各表, 压缩时只详细描述与问题最相关的表
+        """
+        self.profile = profile
+        self.budget = budget
+        self.source = source
+        self.catalog = catalog
+
+    def build(
+        self,
+        question: str,
+        render: Callable[[str], str],
+        history: List[Dict[str, Any]],
+        error: Optional[str] = None,
+        summaries: Optional[List[str]] = None,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        构建系统提示
+
+        Args:
+            question: 用户问题
+            render: 根据数据集描述生成系统提示正文的函数
+            history: 执行历史(question/code/result)
+            error: 上一次执行的错误信息(重试时)
+            summaries: 已移出对话记忆的更早轮次摘要(见 conversation_memory)
+
+        Returns:
+            (system_prompt, stats) - stats 包含估计的token数、使用的压缩档位、详细/折叠的列数,
+            以及最紧凑档位仍超出预算时超出的token数(over_budget, 未超出为0)
+        """
+        question_tokens = estimate_tokens(question)
+        ranked = None
+        for index, level in enumerate(LEVELS):
+            if self.catalog is not None:
+                dataset_info = self.catalog.prompt_text(question, level.head_rows, level.detailed_tables)
+                collapsed = 0
+            else:
+                if level.detailed_columns is not None and ranked is None:
+                    ranked = rank_columns(question, self.profile)
+                dataset_info, collapsed = self._dataset_section(level, ranked)
+            prompt = render(dataset_info) + self._error_section(error, level) + self._history_section(history, level, summaries or [])
+            tokens = estimate_tokens(prompt) + question_tokens
+            if tokens <= self.budget or index == len(LEVELS) - 1:
+                over_budget = max(0, tokens - self.budget)
+                if over_budget:
+                    print(f"⚠ 提示词约{tokens} tokens, 压缩到最紧凑档位后仍超出预算({self.budget} tokens)")
+                return prompt, {
+                    "estimated_tokens": tokens,
+                    "budget": self.budget,
+                    "level": index,
+                    "columns_detailed": len(self.profile.columns) - collapsed,
+                    "columns_collapsed": collapsed,
+                    "over_budget": over_budget,
+                }
+
+    def _dataset_section(self, level: _Level, ranked: Optional[List[str]]) -> Tuple[str, int]:
+        """数据集描述及被折叠的列数"""
+        profile = self.profile
+        if level.detailed_columns is None or len(profile.columns) <= level.detailed_columns:
+            return profile.prompt_text(self.source, head_rows=level.head_rows), 0
+
+        detailed = ranked[:level.detailed_columns]
+        kept = set(detailed)
+        # 折叠列保持原顺序
+        rest = [col for col in profile.columns if col not in kept]
+        return self._compact_text(detailed, rest, level.head_rows), len(rest)
+
+    def _compact_text(self, detailed: List[str], rest: List[str], head_rows: int) -> str:
+        profile = self.profile
+        kept = set(detailed)
+        info = f"""
+数据集信息:
+- 文件路径: {self.source}
+- 行数: {profile.rows}
+- 列数: {len(profile.columns)}
+- 与问题最相关的列:
+"""
+        for col in detailed:
+            info += profile.column_line(col) + "\n"
+
+        if rest:
+            by_dtype: Dict[str, List[str]] = {}
+            for col in rest:
+                by_dtype.setdefault(profile.dtypes[col], []).append(col)
+            info += f"- 其余{len(rest)}列(仅列名, 按类型分组):\n"
+            # 折叠部分最多占用一半预算
+            allowance = self.budget // 2
+            for dtype, cols in by_dtype.items():
+                names = []
+                for col in cols:
+                    allowance -= estimate_tokens(col) + 1
+                    if allowance < 0:
+                        break
+                    names.append(col)
+                omitted = len(cols) - len(names)
+                line = f"  * {dtype}: {', '.join(names)}"
+                if omitted:
+                    line += f" 等(另有{omitted}列未列出, 可用 df.columns 查看)"
+                info += line + "\n"
+
+        if head_rows:
+            sample = profile.head[[col for col in profile.head.columns if str(col) in kept][:10]]
+            info += f"\n前{head_rows}行数据示例(相关列):\n{sample.head(head_rows).to_string(max_colwidth=30)}\n"
+        return info
+
+    @staticmethod
+    def _error_section(error: Optional[str], level: _Level) -> str:
+        if not error:
+            return ""
+        if len(error) > level.error_chars:
+            # 保留结尾, traceback的关键信息在最后
+            error = "..." + error[-level.error_chars:]
+        return f"\n\n上一次代码执行失败,错误信息:\n{error}\n\n请修正错误,生成正确的代码。"
+
+    @staticmethod
+    def _history_section(history: List[Dict[str, Any]], level: _Level, summaries: List[str]) -> str:
+        recent = history[-level.history_turns:] if level.history_turns else []
+        if not recent:
+            return ""
+        limit = level.history_chars
+        text = "\n\n对话历史:\n"
+        shown = summaries[-level.summary_lines:] if level.summary_lines else []
+        if shown:
+            text += "更早的对话摘要:\n" + "".join(f"- {line}\n" for line in shown)
+        older = len(history) - len(recent) + len(summaries) - len(shown)
+        if older:
+            text += f"(更早的{older}轮已省略)\n"
+        for i, hist in enumerate(recent, 1):
+            text += f"\n问题{i}: {hist['question']}\n"
+            text += f"代码: {hist['code'][:limit]}...\n"
+            if level.include_results:
+                text += f"结果: {hist['result'][:limit]}...\n"
+        return text
@@ -0,0 +1,488 @@
+"""
+LLM提供商路由
+按提供商统计滚动窗口内的延迟(p50/p95)、错误率和限流次数, 把请求发往当前最健康的提供商:
+- 余额不足(402)、限流(429)、服务不可用等错误自动切换到下一个提供商
+- 熔断: 连续失败或限流时暂停使用该提供商, 冷却后半开放行试探请求
+- 对冲(可选): 请求超过设定时间仍未返回时, 同时向第二个提供商发起请求, 取先成功者
+ProviderRouter 提供与LangChain聊天模型相同的 invoke/ainvoke/stream/astream 接口, 可直接作为 DataAnalyzer.llm
+"""
+
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+
+# 默认优先顺序(统计数据相同时按此顺序)及对应的API Key环境变量
+PROVIDER_ORDER = ["gemini", "gpt", "claude", "deepseek", "qwen3"]
+PROVIDER_ENV_KEYS = {
+    "gemini": "GOOGLE_API_KEY",
+    "gpt": "OPENAI_API_KEY",
+    "claude": "ANTHROPIC_API_KEY",
+    "deepseek": "DEEPSEEK_API_KEY",
+    "qwen3": "QWEN_API_KEY",
+}
+
+# 可切换到其他提供商重试的错误类型
+FAILOVER_ERRORS = {"payment", "rate_limit", "unavailable"}
+
+# 余额不足时的熔断时长(秒), 通常需要人工充值
+PAYMENT_COOLDOWN = 600.0
+
+_RETRY_AFTER = re.compile(r'retry[- ]after[^0-9]{0,10}(\d+(?:\.\d+)?)', re.IGNORECASE)
+
+
+def available_providers() -> List[str]:
+    """已配置API Key的提供商(按默认优先顺序)"""
+    return [name for name in PROVIDER_ORDER if os.getenv(PROVIDER_ENV_KEYS[name])]
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for candidate in (error, getattr(error, "response", None)):
+        code = getattr(candidate, "status_code", None)
+        if isinstance(code, int):
+            return code
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def classify_error(error: Union[BaseException, str]) -> str:
+    """
+    将LLM调用错误归类
+
+    Returns:
+        "payment"(余额/配额不足) | "rate_limit"(限流) | "unavailable"(超时、连接失败、5xx) | "other"
+    """
+    status = None if isinstance(error, str) else _status_code(error)
+    msg = str(error).lower()
+    name = "" if isinstance(error, str) else type(error).__name__.lower()
+
+    if status == 402 or (
+        "insufficient" in msg and ("balance" in msg or "quota" in msg)
+    ) or " 402" in msg or "code: 402" in msg or ("payment" in msg and "required" in msg):
+        return "payment"
+    if status == 429 or " 429" in msg or "rate limit" in msg or "ratelimit" in name \
+            or "too many requests" in msg or "resource_exhausted" in msg:
+        return "rate_limit"
+    if (status is not None and status >= 500) or "timeout" in name or "timed out" in msg \
+            or "connection" in name or "overloaded" in msg or "unavailable" in msg:
+        return "unavailable"
+    return "other"
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """从错误响应中读取 Retry-After(秒)"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value is None:
+        match = _RETRY_AFTER.search(str(error))
+        value = match.group(1) if match else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class ProviderHealth:
+    """单个提供商的滚动窗口统计和熔断状态"""
+
+    def __init__(self, name: str, window: int = 50, failure_threshold: int = 3, cooldown: float = 30.0):
+        """
+        Args:
+            window: 统计最近多少次调用
+            failure_threshold: 连续失败多少次后熔断
+            cooldown: 熔断时长(秒), 限流响应带 Retry-After 时以其为准
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._samples: deque = deque(maxlen=window)  # (成功与否, 延迟秒数, 错误类型)
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self._samples.append((True, latency, None))
+            self._consecutive_failures = 0
+            self._open_until = 0.0
+
+    def record_failure(self, kind: str, retry_after: Optional[float] = None):
+        with self._lock:
+            self._samples.append((False, None, kind))
+            self._consecutive_failures += 1
+            if kind == "payment":
+                cooldown = PAYMENT_COOLDOWN
+            elif kind == "rate_limit":
+                cooldown = retry_after if retry_after is not None else self.cooldown
+            elif self._consecutive_failures >= self.failure_threshold:
+                cooldown = self.cooldown
+            else:
+                return
+            self._open_until = max(self._open_until, time.monotonic() + cooldown)
+
+    def is_available(self) -> bool:
+        """熔断未生效或冷却已结束(半开, 放行试探请求)"""
+        return time.monotonic() >= self._open_until
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(latency for ok, latency, _ in self._samples if ok)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, max(0, math.ceil(q * len(latencies)) - 1))
+        return latencies[index]
+
+    @property
+    def p50(self) -> Optional[float]:
+        return self.latency_percentile(0.5)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self.latency_percentile(0.95)
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            return sum(1 for ok, _, _ in self._samples if not ok) / len(self._samples)
+
+    @property
+    def rate_limited(self) -> int:
+        with self._lock:
+            return sum(1 for _, _, kind in self._samples if kind == "rate_limit")
+
+    def score(self) -> float:
+        """越小越健康: p95延迟按错误率放大(尚无样本时为0, 使新提供商先获得试探流量)"""
+        return (self.p95 or 0.0) * (1 + 4 * self.error_rate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "p50": self.p50,
+            "p95": self.p95,
+            "error_rate": round(self.error_rate, 3),
+            "rate_limited": self.rate_limited,
+            "calls": len(self._samples),
+            "available": self.is_available(),
+        }
+
+
+# 进程级的提供商健康统计, 所有分析器和路由器共享
+_HEALTH: Dict[str, ProviderHealth] = {}
+_health_lock = threading.Lock()
+
+
+def get_health(name: str, registry: Optional[Dict[str, ProviderHealth]] = None) -> ProviderHealth:
+    registry = _HEALTH if registry is None else registry
+    with _health_lock:
+        if name not in registry:
+            registry[name] = ProviderHealth(name)
+        return registry[name]
+
+
+def rank_providers(
+    names: List[str], exclude: Optional[str] = None, registry: Optional[Dict[str, ProviderHealth]] = None
+) -> List[str]:
+    """按健康程度排序: 可用的在前, 其次按 score, 最后按给定顺序"""
+    candidates = [name for name in names if name != exclude]
+    healths = {name: get_health(name, registry) for name in candidates}
+    return sorted(
+        candidates,
+        key=lambda name: (not healths[name].is_available(), healths[name].score(), candidates.index(name)),
+    )
+
+
+class ProviderRouterError(RuntimeError):
+    """所有提供商均调用失败"""
+
+    def __init__(self, errors: List[Tuple[str, BaseException]]):
+        self.errors = errors
+        detail = "; ".join(f"{name}: {error}" for name, error in errors)
+        super().__init__(f"所有LLM提供商均调用失败 - {detail}")
+
+
+class ProviderRouter:
+    """按健康状况在多个LLM提供商之间路由请求"""
+
+    def __init__(
+        self,
+        providers: Union[List[str], Dict[str, Any]],
+        client_factory: Optional[Callable[[str], Any]] = None,
+        hedge_after: Union[float, str, None] = None,
+        rate_limiters: Optional[Dict[str, Any]] = None,
+        health: Optional[Dict[str, ProviderHealth]] = None,
+    ):
+        """
+        Args:
+            providers: 提供商名称列表(配合 client_factory 按需创建客户端), 或 {名称: 客户端}
+            client_factory: 根据提供商名称创建LLM客户端
+            hedge_after: 对冲等待时间(秒); "p95" 表示使用首选提供商的p95延迟; None 不对冲
+            rate_limiters: 按提供商的限速器
+            health: 健康统计表, 默认使用进程级共享的统计(测试时可传入独立的字典)
+        """
+        if isinstance(providers, dict):
+            self.providers = list(providers)
+            self._clients = dict(providers)
+        else:
+            self.providers = list(providers)
+            self._clients = {}
+        if not self.providers:
+            raise ValueError("至少需要一个LLM提供商")
+        self.client_factory = client_factory
+        self.hedge_after = hedge_after
+        self.rate_limiters = rate_limiters or {}
+        self._health = health
+        self._clients_lock = threading.Lock()
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        self._last_provider: ContextVar[Optional[str]] = ContextVar(f"router_last_provider_{id(self)}", default=None)
+
+    @property
+    def last_provider(self) -> Optional[str]:
+        """当前上下文中最近一次成功响应的提供商"""
+        return self._last_provider.get()
+
+    def health(self, name: str) -> ProviderHealth:
+        return get_health(name, self._health)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: self.health(name).snapshot() for name in self.providers}
+
+    def ranked(self) -> List[str]:
+        """本次请求依次尝试的提供商(跳过熔断中的提供商; 全部熔断时仍按排序全部尝试)"""
+        ranked = rank_providers(self.providers, registry=self._health)
+        available = [name for name in ranked if self.health(name).is_available()]
+        return available or ranked
+
+    def client(self, name: str) -> Any:
+        with self._clients_lock:
+            if name not in self._clients:
+                if self.client_factory is None:
+                    raise ValueError(f"未提供 {name} 的LLM客户端")
+                self._clients[name] = self.client_factory(name)
+            return self._clients[name]
+
+    def _hedge_delay(self, name: str) -> Optional[float]:
+        if self.hedge_after == "p95":
+            return self.health(name).p95
+        return self.hedge_after
+
+    def _record_failure(self, name: str, error: BaseException) -> str:
+        kind = classify_error(error)
+        self.health(name).record_failure(kind, _retry_after(error))
+        print(f"⚠ LLM提供商 {name} 调用失败({kind}): {str(error)[:200]}")
+        return kind
+
+    # ---- 同步接口 ----
+
+    def _call(self, name: str, messages: List[Any], **kwargs) -> Any:
+        limiter = self.rate_limiters.get(name)
+        if limiter:
+            limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = self.client(name).invoke(messages, **kwargs)
+        except Exception as e:
+            self._record_failure(name, e)
+            raise
+        self.health(name).record_success(time.perf_counter() - start)
+        return name, response
+
+    def invoke(self, messages: List[Any], **kwargs) -> Any:
+        errors: List[Tuple[str, BaseException]] = []
+        queue = self.ranked()
+        while queue:
+            name = queue.pop(0)
+            delay = self._hedge_delay(name)
+            try:
+                if delay is not None and queue:
+                    winner, response = self._hedged(name, queue[0], delay, messages, **kwargs)
+                    if winner == queue[0]:
+                        queue.pop(0)
+                else:
+                    winner, response = self._call(name, messages, **kwargs)
+            except _HedgeFailed as e:
+                errors.extend(e.errors)
+                if any(classify_error(error) not in FAILOVER_ERRORS for _, error in e.errors):
+                    raise e.errors[-1][1]
+                queue = [n for n in queue if n not in dict(e.errors)]
+                continue
+            except Exception as e:
+                errors.append((name, e))
+                if classify_error(e) not in FAILOVER_ERRORS:
+                    raise
+                continue
+            self._last_provider.set(winner)
+            return response
+        raise ProviderRouterError(errors)
+
+    def _hedged(self, primary: str, backup: str, delay: float, messages: List[Any], **kwargs) -> Tuple[str, Any]:
+        """先请求 primary, 超过 delay 秒未返回时同时请求 backup, 返回先成功的结果"""
+        if self._hedge_pool is None:
+            with self._clients_lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+        pool = self._hedge_pool
+        futures = {pool.submit(self._call, primary, messages, **kwargs): primary}
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            futures[pool.submit(self._call, backup, messages, **kwargs)] = backup
+
+        errors: List[Tuple[str, BaseException]] = []
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append((futures[future], e))
+        raise _HedgeFailed(errors)
+
+    def stream(self, messages: List[Any], **kwargs) -> Iterator[Any]:
+        """流式调用: 在收到第一段输出前失败时切换提供商, 之后的失败直接抛出"""
+        errors: List[Tuple[str, BaseException]] = []
+        for name in self.ranked():
+            limiter = self.rate_limiters.get(name)
+            if limiter:
+                limiter.acquire()
+            start = time.perf_counter()
+            stream = self.client(name).stream(messages, **kwargs)
+            started = failed = False
+            try:
+                for chunk in stream:
+                    if not started:
+                        started = True
+                        self._last_provider.set(name)
+                    yield chunk
+            except Exception as e:
+                failed = True
+                self._record_failure(name, e)
+                if started or classify_error(e) not in FAILOVER_ERRORS:
+                    raise
+                errors.append((name, e))
+                continue
+            finally:
+                # 调用方提前结束读取时同样计为成功
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+                if not failed:
+                    self.health(name).record_success(time.perf_counter() - start)
+            return
+        raise ProviderRouterError(errors)
+
+    # ---- 异步接口 ----
+
+    async def _acall(self, name: str, messages: List[Any], **kwargs) -> Tuple[str, Any]:
+        limiter = self.rate_limiters.get(name)
+        if limiter:
+            await limiter.aacquire()
+        client = self.client(name)
+        start = time.perf_counter()
+        try:
+            if hasattr(client, "ainvoke"):
+                response = await client.ainvoke(messages, **kwargs)
+            else:
+                response = await asyncio.to_thread(client.invoke, messages, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._record_failure(name, e)
+            raise
+        self.health(name).record_success(time.perf_counter() - start)
+        return name, response
+
+    async def ainvoke(self, messages: List[Any], **kwargs) -> Any:
+        errors: List[Tuple[str, BaseException]] = []
+        queue = self.ranked()
+        while queue:
+            name = queue.pop(0)
+            delay = self._hedge_delay(name)
+            try:
+                if delay is not None and queue:
+                    winner, response = await self._ahedged(name, queue[0], delay, messages, **kwargs)
+                    if winner == queue[0]:
+                        queue.pop(0)
+                else:
+                    winner, response = await self._acall(name, messages, **kwargs)
+            except _HedgeFailed as e:
+                errors.extend(e.errors)
+                if any(classify_error(error) not in FAILOVER_ERRORS for _, error in e.errors):
+                    raise e.errors[-1][1]
+                queue = [n for n in queue if n not in dict(e.errors)]
+                continue
+            except Exception as e:
+                errors.append((name, e))
+                if classify_error(e) not in FAILOVER_ERRORS:
+                    raise
+                continue
+            self._last_provider.set(winner)
+            return response
+        raise ProviderRouterError(errors)
+
+    async def _ahedged(self, primary: str, backup: str, delay: float, messages: List[Any], **kwargs) -> Tuple[str, Any]:
+        """_hedged 的异步版本, 先成功者返回后取消另一个请求"""
+        tasks = {asyncio.ensure_future(self._acall(primary, messages, **kwargs)): primary}
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            tasks[asyncio.ensure_future(self._acall(backup, messages, **kwargs))] = backup
+
+        errors: List[Tuple[str, BaseException]] = []
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append((tasks[task], task.exception()))
+        finally:
+            for task in pending:
+                task.cancel()
+        raise _HedgeFailed(errors)
+
+    async def astream(self, messages: List[Any], **kwargs) -> AsyncIterator[Any]:
+        errors: List[Tuple[str, BaseException]] = []
+        for name in self.ranked():
+            limiter = self.rate_limiters.get(name)
+            if limiter:
+                await limiter.aacquire()
+            start = time.perf_counter()
+            stream = self.client(name).astream(messages, **kwargs)
+            started = failed = False
+            try:
+                async for chunk in stream:
+                    if not started:
+                        started = True
+                        self._last_provider.set(name)
+                    yield chunk
+            except Exception as e:
+                failed = True
+                self._record_failure(name, e)
+                if started or classify_error(e) not in FAILOVER_ERRORS:
+                    raise
+                errors.append((name, e))
+                continue
+            finally:
+                aclose = getattr(stream, "aclose", None)
+                if aclose:
+                    await aclose()
+                if not failed:
+                    self.health(name).record_success(time.perf_counter() - start)
+            return
+        raise ProviderRouterError(errors)
+
+
+class _HedgeFailed(Exception):
+    """对冲请求的所有参与者均失败"""
+
+    def __init__(self, errors: List[Tuple[str, BaseException]]):
+        super().__init__(errors)
+        self.errors = errors
@@ -0,0 +1,129 @@
+"""
+生成代码的查询引擎
+- pandas(默认): 数据集以内存中的 df 提供
+- duckdb: 数据集以DuckDB关系 rel(视图 data)提供, 直接扫描列式存储(Parquet), 过滤和聚合在库内完成
+- polars: 数据集以Polars LazyFrame lf 提供, 查询在 collect() 时流式执行
+DuckDB和Polars为可选依赖, 选用时才导入; 查询结果只把最终的小结果转为pandas用于显示
+"""
+
+import importlib
+from typing import Any, Dict
+
+# 可选的查询引擎
+ENGINES = ("pandas", "duckdb", "polars")
+
+# 结果变量转为pandas显示时的最大行数
+MAX_RESULT_ROWS = 1000
+
+_RULES = {
+    "pandas": (
+        "2. 数据框变量名必须使用 'df'\n"
+        "                3. df已经加载好了,不需要重新读取CSV"
+    ),
+    "duckdb": (
+        "2. 数据集是DuckDB关系 rel(SQL中的视图名为 data), 连接为 con; 用 con.sql(\"SELECT ... FROM data ...\") "
+        "或 rel 的 filter/aggregate/order/limit 查询, 过滤和聚合都在SQL中完成, 不要把整个数据集转为pandas\n"
+        "                3. 只把最终的小结果用 .df() 转为pandas DataFrame 后打印或绘图; 不需要重新读取文件"
+    ),
+    "polars": (
+        "2. 数据集是Polars LazyFrame lf(已导入 pl), 用 lf.filter/group_by/agg/sort 等惰性操作查询, "
+        "最后调用 .collect(), 不要把整个数据集转为pandas\n"
+        "                3. 只把最终的小结果用 .to_pandas() 转为pandas DataFrame 后打印或绘图; 不需要重新读取文件"
+    ),
+}
+
+_EXAMPLES = {
+    "pandas": "result = df.groupby('Category')['Sales'].sum()\nprint(result)",
+    "duckdb": (
+        "result = con.sql(\"SELECT Category, SUM(Sales) AS Sales FROM data GROUP BY Category ORDER BY Sales DESC\").df()\n"
+        "print(result)"
+    ),
+    "polars": (
+        "result = lf.group_by('Category').agg(pl.col('Sales').sum()).sort('Sales', descending=True).collect().to_pandas()\n"
+        "print(result)"
+    ),
+}
+
+
+def _import(engine: str):
+    try:
+        return importlib.import_module(engine)
+    except ImportError:
+        raise ImportError(f"查询引擎 {engine} 需要安装: pip install {engine}")
+
+
+def check_engine(engine: str) -> str:
+    """
+    校验查询引擎名称并确认依赖已安装
+
+    Raises:
+        ValueError: 未知的引擎
+        ImportError: 引擎依赖未安装
+    """
+    engine = (engine or "pandas").lower()
+    if engine not in ENGINES:
+        raise ValueError(f"未知的查询引擎: {engine} (可选: {', '.join(ENGINES)})")
+    if engine != "pandas":
+        _import(engine)
+    return engine
+
+
+def _sql_literal(text: str) -> str:
+    return "'" + text.replace("'", "''") + "'"
+
+
+def engine_namespace(engine: str, store_path: str) -> Dict[str, Any]:
+    """
+    生成代码执行环境中的数据变量
+
+    Args:
+        engine: duckdb 或 polars
+        store_path: 清洗后数据集的Parquet文件
+
+    Returns:
+        duckdb: {"duckdb", "con", "rel"}; polars: {"pl", "lf"}
+    """
+    if engine == "duckdb":
+        duckdb = _import("duckdb")
+        # 每次执行使用独立连接, 并发执行互不影响
+        con = duckdb.connect()
+        con.execute(f"CREATE VIEW data AS SELECT * FROM read_parquet({_sql_literal(store_path)})")
+        return {"duckdb": duckdb, "con": con, "rel": con.table("data")}
+    if engine == "polars":
+        pl = _import("polars")
+        return {"pl": pl, "lf": pl.scan_parquet(store_path)}
+    return {}
+
+
+def close_namespace(namespace: Dict[str, Any]):
+    """释放执行环境中的引擎连接"""
+    con = namespace.get("con")
+    if con is not None:
+        try:
+            con.close()
+        except Exception:
+            pass
+
+
+def to_pandas(value: Any, max_rows: int = MAX_RESULT_ROWS) -> Any:
+    """DuckDB关系、Polars结果转为最多 max_rows 行的pandas对象, 其他值原样返回(不导入引擎)"""
+    module = type(value).__module__ or ""
+    if "duckdb" in module and hasattr(value, "limit"):
+        return value.limit(max_rows).df()
+    if module.startswith("polars"):
+        if hasattr(value, "collect"):
+            value = value.head(max_rows).collect()
+        elif hasattr(value, "head"):
+            value = value.head(max_rows)
+        return value.to_pandas() if hasattr(value, "to_pandas") else value
+    return value
+
+
+def prompt_rules(engine: str) -> str:
+    """提示词中数据变量的规则(第2、3条)"""
+    return _RULES[engine]
+
+
+def example_code(engine: str) -> str:
+    """提示词中的示例代码"""
+    return _EXAMPLES[engine]
@@ -0,0 +1,49 @@
+"""
+LLM调用限速
+按提供商限制每秒请求数, 同一限速器可同时用于线程(acquire)和asyncio(aacquire)
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, List
+
+
+class RateLimiter:
+    """按固定间隔放行请求的限速器(每秒最多 rate 个请求)"""
+
+    def __init__(self, rate: float):
+        if rate <= 0:
+            raise ValueError("限速必须大于0")
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """预约下一个可用时间点, 返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            return slot - now
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def aacquire(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def parse_rate_limits(specs: List[str]) -> Dict[str, RateLimiter]:
+    """解析 ["qwen3=2", "deepseek=0.5"] 形式的限速配置(每秒请求数)"""
+    limiters = {}
+    for spec in specs or []:
+        provider, _, rate = spec.partition("=")
+        if not rate:
+            raise ValueError(f"限速格式应为 provider=每秒请求数: {spec}")
+        limiters[provider.strip().lower()] = RateLimiter(float(rate))
+    return limiters
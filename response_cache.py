@@ -0,0 +1,188 @@
+"""
+生成代码的响应缓存
+以 数据集结构指纹 + 规范化问题 + 相关对话历史 为键缓存LLM生成的代码:
+- 精确匹配层: 键完全一致时直接命中
+- 语义相似层(可选): 提供 embed_fn 时, 对同一结构和历史下的问题按向量余弦相似度匹配
+持久化在本地SQLite中, 支持过期时间(TTL)和按最近访问时间的容量淘汰(LRU)
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from csv_streaming import get_store_dir
+
+
+# 参与缓存键的最近对话轮数(追问通常只依赖最近的上下文)
+HISTORY_TURNS = 2
+
+_TRAILING_PUNCT = "?？。.!！ "
+
+
+def normalize_question(question: str) -> str:
+    """规范化问题文本: 全半角统一、小写、合并空白、去掉句末标点"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(_TRAILING_PUNCT)
+
+
+def history_digest(execution_history: List[Dict[str, Any]], turns: int = HISTORY_TURNS) -> str:
+    """最近几轮对话(问题+代码)的摘要; 无历史时为空字符串"""
+    recent = execution_history[-turns:] if turns else []
+    if not recent:
+        return ""
+    digest = hashlib.sha256()
+    for hist in recent:
+        digest.update(normalize_question(hist["question"]).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(hist["code"].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def langchain_embedder(embeddings: Any) -> Callable[[str], Sequence[float]]:
+    """将LangChain的Embeddings对象包装为 embed_fn"""
+    return embeddings.embed_query
+
+
+class CodeCache:
+    """生成代码的持久化缓存(精确匹配 + 可选语义相似匹配)"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = 7 * 24 * 3600,
+        max_entries: int = 2000,
+        embed_fn: Optional[Callable[[str], Sequence[float]]] = None,
+        similarity_threshold: float = 0.92,
+    ):
+        """
+        Args:
+            path: SQLite文件路径, 默认放在缓存目录下
+            ttl: 条目有效期(秒)
+            max_entries: 最多保留的条目数, 超出时淘汰最久未访问的条目
+            embed_fn: 文本向量化函数, 提供时启用语义相似匹配
+            similarity_threshold: 语义匹配的最低余弦相似度
+        """
+        self.path = path or os.path.join(get_store_dir(), "code_cache.sqlite")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS code_cache (
+                    key TEXT PRIMARY KEY,
+                    schema TEXT NOT NULL,
+                    context TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    output TEXT,
+                    explanation TEXT,
+                    embedding BLOB,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_code_cache_scope ON code_cache(schema, context)")
+
+    @staticmethod
+    def make_key(schema: str, question: str, context: str) -> str:
+        raw = f"{schema}\0{normalize_question(question)}\0{context}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, schema: str, question: str, context: str) -> Optional[Dict[str, Any]]:
+        """
+        查找缓存的代码
+
+        Returns:
+            {"key", "code", "output", "explanation", "match": "exact" | "semantic"} 或 None
+        """
+        now = time.time()
+        key = self.make_key(schema, question, context)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, code, output, explanation FROM code_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+        match = "exact"
+
+        if row is None and self.embed_fn is not None:
+            row = self._semantic_lookup(schema, question, context, now)
+            match = "semantic"
+        if row is None:
+            return None
+
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE code_cache SET last_access = ? WHERE key = ?", (now, row[0]))
+        return {"key": row[0], "code": row[1], "output": row[2], "explanation": row[3], "match": match}
+
+    def _semantic_lookup(self, schema: str, question: str, context: str, now: float):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, code, output, explanation, embedding FROM code_cache "
+                "WHERE schema = ? AND context = ? AND created_at > ? AND embedding IS NOT NULL",
+                (schema, context, now - self.ttl),
+            ).fetchall()
+        if not rows:
+            return None
+
+        query = self._embed(question)
+        matrix = np.vstack([np.frombuffer(r[4], dtype=np.float32) for r in rows])
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        return rows[best][:4]
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn(normalize_question(question)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def put(self, schema: str, question: str, context: str, code: str, output: str = None, explanation: str = None):
+        """写入(或覆盖)缓存条目"""
+        now = time.time()
+        key = self.make_key(schema, question, context)
+        embedding = None
+        if self.embed_fn is not None:
+            try:
+                embedding = self._embed(question).tobytes()
+            except Exception as e:
+                print(f"⚠ 问题向量化失败, 仅使用精确匹配缓存: {e}")
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO code_cache "
+                "(key, schema, context, question, code, output, explanation, embedding, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, schema, context, question, code, output, explanation, embedding, now, now),
+            )
+            self._evict(now)
+
+    def invalidate(self, key: str):
+        """删除失效的条目(如缓存代码执行失败)"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM code_cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM code_cache")
+
+    def _evict(self, now: float):
+        """删除过期条目, 并按最近访问时间淘汰超出容量的条目(调用方持有锁)"""
+        self._conn.execute("DELETE FROM code_cache WHERE created_at <= ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM code_cache WHERE key IN ("
+            "SELECT key FROM code_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
@@ -0,0 +1,176 @@
+"""
+分析会话的持久化存储
+以SQLite保存会话状态(数据源、清洗后数据集的存储引用、数据集概要、对话记忆、LLM提供商),
+应用重启或命令行再次启动时按会话ID恢复: 只读取一行记录, 不重新读取和清理CSV,
+DataFrame在第一次执行代码时才从列式存储加载
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from csv_streaming import get_store_dir
+
+
+def new_session_id() -> str:
+    return secrets.token_hex(6)
+
+
+class StoredUpload:
+    """
+    恢复上传文件的会话时代替原文件对象: 只携带会话记录中的数据源标识,
+    数据取自会话引用的列式存储(上传内容已不可用, 存储被清理后无法恢复)
+    """
+
+    def __init__(self, source_id: str):
+        self.source_id = source_id
+        self.name = source_id.rsplit("#", 1)[0]
+
+    def __str__(self) -> str:
+        return self.name
+
+
+def is_upload(source: Any) -> bool:
+    """数据源是否为上传的文件对象(或恢复时代替它的 StoredUpload)"""
+    return isinstance(source, StoredUpload) or hasattr(source, "getvalue")
+
+
+def source_name(source: Any) -> str:
+    """
+    会话记录中的数据源标识: 文件绝对路径; 上传文件为 文件名#内容指纹(同名的不同文件互不混淆);
+    其他对象为其 name(如多表目录的标识)
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.abspath(os.fspath(source))
+    if isinstance(source, StoredUpload):
+        return source.source_id
+    name = str(getattr(source, "name", "upload"))
+    if hasattr(source, "getvalue"):
+        return f"{name}#{hashlib.blake2b(source.getvalue(), digest_size=8).hexdigest()}"
+    return name
+
+
+def source_stat(source: Any) -> Optional[List[int]]:
+    """数据源文件的 [大小, 修改时间], 用于判断保存后是否被修改; 非文件或文件不存在时为None"""
+    if not isinstance(source, (str, os.PathLike)):
+        return None
+    try:
+        stat = os.stat(source)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class SessionStore:
+    """会话状态的SQLite存储, 超出容量时淘汰最久未更新的会话"""
+
+    def __init__(self, path: Optional[str] = None, max_sessions: int = 200):
+        """
+        Args:
+            path: SQLite文件路径, 默认放在缓存目录下
+            max_sessions: 最多保留的会话数
+        """
+        self.path = path or os.path.join(get_store_dir(), "sessions.sqlite")
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    provider TEXT,
+                    turns INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    profile BLOB,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+
+    def save(self, session_id: str, source: str, provider: Optional[str], state: Dict[str, Any], profile: Any = None):
+        """
+        写入(或更新)会话
+
+        Args:
+            session_id: 会话ID
+            source: 数据源标识(见 source_name)
+            provider: 当前LLM提供商
+            state: 可JSON序列化的会话状态(数据集存储引用、对话记忆等)
+            profile: 数据集概要(DatasetProfile, 以pickle保存), 恢复时无需重新扫描数据
+        """
+        now = time.time()
+        turns = state.get("memory", {}).get("total_turns", 0)
+        payload = json.dumps(state, ensure_ascii=False, default=str)
+        blob = pickle.dumps(profile, protocol=pickle.HIGHEST_PROTOCOL) if profile is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sessions (id, source, provider, turns, state, profile, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET source = excluded.source, provider = excluded.provider, "
+                "turns = excluded.turns, state = excluded.state, "
+                "profile = excluded.profile, updated_at = excluded.updated_at",
+                (session_id, source, provider, turns, payload, blob, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM sessions WHERE id IN ("
+                "SELECT id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,),
+            )
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取会话
+
+        Returns:
+            {"id", "source", "provider", "state", "profile", "created_at", "updated_at"} 或 None
+            (概要无法还原时 profile 为 None)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, source, provider, state, profile, created_at, updated_at FROM sessions WHERE id = ?",
+                (session_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        profile = None
+        if row[4] is not None:
+            try:
+                profile = pickle.loads(row[4])
+            except Exception as e:
+                print(f"⚠ 会话中的数据集概要无法还原, 将重新加载数据: {e}")
+        return {
+            "id": row[0],
+            "source": row[1],
+            "provider": row[2],
+            "state": json.loads(row[3]),
+            "profile": profile,
+            "created_at": row[5],
+            "updated_at": row[6],
+        }
+
+    def list(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """最近更新的会话摘要(id/source/provider/turns/updated_at)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, source, provider, turns, updated_at FROM sessions ORDER BY updated_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"id": row[0], "source": row[1], "provider": row[2], "turns": row[3], "updated_at": row[4]}
+            for row in rows
+        ]
+
+    def delete(self, session_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions")
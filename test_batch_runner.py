@@ -0,0 +1,130 @@
+"""
+批处理测试 - 问题文件读取(JSONL/CSV)、追问链分组、结果文件覆盖与追加, 以及按提供商限速
+
+使用方式:
+  python test_batch_runner.py
+  或 python -m pytest test_batch_runner.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存写入临时目录
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from batch_runner import group_chains, load_questions, run_batch
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeLLM
+from rate_limit import RateLimiter, parse_rate_limits
+from test_support import SAMPLE_CSV, temp_workspace
+
+
+def _write(path: str, text: str) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def test_load_questions_and_chains():
+    with temp_workspace() as tmp:
+        jsonl = _write(os.path.join(tmp, "questions.jsonl"), "\n".join([
+            '"总销售额"',
+            '{"id": 0, "question": "Bikes的销售额", "chain": "bikes"}',
+            "",
+            '{"question": " 同样分析Clothing ", "chain": "bikes"}',
+            '{"id": "q4", "question": "哪年最高"}',
+        ]))
+        questions = load_questions(jsonl)
+        # 显式的 id 0 保留, 缺失 id 按记录序号编号(跳过空行)
+        assert [q["id"] for q in questions] == ["1", 0, "3", "q4"]
+        assert questions[2]["question"] == "同样分析Clothing"
+        assert [q["chain"] for q in questions] == [None, "bikes", "bikes", None]
+
+        chains = group_chains(questions)
+        assert [[q["id"] for q in chain] for chain in chains] == [["1"], [0, "3"], ["q4"]]
+
+        csv_path = _write(os.path.join(tmp, "questions.csv"), "id,question,chain\n0,总销售额,\n,Bikes的销售额,a\n")
+        rows = load_questions(csv_path)
+        assert [(q["id"], q["chain"]) for q in rows] == [("0", None), ("2", "a")]
+
+        try:
+            load_questions(_write(os.path.join(tmp, "bad.jsonl"), '{"id": 1}\n'))
+            raise AssertionError("缺少 question 时应报错")
+        except ValueError as e:
+            assert "第 1 条" in str(e)
+
+
+def test_results_overwritten_unless_append():
+    with temp_workspace() as tmp:
+        analyzer = DataAnalyzer(SAMPLE_CSV, "fake", llm=FakeLLM(lambda q: f"print('{q}')"), explain="none")
+        questions = [{"id": str(i), "question": f"q{i}", "chain": None} for i in range(3)]
+        output_path = os.path.join(tmp, "results.jsonl")
+
+        def read_ids():
+            with open(output_path, "r", encoding="utf-8") as f:
+                return sorted(json.loads(line)["id"] for line in f)
+
+        asyncio.run(run_batch(analyzer, questions, output_path=output_path))
+        asyncio.run(run_batch(analyzer, questions, output_path=output_path))
+        assert read_ids() == ["0", "1", "2"]
+
+        asyncio.run(run_batch(analyzer, questions[:1], output_path=output_path, append=True))
+        assert read_ids() == ["0", "0", "1", "2"]
+
+
+def test_rate_limiter_pacing():
+    limiter = RateLimiter(20)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    # 第一个请求立即放行, 之后每个间隔 1/20 秒
+    assert 0.19 <= time.monotonic() - start < 0.5
+
+    async def acquire_all():
+        await asyncio.gather(*(limiter.aacquire() for _ in range(5)))
+
+    start = time.monotonic()
+    asyncio.run(acquire_all())
+    assert 0.2 <= time.monotonic() - start < 0.6
+
+    assert set(parse_rate_limits(["Qwen3=2", "deepseek=0.5"])) == {"qwen3", "deepseek"}
+    for spec in (["qwen3"], ["qwen3=0"]):
+        try:
+            parse_rate_limits(spec)
+            raise AssertionError(f"{spec} 应报错")
+        except ValueError:
+            pass
+
+
+def test_batch_respects_rate_limit():
+    with temp_workspace():
+        analyzer = DataAnalyzer(
+            SAMPLE_CSV, "fake", llm=FakeLLM(lambda q: f"print('{q}')"), explain="none",
+            use_cache=False, rate_limiters={"fake": RateLimiter(20)},
+        )
+        questions = [{"id": str(i), "question": f"q{i}", "chain": None} for i in range(6)]
+        start = time.monotonic()
+        records = asyncio.run(run_batch(analyzer, questions, workers=6))
+        # 6个并发问题共享同一限速器, 各LLM调用至少间隔 1/20 秒
+        assert time.monotonic() - start >= 0.25
+        assert all(record["success"] for record in records)
+
+
+def main():
+    tests = [
+        test_load_questions_and_chains,
+        test_results_overwritten_unless_append,
+        test_rate_limiter_pacing,
+        test_batch_respects_rate_limit,
+    ]
+    print("=" * 80)
+    print("🧪 批处理测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
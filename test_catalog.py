@@ -0,0 +1,173 @@
+"""
+多表数据集测试 - 目录注册、分区合并(各分区格式不一致时对齐类型)、Excel多工作表、按需加载与会话恢复
+
+使用方式:
+  python test_catalog.py
+  或 python -m pytest test_catalog.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存和会话写入临时目录
+"""
+
+import contextlib
+import os
+
+import pandas as pd
+
+from code_executor import references_name, tables_used
+from data_analyzer import DataAnalyzer
+from dataset_catalog import DatasetCatalog
+from fake_llm import FakeLLM
+from session_store import SessionStore
+from test_support import SAMPLE_CSV, temp_workspace
+
+
+@contextlib.contextmanager
+def _workspace():
+    """临时目录: 两个按月分区的销售CSV和一个目标表"""
+    with temp_workspace() as tmp:
+        data_dir = os.path.join(tmp, "data")
+        os.makedirs(data_dir)
+        sales = pd.read_csv(SAMPLE_CSV, encoding="utf-8-sig")
+        half = len(sales) // 2
+        sales.iloc[:half].to_csv(os.path.join(data_dir, "sales_2024_01.csv"), index=False)
+        sales.iloc[half:].to_csv(os.path.join(data_dir, "sales_2024_02.csv"), index=False)
+        pd.DataFrame({"Category": ["Bikes", "Clothing"], "Target": ["$1,000", "$2,000"]}).to_csv(
+            os.path.join(data_dir, "targets.csv"), index=False
+        )
+        yield data_dir, len(sales), SessionStore(os.path.join(tmp, "sessions.sqlite"))
+
+
+def test_tables_used():
+    names = ["sales", "targets"]
+    assert tables_used("print(tables['targets'].shape)", names) == ["targets"]
+    assert tables_used("t = tables.get('sales')", names) == ["sales"]
+    # 无法静态确定时视为用到全部表
+    assert tables_used("for name in tables: print(name)", names) == names
+    assert tables_used("print(1)", names) == []
+    assert references_name("print(df.shape)", "df")
+    assert not references_name("print('df')", "df")
+
+
+def test_partitions_grouped_and_loaded_lazily():
+    with _workspace() as (data_dir, rows, _):
+        catalog = DatasetCatalog.from_sources(data_dir)
+        assert catalog.names == ["sales", "targets"]
+        assert len(catalog.info("sales").sources) == 2
+        # 注册时只读取样本
+        assert catalog.loaded() == {}
+        assert "tables['sales']" in catalog.prompt_text("各类别销售额")
+
+        sales = catalog.load("sales")
+        assert len(sales) == rows and pd.api.types.is_numeric_dtype(sales["Sales"])
+        assert list(catalog.loaded()) == ["sales"]
+
+        # 在表映射上修改不影响目录中的数据
+        tables = catalog.tables()
+        frame = tables["sales"]
+        frame["Sales"] = 0
+        assert catalog.load("sales")["Sales"].sum() > 0
+
+
+def test_partition_formats_reconciled():
+    with temp_workspace() as tmp:
+        data_dir = os.path.join(tmp, "data")
+        os.makedirs(data_dir)
+        # 第一个分区为纯数字, 第二个分区为货币文本; Code 列一个分区为数字, 另一个为无法转换的文本
+        pd.DataFrame({"Sales": [100, 200], "Code": [1, 2]}).to_csv(os.path.join(data_dir, "sales_01.csv"), index=False)
+        pd.DataFrame({"Sales": ["$1,000", "$2,500"], "Code": ["A1", None]}).to_csv(
+            os.path.join(data_dir, "sales_02.csv"), index=False
+        )
+        catalog = DatasetCatalog.from_sources(data_dir)
+        # 概要的样本覆盖各分区
+        assert catalog.profile("sales").dtypes["Sales"] == "int64"
+        assert catalog.info("sales").rules == {"Sales": "currency"}
+
+        sales = catalog.load("sales")
+        assert pd.api.types.is_numeric_dtype(sales["Sales"]) and sales["Sales"].sum() == 3800
+        assert sales["Code"].tolist()[:3] == ["1", "2", "A1"] and pd.isna(sales["Code"].iloc[3])
+
+
+def test_workbook_sheets():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        print("⚠ 未安装 openpyxl, 跳过")
+        return
+    with temp_workspace() as tmp:
+        path = os.path.join(tmp, "report.xlsx")
+        with pd.ExcelWriter(path) as writer:
+            pd.DataFrame({"Year": [2023, 2023], "Sales": [100, 200]}).to_excel(writer, sheet_name="plain", index=False)
+            pd.DataFrame({"Year": [2024, 2024], "Sales": ["$1,000", "$2,500"]}).to_excel(
+                writer, sheet_name="formatted", index=False
+            )
+        catalog = DatasetCatalog.from_sources(path)
+        assert catalog.names == ["report.plain", "report.formatted"]
+        assert catalog.profile("report.plain").rows == 2
+        # 各工作表分别推断清洗规则
+        assert catalog.load("report.plain")["Sales"].sum() == 300
+        assert catalog.load("report.formatted")["Sales"].sum() == 3500
+
+        code = "print(sum(tables[name]['Sales'].sum() for name in tables))"
+        analyzer = DataAnalyzer(path, "fake", llm=FakeLLM(lambda q: code), explain="none")
+        result = analyzer.generate_code("各工作表销售额合计")
+        assert result["success"] and result["execution_result"].strip() == "3800", result["error"]
+
+
+def test_analyzer_loads_only_used_tables():
+    with _workspace() as (data_dir, _, store):
+        code = "print(tables['targets']['Target'].sum())"
+        analyzer = DataAnalyzer(
+            data_dir, "fake", llm=FakeLLM(lambda q: code, explanation="完成。"),
+            session_store=store, explain="none",
+        )
+        assert analyzer.catalog is not None and analyzer._df is None
+        messages = analyzer._build_code_messages("目标总额是多少?", 0)
+        assert "表 targets" in messages[0].content and "tables['表名']" in messages[0].content
+
+        result = analyzer.generate_code("目标总额是多少?")
+        assert result["success"] and result["execution_result"].strip() == "3000"
+        assert list(analyzer.catalog.loaded()) == ["targets"]
+
+        # 按会话ID恢复时重建表目录, 不加载任何表
+        resumed = DataAnalyzer.resume(analyzer.session_id, store, llm=FakeLLM(lambda q: code))
+        assert resumed.catalog.names == ["sales", "targets"]
+        assert resumed.catalog.loaded() == {}
+        assert len(resumed.execution_history) == 1
+
+
+def test_resumed_catalog_keeps_cache():
+    with _workspace() as (data_dir, _, store):
+        code = "print(tables['targets']['Target'].sum())"
+        analyzer = DataAnalyzer(data_dir, "fake", llm=FakeLLM(lambda q: code), session_store=store, explain="none")
+        analyzer.generate_code("目标总额是多少?")
+        key = analyzer._execution_key(code)
+        assert analyzer.catalog.dataset_cache is not None and key
+
+        # 恢复的会话同样使用表缓存, 执行结果的键不变
+        resumed = DataAnalyzer.resume(analyzer.session_id, store, llm=FakeLLM(lambda q: code), explain="none")
+        assert resumed.catalog.dataset_cache is not None
+        assert resumed._execution_key(code) == key
+
+        uncached = DataAnalyzer.resume(analyzer.session_id, store, llm=FakeLLM(lambda q: code), use_cache=False)
+        assert uncached.catalog.dataset_cache is None and uncached._execution_key(code) is None
+
+
+def main():
+    tests = [
+        test_tables_used,
+        test_partitions_grouped_and_loaded_lazily,
+        test_partition_formats_reconciled,
+        test_workbook_sheets,
+        test_analyzer_loads_only_used_tables,
+        test_resumed_catalog_keeps_cache,
+    ]
+    print("=" * 80)
+    print("🧪 多表数据集测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
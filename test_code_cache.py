@@ -0,0 +1,127 @@
+"""
+生成代码缓存测试 - 问题规范化与精确匹配、过期时间(TTL)、按最近访问淘汰(LRU)、语义相似匹配层
+
+使用方式:
+  python test_code_cache.py
+  或 python -m pytest test_code_cache.py
+"""
+
+import os
+import tempfile
+from unittest import mock
+
+from response_cache import CodeCache, history_digest, normalize_question
+
+
+class _Clock:
+    """可手动推进的 time.time 替身"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_exact_match_and_context():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CodeCache(os.path.join(tmp, "code_cache.sqlite"))
+        cache.put("schema1", "总销售额是多少?", "", "print(df['Sales'].sum())", output="100")
+
+        # 全半角、大小写、空白和句末标点不影响匹配
+        assert normalize_question(" Total  SALES？ ") == "total sales"
+        hit = cache.get("schema1", "总销售额是多少？", "")
+        assert hit["match"] == "exact" and hit["code"] == "print(df['Sales'].sum())" and hit["output"] == "100"
+
+        # 数据集结构或对话历史不同时不命中
+        assert cache.get("schema2", "总销售额是多少?", "") is None
+        history = [{"question": "Bikes的销售额", "code": "print(1)"}]
+        assert history_digest(history) != "" and history_digest([]) == ""
+        assert cache.get("schema1", "总销售额是多少?", history_digest(history)) is None
+
+        cache.invalidate(hit["key"])
+        assert cache.get("schema1", "总销售额是多少?", "") is None
+
+
+def test_ttl_and_lru():
+    with tempfile.TemporaryDirectory() as tmp:
+        clock = _Clock()
+        with mock.patch("response_cache.time.time", clock):
+            cache = CodeCache(os.path.join(tmp, "code_cache.sqlite"), ttl=100, max_entries=2)
+            cache.put("s", "q1", "", "code1")
+            clock.now += 99
+            assert cache.get("s", "q1", "")["code"] == "code1"
+            # 过期按创建时间计算, 访问不会延长有效期
+            clock.now += 2
+            assert cache.get("s", "q1", "") is None
+
+            # 超出容量时淘汰最久未访问的条目
+            cache.put("s", "a", "", "code-a")
+            clock.now += 1
+            cache.put("s", "b", "", "code-b")
+            clock.now += 1
+            assert cache.get("s", "a", "") is not None
+            clock.now += 1
+            cache.put("s", "c", "", "code-c")
+            assert cache.get("s", "b", "") is None
+            assert cache.get("s", "a", "") is not None and cache.get("s", "c", "") is not None
+
+            # 写入时清理已过期的条目
+            clock.now += 200
+            cache.put("s", "d", "", "code-d")
+            count = cache._conn.execute("SELECT COUNT(*) FROM code_cache").fetchone()[0]
+            assert count == 1
+
+
+def test_semantic_tier():
+    vectors = {
+        "总销售额": [1.0, 0.0, 0.0],
+        "销售额合计": [0.98, 0.2, 0.0],
+        "平均利润": [0.0, 1.0, 0.0],
+    }
+    calls = []
+
+    def embed(text):
+        calls.append(text)
+        return vectors[text]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CodeCache(os.path.join(tmp, "code_cache.sqlite"), embed_fn=embed, similarity_threshold=0.95)
+        cache.put("s", "总销售额", "", "print(df['Sales'].sum())")
+
+        hit = cache.get("s", "销售额合计", "")
+        assert hit["match"] == "semantic" and hit["code"] == "print(df['Sales'].sum())"
+        # 相似度低于阈值、结构或历史不同时不做语义匹配
+        assert cache.get("s", "平均利润", "") is None
+        assert cache.get("other", "销售额合计", "") is None
+        assert cache.get("s", "销售额合计", "history") is None
+        # 精确命中时不调用向量化
+        calls.clear()
+        assert cache.get("s", "总销售额", "")["match"] == "exact" and calls == []
+
+        # 没有 embed_fn 时只有精确匹配层
+        exact_only = CodeCache(cache.path)
+        assert exact_only.get("s", "销售额合计", "") is None
+
+        # 向量化失败时仍写入精确匹配条目
+        failing = CodeCache(cache.path, embed_fn=lambda text: vectors[text])
+        failing.put("s", "未知问题", "", "print(0)")
+        assert failing.get("s", "未知问题", "")["match"] == "exact"
+
+
+def main():
+    tests = [
+        test_exact_match_and_context,
+        test_ttl_and_lru,
+        test_semantic_tier,
+    ]
+    print("=" * 80)
+    print("🧪 生成代码缓存测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+并发输出隔离测试 - 多个会话在同一进程内同时执行分析
+
+使用方式:
+  python test_concurrency.py
+  或 python -m pytest test_concurrency.py
+
+每个会话的生成代码交替打印带自身标记的行, 验证各自的 execution_result
+只包含本会话的输出(不依赖API Key与网络)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeLLM
+
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "大模型实习项目测试.csv")
+SESSIONS = 16
+LINES = 50
+
+
+def _code_for(question: str) -> str:
+    # 问题即会话标记; sleep 让各线程的输出充分交错
+    return (
+        "import time\n"
+        f"for i in range({LINES}):\n"
+        f"    print('{question}-' + str(i) + '-' + str(len(df)))\n"
+        "    time.sleep(0.001)\n"
+    )
+
+
+def test_concurrent_output_isolation():
+    analyzers = [
+        DataAnalyzer(CSV_PATH, "fake", llm=FakeLLM(_code_for), use_cache=False)
+        for _ in range(SESSIONS)
+    ]
+
+    def run(index: int):
+        return analyzers[index].generate_code(f"session{index}")
+
+    with ThreadPoolExecutor(max_workers=SESSIONS) as pool:
+        results = list(pool.map(run, range(SESSIONS)))
+
+    rows = len(analyzers[0].df)
+    for index, result in enumerate(results):
+        assert result["success"], result["error"]
+        expected = [f"session{index}-{i}-{rows}" for i in range(LINES)]
+        assert result["execution_result"].splitlines() == expected, f"会话{index}的输出被串扰"
+
+
+def test_async_questions_multiplexed():
+    """数百个异步提问共享一个事件循环, 总耗时应远小于逐个等待LLM的耗时"""
+    questions = 200
+    latency = 0.2
+    llm = FakeLLM(lambda q: f"print('{q}')", latency=latency)
+    analyzers = [DataAnalyzer(CSV_PATH, "fake", llm=llm, use_cache=False) for _ in range(questions)]
+
+    async def run_all():
+        return await asyncio.gather(*(
+            analyzer.agenerate_code(f"q{i}") for i, analyzer in enumerate(analyzers)
+        ))
+
+    start = time.perf_counter()
+    results = asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+
+    assert all(r["success"] for r in results)
+    assert [r["execution_result"].strip() for r in results] == [f"q{i}" for i in range(questions)]
+    # 每个问题两次LLM调用, 串行需要 questions * 2 * latency 秒
+    assert elapsed < questions * 2 * latency / 4, f"异步提问未能并发: {elapsed:.1f}s"
+
+
+def test_background_explanations_share_pool():
+    """后台生成解释的各分析器共用一个线程池, 创建再多会话也不会累积线程"""
+    llm = FakeLLM(lambda q: "print(1)", latency=0.01)
+    futures = []
+    for _ in range(3):
+        analyzers = [DataAnalyzer(CSV_PATH, "fake", llm=llm, use_cache=False, explain="async") for _ in range(SESSIONS)]
+        futures += [analyzer.generate_code("q")["explanation_future"] for analyzer in analyzers]
+    assert [future.result() for future in futures] == ["这是分析结果的解释。"] * len(futures)
+
+    # 同一线程池的线程按序编号(explain_0, explain_1, ...), 多个线程池会出现重名
+    names = [thread.name for thread in threading.enumerate() if thread.name.startswith("explain")]
+    assert 0 < len(names) == len(set(names)) <= min(32, (os.cpu_count() or 1) + 4)
+
+
+def main():
+    print("=" * 80)
+    print(f"🧪 并发输出隔离测试: {SESSIONS} 个会话 x {LINES} 行输出")
+    print("=" * 80)
+    test_concurrent_output_isolation()
+    print("\n✅ 所有会话的执行结果相互隔离")
+    test_async_questions_multiplexed()
+    print("✅ 异步提问可在单个事件循环中并发执行")
+    test_background_explanations_share_pool()
+    print("✅ 后台解释共用一个线程池")
+
+
+if __name__ == "__main__":
+    main()
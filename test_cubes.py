@@ -0,0 +1,143 @@
+"""
+聚合立方体测试 - 上卷结果与groupby一致、持久化、分析器中直接查询立方体
+
+使用方式:
+  python test_cubes.py
+  或 python -m pytest test_cubes.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存和会话写入临时目录
+"""
+
+import contextlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cube import AggregateCubes
+from benchmarks.synthetic import make_sales_frame, write_sales_csv
+from data_analyzer import DataAnalyzer
+from dataset_profile import DatasetProfile
+from fake_llm import FakeLLM
+from session_store import SessionStore
+from test_support import SAMPLE_CSV, temp_workspace
+
+
+@contextlib.contextmanager
+def _workspace(rows: int = 60_000):
+    """临时的缓存目录和合成CSV(行数超过提供立方体的下限)"""
+    with temp_workspace() as tmp:
+        csv_path = write_sales_csv(os.path.join(tmp, "sales.csv"), rows)
+        yield csv_path, SessionStore(os.path.join(tmp, "sessions.sqlite"))
+
+
+def _frame() -> pd.DataFrame:
+    df = make_sales_frame(20_000)
+    df["Rating"] = df["Rating"].astype("float64")
+    df.loc[::97, "Rating"] = np.nan
+    df.loc[::131, "Category"] = None
+    return df
+
+
+def _assert_same(actual, expected):
+    if isinstance(expected, pd.Series):
+        pd.testing.assert_series_equal(actual, expected, check_dtype=False)
+    else:
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_cube_matches_groupby():
+    df = _frame()
+    cubes = AggregateCubes(DatasetProfile.build(df), lambda: df, min_rows=0)
+    assert cubes.dimensions == ["Year", "Category", "Product"]
+    assert "Rating" not in cubes.dimensions and "Sales" in cubes.measures
+
+    clothing = df[df["Category"] == "Clothing"]
+    selected = df[df["Category"].isin(["Bikes", "Clothing"]) & (df["Year"] == 2017)]
+    for func in ["sum", "mean", "count", "min", "max"]:
+        _assert_same(cubes.agg("Category", "Sales", func), df.groupby("Category")["Sales"].agg(func))
+        _assert_same(cubes.agg(["Year", "Category"], "Rating", func), df.groupby(["Year", "Category"])["Rating"].agg(func))
+        _assert_same(
+            cubes.agg("Year", ["Sales", "Rating"], func, where={"Category": "Clothing"}),
+            clothing.groupby("Year")[["Sales", "Rating"]].agg(func),
+        )
+        _assert_same(
+            cubes.agg("Product", "Sales", func, where={"Category": ["Bikes", "Clothing"], "Year": 2017}),
+            selected.groupby("Product")["Sales"].agg(func),
+        )
+    _assert_same(cubes.agg("Category", func="size"), df.groupby("Category").size())
+
+    # 重复查询返回缓存结果的副本
+    first = cubes.agg("Category", "Sales")
+    first[:] = 0
+    assert cubes.agg("Category", "Sales").sum() == df["Sales"].sum() - df.loc[df["Category"].isna(), "Sales"].sum()
+
+    for bad in [lambda: cubes.agg("Rating", "Sales"), lambda: cubes.agg("Year", "Product")]:
+        try:
+            bad()
+            assert False, "非维度/非数值列应抛出KeyError"
+        except KeyError:
+            pass
+
+
+def test_cube_persisted_and_pickled():
+    df = _frame()
+    profile = DatasetProfile.build(df)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cube.parquet")
+        cubes = AggregateCubes(profile, lambda: df, path, min_rows=0)
+        expected = cubes.agg("Year", "Sales")
+        assert os.path.exists(path)
+
+        def no_scan():
+            raise AssertionError("已持久化的立方体不应重新扫描数据")
+
+        reloaded = AggregateCubes(profile, no_scan, path, min_rows=0)
+        _assert_same(reloaded.agg("Year", "Sales"), expected)
+        _assert_same(pickle.loads(pickle.dumps(reloaded)).agg("Year", "Sales"), expected)
+
+    # 小数据集不提供立方体
+    assert not AggregateCubes(DatasetProfile.build(df.head(100)), lambda: df).available
+
+
+def test_analyzer_queries_cube_without_df():
+    with _workspace() as (csv_path, store):
+        code = "print(cubes.agg('Year', 'Sales', 'sum', where={'Category': 'Clothing'}))"
+        llm = FakeLLM(lambda q: code, explanation="完成。")
+        analyzer = DataAnalyzer(csv_path, "fake", llm=llm, session_store=store, explain="none")
+        assert analyzer.cubes is not None
+        assert "cubes.agg" in analyzer._build_code_messages("Clothing各年销售额", 0)[0].content
+
+        result = analyzer.generate_code("Clothing各年销售额")
+        expected = analyzer.df[analyzer.df["Category"] == "Clothing"].groupby("Year")["Sales"].sum()
+        assert result["success"] and result["execution_result"].strip() == str(expected).strip()
+
+        # 恢复的会话从缓存读取立方体, 只查询立方体的代码不加载数据集
+        resumed = DataAnalyzer.resume(analyzer.session_id, store, llm=llm, explain="none")
+        assert resumed.generate_code("再问一次")["success"]
+        assert resumed._df is None
+
+    # 样例数据只有几十行, 不提供立方体
+    small = DataAnalyzer(SAMPLE_CSV, "fake", llm=FakeLLM(lambda q: "print(1)"), use_cache=False)
+    assert small.cubes is None
+    assert "cubes" not in small._build_code_messages("总销售额", 0)[0].content
+
+
+def main():
+    tests = [
+        test_cube_matches_groupby,
+        test_cube_persisted_and_pickled,
+        test_analyzer_queries_cube_without_df,
+    ]
+    print("=" * 80)
+    print("🧪 聚合立方体测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
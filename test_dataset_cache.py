@@ -0,0 +1,123 @@
+"""
+数据集缓存测试 - 文件指纹随内容/修改时间变化、读写往返、同源旧版本清理与LRU容量淘汰
+
+使用方式:
+  python test_dataset_cache.py
+  或 python -m pytest test_dataset_cache.py
+"""
+
+import io
+import os
+import time
+
+import pandas as pd
+
+from dataset_cache import DatasetCache
+from test_support import copy_sample_csv, temp_workspace
+
+
+def _frame(rows: int = 2000) -> pd.DataFrame:
+    return pd.DataFrame({"a": range(rows), "b": [f"text-{i}" for i in range(rows)]})
+
+
+def test_fingerprint_changes_with_source():
+    with temp_workspace() as tmp:
+        cache = DatasetCache(os.path.join(tmp, "cache"))
+        csv_path = copy_sample_csv(tmp)
+        key = cache.fingerprint(csv_path)
+        # 相对路径与绝对路径指纹相同, 未修改时稳定
+        assert key == cache.fingerprint(os.path.relpath(csv_path)) == cache.fingerprint(csv_path)
+
+        # 修改内容(大小变化)或只改修改时间, 指纹都变化
+        with open(csv_path, "a", encoding="utf-8") as f:
+            f.write('2024,Bikes,New Bike," $1,000 ",50%\n')
+        appended = cache.fingerprint(csv_path)
+        assert appended != key
+        stat = os.stat(csv_path)
+        os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert cache.fingerprint(csv_path) != appended
+
+        # 同一路径的副本指纹不同(路径参与指纹)
+        copy_path = copy_sample_csv(tmp, "copy.csv")
+        assert cache.fingerprint(copy_path) != cache.fingerprint(csv_path)
+
+        # 上传文件按名称和全部内容计算; 无法识别的数据源不缓存
+        upload = io.BytesIO(b"a,b\n1,2\n")
+        upload.name = "upload.csv"
+        same = io.BytesIO(b"a,b\n1,2\n")
+        same.name = "upload.csv"
+        changed = io.BytesIO(b"a,b\n1,3\n")
+        changed.name = "upload.csv"
+        assert cache.fingerprint(upload) == cache.fingerprint(same) != cache.fingerprint(changed)
+        assert cache.fingerprint(42) is None
+
+
+def test_roundtrip_and_same_source_replaced():
+    with temp_workspace() as tmp:
+        cache = DatasetCache(os.path.join(tmp, "cache"))
+        csv_path = copy_sample_csv(tmp)
+        df = _frame()
+        df["c"] = pd.Categorical(["x", "y"] * 1000)
+        old_key = cache.fingerprint(csv_path)
+        cache.save(old_key, df, csv_path, extra={"note": "v1"})
+
+        loaded = cache.load(old_key)
+        pd.testing.assert_frame_equal(loaded, df)
+        assert cache.load_meta(old_key)["note"] == "v1" and cache.load("missing") is None
+
+        # 源文件修改后写入新版本, 同一数据源的旧版本被清理
+        with open(csv_path, "a", encoding="utf-8") as f:
+            f.write("\n")
+        new_key = cache.fingerprint(csv_path)
+        cache.save(new_key, df.head(10), csv_path)
+        assert cache.load(old_key) is None and len(cache.load(new_key)) == 10
+
+        # 损坏的条目视为未命中并删除
+        with open(cache.data_path(new_key), "wb") as f:
+            f.write(b"not parquet")
+        assert cache.load(new_key) is None
+        assert not os.path.exists(cache.data_path(new_key))
+
+
+def test_lru_eviction():
+    with temp_workspace() as tmp:
+        cache_dir = os.path.join(tmp, "cache")
+        probe = DatasetCache(cache_dir)
+        probe.save("probe", _frame())
+        entry_size = os.path.getsize(probe.data_path("probe")) + os.path.getsize(os.path.join(cache_dir, "probe.json"))
+        probe.clear()
+
+        # 容量约可容纳两个条目
+        cache = DatasetCache(cache_dir, max_bytes=int(entry_size * 2.5))
+        now = time.time()
+        for i, key in enumerate(["first", "second"]):
+            cache.save(key, _frame())
+            os.utime(cache.data_path(key), (now - 100 + i, now - 100 + i))
+        # 访问 first 后它成为最近使用的条目
+        assert cache.load("first") is not None
+        cache.save("third", _frame())
+        assert cache.load("second") is None
+        assert cache.load("first") is not None and cache.load("third") is not None
+
+        # 容量小于单个条目时至少保留最新的一个
+        tiny = DatasetCache(cache_dir, max_bytes=1)
+        tiny.save("fourth", _frame())
+        assert [key for key, _ in tiny._entries()] == ["fourth"]
+
+
+def main():
+    tests = [
+        test_fingerprint_changes_with_source,
+        test_roundtrip_and_same_source_replaced,
+        test_lru_eviction,
+    ]
+    print("=" * 80)
+    print("🧪 数据集缓存测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
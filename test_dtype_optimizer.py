@@ -0,0 +1,154 @@
+"""
+列类型压缩测试 - 维度类数值无损降级(度量列保持64位, 乘积不溢出)、可选的category编码(筛选后分组结果不变)、内存报告与提示词中的列类型
+
+使用方式:
+  python test_dtype_optimizer.py
+  或 python -m pytest test_dtype_optimizer.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存写入临时目录
+"""
+
+import contextlib
+import os
+
+import pandas as pd
+
+from benchmarks.synthetic import make_sales_frame, write_sales_csv
+from data_analyzer import DataAnalyzer
+from dtype_optimizer import format_memory_report, optimize_dtypes
+from fake_llm import FakeLLM
+from test_support import temp_workspace
+
+
+@contextlib.contextmanager
+def _workspace(rows: int = 20_000):
+    """临时的缓存目录和合成CSV"""
+    with temp_workspace() as tmp:
+        yield write_sales_csv(os.path.join(tmp, "sales.csv"), rows)
+
+
+def test_optimize_dtypes():
+    df = make_sales_frame(20_000)
+    df["Category"] = df["Category"].astype(object)
+    df["Quarter"] = df["Rating"] / 4  # float32可精确表示
+    df["Ratio"] = df["Rating"] / 3  # 不可精确表示, 保持float64
+    df["Big"] = df["Sales"] * 10_000_000_000
+    df["Id"] = [f"order-{i}" for i in range(len(df))]
+    original = df.copy()
+
+    # 默认不转换文本列
+    default = df.copy()
+    optimize_dtypes(default)
+    assert default["Category"].dtype == original["Category"].dtype and str(default["Year"].dtype) == "int32"
+
+    report = optimize_dtypes(df, categories=True)
+    dtypes = df.dtypes.astype(str).to_dict()
+    assert dtypes["Category"] == "category" and dtypes["Product"] == "category"
+    # 维度类整数(年份、评分)降到int32; 度量列(Sales最大值超过46340)和大数保持int64
+    assert dtypes["Year"] == "int32" and dtypes["Rating"] == "int32"
+    assert dtypes["Sales"] == "int64" and dtypes["Big"] == "int64"
+    assert dtypes["Quarter"] == "float32" and dtypes["Ratio"] == "float64"
+    assert dtypes["Id"] == original["Id"].dtype
+    assert report["after"] < report["before"] / 2
+    assert {item["column"] for item in report["columns"]} == {"Year", "Category", "Product", "Rating", "Quarter"}
+    assert "MB →" in format_memory_report(report)
+
+    for col in original.columns:
+        assert (df[col].astype(original[col].dtype) == original[col]).all(), col
+    pd.testing.assert_series_equal(
+        df.groupby("Category")["Sales"].sum(), original.groupby("Category")["Sales"].sum(),
+        check_dtype=False, check_categorical=False, check_index_type=False,
+    )
+
+    strings = pd.DataFrame({"Id": pd.Series([f"id{i}" for i in range(2000)], dtype=object)})
+    optimize_dtypes(strings, arrow_strings=True)
+    assert getattr(strings["Id"].dtype, "storage", None) == "pyarrow"
+
+    # 小数据集不压缩
+    small = make_sales_frame(100)
+    assert optimize_dtypes(small)["columns"] == [] and small["Year"].dtype == "int64"
+
+
+def test_measures_keep_width():
+    # 两列相乘超出int32范围: 保持int64, 乘积正确
+    df = pd.DataFrame({"Sales": [60000] * 2000, "Qty": [50000] * 2000, "Year": [2024] * 2000})
+    optimize_dtypes(df)
+    assert df["Sales"].dtype == "int64" and df["Qty"].dtype == "int64" and df["Year"].dtype == "int32"
+    assert (df["Sales"] * df["Qty"]).sum() == 60000 * 50000 * 2000
+    assert (df["Sales"] * df["Qty"]).min() > 0
+
+    # 取值多的列即使数值小也视为度量, 浮点同样只压缩维度类的列
+    measures = pd.DataFrame({"Qty": range(5000), "Price": [i / 4 for i in range(5000)]})
+    assert optimize_dtypes(measures)["columns"] == []
+    dims = pd.DataFrame({"Rating": [i % 5 for i in range(5000)], "Score": [(i % 8) / 4 for i in range(5000)]})
+    optimize_dtypes(dims)
+    assert dims.dtypes.astype(str).tolist() == ["int32", "float32"]
+    # 维度类整数两两相乘不会溢出int32
+    assert (dims["Rating"] * dims["Rating"]).max() == 16
+
+
+def test_filtered_groupby_unchanged():
+    # 筛选后按另一列分组: 压缩后的结果与原始数据一致, 不列出被筛选掉的类别
+    code = "print(df[df['Category']=='Bikes'].groupby('Product')['Sales'].sum())"
+    with _workspace() as csv_path:
+        llm = FakeLLM(lambda q: code)
+        plain = DataAnalyzer(csv_path, "fake", llm=llm, explain="none", use_cache=False, optimize_dtypes=False)
+        expected = plain.generate_code("Bikes各产品销售额")["execution_result"]
+
+        compact = DataAnalyzer(csv_path, "fake", llm=llm, explain="none", use_cache=False)
+        assert compact.memory_report["columns"] and str(compact.df["Category"].dtype) != "category"
+        assert compact.generate_code("Bikes各产品销售额")["execution_result"] == expected
+
+        # 启用category时提示词要求 observed=True, 按提示写的代码结果不变
+        categorical = DataAnalyzer(csv_path, "fake", llm=llm, explain="none", use_cache=False, categories=True)
+        assert str(categorical.df["Product"].dtype) == "category"
+        prompt = categorical._build_code_messages("Bikes各产品销售额", 0)[0].content
+        assert "observed=True" in prompt and "astype(str)" in prompt
+        observed = code.replace("groupby('Product')", "groupby('Product', observed=True)")
+        categorical.llm = FakeLLM(lambda q: observed)
+        result = categorical.generate_code("Bikes各产品销售额")["execution_result"]
+        assert result.rsplit("Name:", 1)[0] == expected.rsplit("Name:", 1)[0]
+
+
+def test_analyzer_reports_compact_dtypes():
+    with _workspace() as csv_path:
+        llm = FakeLLM(lambda q: "print(df.groupby('Category')['Sales'].sum())")
+        analyzer = DataAnalyzer(csv_path, "fake", llm=llm, explain="none")
+        assert str(analyzer.df["Year"].dtype) == "int32"
+        assert analyzer.memory_report["after"] < analyzer.memory_report["before"]
+
+        # 提示词中的列类型与压缩后的一致, 没有category列时不提示 observed
+        prompt = analyzer._build_code_messages("各类别总销售额", 0)[0].content
+        assert "Year: int32" in prompt and "Sales: int64" in prompt and "observed" not in prompt
+        assert "Sales列已从货币格式转为int64" in prompt
+
+        plain = DataAnalyzer(csv_path, "fake", llm=llm, explain="none", use_cache=False, optimize_dtypes=False)
+        assert plain.memory_report is None and str(plain.df["Sales"].dtype) == "int64"
+        # 结果的值相同(汇总列的dtype可能随压缩后的类型变化)
+        compact = analyzer.generate_code("各类别总销售额")["execution_result"]
+        original = plain.generate_code("各类别总销售额")["execution_result"]
+        assert compact.rsplit("dtype:", 1)[0] == original.rsplit("dtype:", 1)[0]
+
+        # 从缓存加载时保持压缩后的类型和报告
+        cached = DataAnalyzer(csv_path, "fake", llm=llm, explain="none")
+        assert str(cached.df["Year"].dtype) == "int32"
+        assert cached.memory_report == analyzer.memory_report
+
+
+def main():
+    tests = [
+        test_optimize_dtypes,
+        test_measures_keep_width,
+        test_filtered_groupby_unchanged,
+        test_analyzer_reports_compact_dtypes,
+    ]
+    print("=" * 80)
+    print("🧪 列类型压缩测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
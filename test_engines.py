@@ -0,0 +1,117 @@
+"""
+查询引擎测试 - DuckDB/Polars直接查询列式存储、提示词规则与会话恢复
+
+使用方式:
+  python test_engines.py
+  或 python -m pytest test_engines.py
+
+使用本地模拟的LLM(不依赖API Key与网络); 未安装的引擎跳过
+"""
+
+import contextlib
+import importlib.util
+import os
+
+import pandas as pd
+
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeLLM
+from query_engine import check_engine, to_pandas
+from session_store import SessionStore
+from test_support import SAMPLE_CSV, temp_workspace
+
+# 各引擎回答"各类别总销售额"的代码
+CODES = {
+    "duckdb": 'print(con.sql("SELECT Category, SUM(Sales) AS Sales FROM data GROUP BY Category ORDER BY Category").df())',
+    "polars": "result = lf.group_by('Category').agg(pl.col('Sales').sum()).sort('Category')",
+}
+
+
+def _installed(engine: str) -> bool:
+    return importlib.util.find_spec(engine) is not None
+
+
+@contextlib.contextmanager
+def _workspace():
+    """临时的缓存目录和会话存储"""
+    with temp_workspace() as tmp:
+        yield SessionStore(os.path.join(tmp, "sessions.sqlite"))
+
+
+def _expected_sales() -> pd.Series:
+    analyzer = DataAnalyzer(SAMPLE_CSV, "fake", llm=FakeLLM(lambda q: ""), use_cache=False)
+    return analyzer.df.groupby("Category")["Sales"].sum()
+
+
+def test_check_engine():
+    assert check_engine("Pandas") == "pandas"
+    try:
+        check_engine("spark")
+        assert False, "未知引擎应抛出ValueError"
+    except ValueError:
+        pass
+    for engine in CODES:
+        if not _installed(engine):
+            try:
+                check_engine(engine)
+                assert False, "未安装的引擎应抛出ImportError"
+            except ImportError:
+                pass
+    frame = pd.DataFrame({"a": [1]})
+    assert to_pandas(frame) is frame and to_pandas(3) == 3
+
+
+def test_engines_query_store_without_loading_df():
+    expected = _expected_sales()
+    for engine, code in CODES.items():
+        if not _installed(engine):
+            print(f"⚠ 未安装 {engine}, 跳过")
+            continue
+        with _workspace():
+            analyzer = DataAnalyzer(
+                SAMPLE_CSV, "fake", llm=FakeLLM(lambda q: code), engine=engine, explain="none",
+            )
+            assert analyzer._df is None and analyzer.profile.rows == len(pd.read_csv(SAMPLE_CSV))
+            prompt = analyzer._build_code_messages("各类别总销售额", 0)[0].content
+            assert ("con.sql" if engine == "duckdb" else "lf.group_by") in prompt
+            assert "df.groupby" not in prompt
+            assert analyzer.schema_hash.startswith(f"{engine}:")
+
+            result = analyzer.generate_code("各类别总销售额")
+            assert result["success"], result["error"]
+            for category, total in expected.items():
+                assert category in result["execution_result"] and str(total) in result["execution_result"]
+            # 代码没有用到 df, 数据集未载入内存
+            assert analyzer._df is None
+
+
+def test_session_keeps_engine():
+    engine = next((name for name in CODES if _installed(name)), None)
+    if engine is None:
+        print("⚠ 未安装 duckdb/polars, 跳过")
+        return
+    with _workspace() as store:
+        llm = FakeLLM(lambda q: CODES[engine])
+        analyzer = DataAnalyzer(SAMPLE_CSV, "fake", llm=llm, engine=engine, session_store=store, explain="none")
+        analyzer.generate_code("各类别总销售额")
+        resumed = DataAnalyzer.resume(analyzer.session_id, store, llm=llm, explain="none")
+        assert resumed.engine == engine and resumed._df is None
+        assert resumed.generate_code("再算一次")["success"]
+
+
+def main():
+    tests = [
+        test_check_engine,
+        test_engines_query_store_without_loading_df,
+        test_session_keeps_engine,
+    ]
+    print("=" * 80)
+    print("🧪 查询引擎测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
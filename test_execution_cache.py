@@ -0,0 +1,182 @@
+"""
+执行结果缓存测试 - 规范化代码键、内存/磁盘两级LRU、分析器中相同代码不重复执行
+
+使用方式:
+  python test_execution_cache.py
+  或 python -m pytest test_execution_cache.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存写入临时目录
+"""
+
+import contextlib
+import os
+import tempfile
+
+from code_executor import get_pyplot
+from data_analyzer import DataAnalyzer
+from execution_cache import ExecutionCache, figure_bytes, is_cacheable
+from fake_llm import FakeLLM
+from test_support import copy_sample_csv, temp_workspace
+
+
+@contextlib.contextmanager
+def _workspace():
+    """临时的缓存目录和样例CSV的副本"""
+    with temp_workspace() as tmp:
+        yield tmp, copy_sample_csv(tmp)
+
+
+def _execute_hit(result):
+    return next(item for item in result["trace"].spans if item.name == "execute").attributes.get("hit")
+
+
+def test_normalized_keys():
+    key = ExecutionCache.make_key("print(df['Sales'].sum())", "v1")
+    # 注释、空白与引号风格不影响键
+    assert ExecutionCache.make_key('# 总销售额\nprint( df["Sales"].sum() )\n', "v1") == key
+    assert ExecutionCache.make_key("print(df['Sales'].sum())", "v2") != key
+    assert ExecutionCache.make_key("print(df['Sales'].sum())", "v1", "duckdb") != key
+    assert ExecutionCache.make_key("print(df['Sales'].mean())", "v1") != key
+
+    # 结果不确定或有副作用的代码、无法解析的代码以及没有数据版本时不缓存
+    for code in [
+        "print(df.sample(3))",
+        "import datetime\nprint(datetime.date.today())",
+        "df.to_csv('out.csv')",
+        "st.write(df)",
+        "print(",
+    ]:
+        assert not is_cacheable(code) and ExecutionCache.make_key(code, "v1") is None, code
+    assert ExecutionCache.make_key("print(1)", None) is None
+
+
+def test_memory_and_disk_tiers():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "execution_cache.sqlite")
+        cache = ExecutionCache(path, memory_entries=2, max_entries=3)
+        plt = get_pyplot()
+        figure = plt.figure()
+        plt.plot([1, 2, 3])
+        png = figure_bytes(figure)
+        plt.close(figure)
+        assert png.startswith(b"\x89PNG")
+
+        for i in range(3):
+            cache.put(f"k{i}", f"输出{i}", png if i == 0 else None)
+        # 内存层只保留最近两条, 更早的从磁盘读取后回到内存层
+        assert cache.get("k2")["tier"] == "memory"
+        hit = cache.get("k0")
+        assert hit == {"output": "输出0", "figure": png, "tier": "disk"}
+        assert cache.get("k0")["tier"] == "memory"
+
+        # 磁盘层按最近访问淘汰
+        cache.put("k3", "输出3")
+        assert cache.get("k1") is None and cache.get("k0")["output"] == "输出0"
+
+        # 新实例(如重启后)从磁盘读取
+        reopened = ExecutionCache(path)
+        assert reopened.get("k3")["tier"] == "disk" and reopened.get("missing") is None
+
+        # 按总字节数淘汰
+        small = ExecutionCache(os.path.join(tmp, "small.sqlite"), max_bytes=len(png) + 10)
+        small.put("a", "", png)
+        small.put("b", "", png)
+        assert ExecutionCache(small.path).get("a") is None and ExecutionCache(small.path).get("b") is not None
+
+
+def test_analyzer_skips_repeated_execution():
+    with _workspace() as (tmp, csv_path):
+        llm = FakeLLM(lambda q: "total = df['Sales'].sum()\nprint(total)")
+        analyzer = DataAnalyzer(csv_path, "fake", llm=llm, explain="none")
+        first = analyzer.generate_code("总销售额")
+        assert first["success"] and _execute_hit(first) is None
+
+        # 追问时代码缓存不命中(对话历史不同), 重新生成的相同代码仍命中执行结果缓存
+        second = analyzer.generate_code("再算一次总销售额")
+        assert _execute_hit(second) == "memory"
+        assert second["execution_result"] == first["execution_result"]
+
+        # 新的分析器(如CLI重新运行)从磁盘层读取
+        again = DataAnalyzer(csv_path, "fake", llm=llm, explain="none").generate_code("总销售额")
+        assert _execute_hit(again) == "disk" and again["execution_result"] == first["execution_result"]
+
+        # 数据源修改后重新执行
+        with open(csv_path, "a", encoding="utf-8") as f:
+            f.write("\n")
+        changed = DataAnalyzer(csv_path, "fake", llm=llm, explain="none").generate_code("总销售额")
+        assert changed["success"] and _execute_hit(changed) is None
+
+        # 替换 df 后不再使用缓存
+        analyzer.df = analyzer.df.head(10)
+        replaced = analyzer.generate_code("总销售额")
+        assert _execute_hit(replaced) is None
+        assert replaced["execution_result"] != first["execution_result"]
+
+        # 结果不确定的代码每次都执行
+        sampled = DataAnalyzer(csv_path, "fake", llm=FakeLLM(lambda q: "print(len(df.sample(5)))"), explain="none")
+        sampled.generate_code("抽样")
+        assert _execute_hit(sampled.generate_code("抽样")) is None
+
+
+def test_key_covers_dtype_settings():
+    with _workspace() as (tmp, csv_path):
+        llm = FakeLLM(lambda q: "print(df['Sales'].sum())")
+        code = "print(df['Sales'].sum())"
+        # 类型压缩设置不同的分析器互不复用执行结果
+        keys = {
+            DataAnalyzer(csv_path, "fake", llm=llm, **kwargs)._execution_key(code)
+            for kwargs in [{}, {"arrow_strings": True}, {"optimize_dtypes": False}]
+        }
+        assert len(keys) == 3 and None not in keys
+
+
+def test_catalog_version_reuses_fingerprints():
+    with temp_workspace() as tmp:
+        data_dir = os.path.join(tmp, "data")
+        os.makedirs(data_dir)
+        for month in ("01", "02"):
+            with open(os.path.join(data_dir, f"sales_2024_{month}.csv"), "w", encoding="utf-8") as f:
+                f.write("Category,Sales\nBikes,100\nClothing,200\n")
+        code = "print(tables['sales']['Sales'].sum())"
+        analyzer = DataAnalyzer(data_dir, "fake", llm=FakeLLM(lambda q: code), explain="none")
+        cache = analyzer.catalog.dataset_cache
+        calls = []
+        fingerprint = cache.fingerprint
+        cache.fingerprint = lambda source: calls.append(source) or fingerprint(source)
+
+        first = analyzer.generate_code("总销售额")
+        version = analyzer.catalog.version(["sales"])
+        assert first["success"] and len(calls) == 2
+        # 分区文件未变化时不再重新计算指纹
+        assert _execute_hit(analyzer.generate_code("再算一次总销售额")) == "memory"
+        assert analyzer.catalog.version(["sales"]) == version and len(calls) == 2
+
+        # 分区文件修改后重新计算, 数据版本随之变化
+        with open(os.path.join(data_dir, "sales_2024_02.csv"), "a", encoding="utf-8") as f:
+            f.write("Bikes,50\n")
+        assert analyzer.catalog.version(["sales"]) not in (None, version) and len(calls) == 4
+
+        # 分区文件被删除: 不缓存执行结果, 也不抛出异常
+        os.remove(os.path.join(data_dir, "sales_2024_01.csv"))
+        assert analyzer.catalog.version(["sales"]) is None
+        assert analyzer._execution_key(code) is None
+
+
+def main():
+    tests = [
+        test_normalized_keys,
+        test_memory_and_disk_tiers,
+        test_analyzer_skips_repeated_execution,
+        test_key_covers_dtype_settings,
+        test_catalog_version_reuses_fingerprints,
+    ]
+    print("=" * 80)
+    print("🧪 执行结果缓存测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+多进程执行后端测试 - 执行超时、内存上限、工作进程崩溃后的恢复、变量无法序列化与数据集读取失败
+
+使用方式:
+  python test_executor.py
+  或 python -m pytest test_executor.py
+"""
+
+import os
+import threading
+
+import pandas as pd
+
+from code_executor import ProcessCodeExecutor
+
+
+def _frame() -> pd.DataFrame:
+    return pd.DataFrame({"Sales": [1, 2, 3]})
+
+
+def _recovers(executor: ProcessCodeExecutor):
+    """终止的工作进程已被替换, 后续执行正常"""
+    success, output, error, _ = executor.execute("print(df['Sales'].sum())", _frame())
+    assert success and output.strip() == "6", error
+
+
+def test_timeout_and_crash_recovery():
+    executor = ProcessCodeExecutor(workers=1, timeout=1, memory_limit_mb=None)
+    try:
+        success, _, error, _ = executor.execute("import time\ntime.sleep(30)", None)
+        assert not success and error.startswith("TimeoutError")
+        _recovers(executor)
+
+        success, _, error, _ = executor.execute("import os\nos._exit(1)", None)
+        assert not success and "执行进程意外退出(退出码 1)" in error and "内存不足" not in error
+        _recovers(executor)
+    finally:
+        executor.shutdown()
+
+
+def test_memory_limit():
+    executor = ProcessCodeExecutor(workers=1, timeout=30, memory_limit_mb=600)
+    try:
+        code = "import time\nblock = np.ones(200_000_000)\ntime.sleep(30)"
+        success, _, error, _ = executor.execute(code, None)
+        assert not success and error.startswith("MemoryError"), error
+        _recovers(executor)
+    finally:
+        executor.shutdown()
+
+
+def test_errors_reported_without_killing_worker():
+    executor = ProcessCodeExecutor(workers=1, timeout=30, memory_limit_mb=None)
+    try:
+        worker = executor._workers.queue[0]
+
+        # 无法pickle的变量在发送前报告为执行失败
+        success, _, error, _ = executor.execute("print(lock)", None, variables={"lock": threading.Lock()})
+        assert not success and error.startswith("PicklingError"), error
+
+        # 数据集文件在工作进程读取前被删除: 返回读取错误而不是进程退出
+        df = _frame()
+        os.remove(executor._publish([df])[0])
+        success, _, error, _ = executor.execute("print(len(df))", df)
+        assert not success and "数据集读取失败" in error and "内存不足" not in error, error
+
+        _recovers(executor)
+        assert executor._workers.queue[0] is worker and worker.process.is_alive()
+    finally:
+        executor.shutdown()
+
+
+def main():
+    tests = [
+        test_timeout_and_crash_recovery,
+        test_memory_limit,
+        test_errors_reported_without_killing_worker,
+    ]
+    print("=" * 80)
+    print("🧪 多进程执行后端测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
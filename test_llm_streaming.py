@@ -0,0 +1,115 @@
+"""
+LLM流式读取测试 - 代码块闭合后立即停止读取并执行, 不等待模型在代码之后的长篇说明; 提前结束时按文本估算token
+
+使用方式:
+  python test_llm_streaming.py
+  或 python -m pytest test_llm_streaming.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存写入临时目录
+"""
+
+import asyncio
+import math
+
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeLLM
+from test_support import SAMPLE_CSV, temp_workspace
+
+
+CODE = "print(len(df))"
+TRAILER = "\n\n以上代码先读取数据, 再统计行数。" * 50
+CHUNK_SIZE = 8
+
+
+def _analyzer():
+    llm = FakeLLM(lambda q: CODE, trailer=TRAILER, chunk_size=CHUNK_SIZE)
+    analyzer = DataAnalyzer(SAMPLE_CSV, "fake", llm=llm, explain="none", use_cache=False)
+    # 记录开始执行代码时已读取的段数
+    seen = []
+    execute = analyzer._execute_code
+
+    def recording_execute(code):
+        seen.append(llm.streamed_chunks)
+        return execute(code)
+
+    analyzer._execute_code = recording_execute
+    return analyzer, llm, seen
+
+
+def _expected_chunks():
+    code_block = f"```python\n{CODE}\n```"
+    return math.ceil(len(code_block) / CHUNK_SIZE), math.ceil(len(code_block + TRAILER) / CHUNK_SIZE)
+
+
+def test_stops_reading_after_code_block():
+    with temp_workspace():
+        analyzer, llm, seen = _analyzer()
+        result = analyzer.generate_code("一共多少行")
+        code_chunks, total_chunks = _expected_chunks()
+
+        assert result["success"] and result["code"].strip() == CODE
+        # 读到包含闭合标记的那一段即停止, 说明文字不再读取
+        assert llm.streamed_chunks == code_chunks < total_chunks
+        # 开始执行时流已结束, 执行期间和之后都没有再读取
+        assert seen == [code_chunks]
+
+
+def test_async_stops_reading_after_code_block():
+    with temp_workspace():
+        analyzer, llm, seen = _analyzer()
+        result = asyncio.run(analyzer.agenerate_code("一共多少行"))
+        code_chunks, total_chunks = _expected_chunks()
+        assert result["success"]
+        assert llm.streamed_chunks == code_chunks < total_chunks and seen == [code_chunks]
+
+
+def test_early_stop_estimates_tokens():
+    with temp_workspace():
+        analyzer, llm, _ = _analyzer()
+        result = analyzer.generate_code("一共多少行")
+        # 提前结束读取收不到最后一段的用量, 按文本估算并标记
+        call = next(item for item in result["trace"].spans if item.name == "llm")
+        assert call.attributes["estimated"] is True
+        assert call.attributes["prompt_tokens"] > 0 and call.attributes["completion_tokens"] > 0
+        assert result["tokens"]["prompt_tokens"] == call.attributes["prompt_tokens"]
+        assert result["tokens"]["estimated_calls"] == 1
+        assert "(估算)" in result["trace"].format()
+
+        # 读完整个流时使用返回的用量
+        complete = DataAnalyzer(
+            SAMPLE_CSV, "fake", llm=FakeLLM(lambda q: CODE), explain="none", use_cache=False,
+        ).generate_code("一共多少行")
+        call = next(item for item in complete["trace"].spans if item.name == "llm")
+        assert "estimated" not in call.attributes and call.attributes["prompt_tokens"] > 0
+        assert complete["tokens"]["estimated_calls"] == 0
+
+        async_result = asyncio.run(_analyzer()[0].agenerate_code("一共多少行"))
+        assert async_result["tokens"]["estimated_calls"] == 1 and async_result["tokens"]["completion_tokens"] > 0
+
+
+def test_non_streaming_reads_everything():
+    with temp_workspace():
+        llm = FakeLLM(lambda q: CODE, trailer=TRAILER, chunk_size=CHUNK_SIZE)
+        analyzer = DataAnalyzer(SAMPLE_CSV, "fake", llm=llm, explain="none", use_cache=False, streaming=False)
+        result = analyzer.generate_code("一共多少行")
+        # 关闭流式读取时整段返回, 代码块之后的说明不影响代码提取
+        assert result["success"] and result["code"].strip() == CODE and llm.streamed_chunks == 0
+
+
+def main():
+    tests = [
+        test_stops_reading_after_code_block,
+        test_async_stops_reading_after_code_block,
+        test_early_stop_estimates_tokens,
+        test_non_streaming_reads_everything,
+    ]
+    print("=" * 80)
+    print("🧪 LLM流式读取测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
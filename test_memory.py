@@ -0,0 +1,100 @@
+"""
+对话记忆测试 - 环形缓冲区、摘要、超长结果落盘与纠错反馈
+
+使用方式:
+  python test_memory.py
+  或 python -m pytest test_memory.py
+
+使用本地模拟的LLM(不依赖API Key与网络)
+"""
+
+import os
+import tempfile
+
+from conversation_memory import ConversationMemory
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeLLM
+
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "大模型实习项目测试.csv")
+
+
+def test_ring_buffer_and_summaries():
+    memory = ConversationMemory(max_turns=3, max_summaries=2)
+    for i in range(6):
+        memory.add_turn(f"问题{i}", f"print({i})", f"结果{i}\n第二行", "解释")
+    assert [entry["question"] for entry in memory.turns] == ["问题3", "问题4", "问题5"]
+    # 移出的轮次压缩为摘要, 摘要条数同样有上限
+    assert memory.summaries == ["问题1 → 结果1", "问题2 → 结果2"]
+    assert memory.stats()["total_turns"] == 6
+
+    memory.clear()
+    assert memory.turns == [] and memory.summaries == []
+
+
+def test_large_results_spilled():
+    with tempfile.TemporaryDirectory() as tmp:
+        memory = ConversationMemory(max_turns=1, max_result_chars=100, spill_dir=tmp)
+        big = "x" * 10000
+        entry = memory.add_turn("大结果", "print(x)", big, "")
+        assert entry["result_ref"] and len(entry["result"]) < 200
+        assert memory.result_text(entry) == big
+        assert os.listdir(tmp)
+
+        # 移出缓冲区后溢出文件随之删除
+        memory.add_turn("小结果", "print(1)", "1", "")
+        assert os.listdir(tmp) == []
+        assert memory.result_text(entry) == entry["result"]
+
+
+def test_errors_not_accumulated():
+    memory = ConversationMemory()
+    memory.record_error("a", "x" * 100000)
+    memory.record_error("b", "ValueError: boom")
+    assert memory.last_error == {"code": "b", "error": "ValueError: boom"}
+    memory.record_error("c", "y" * 100000)
+    assert len(memory.last_error["error"]) < 5000
+    memory.add_turn("问题", "print(1)", "1", "")
+    assert memory.last_error is None
+
+
+def test_analyzer_history_bounded():
+    codes = {"出错": iter(["raise ValueError('boom')", "print(1)"])}
+    llm = FakeLLM(lambda q: next(codes[q]) if q in codes else f"print('{q}')", explanation="完成。")
+    analyzer = DataAnalyzer(
+        CSV_PATH, "fake", llm=llm, use_cache=False, explain="none",
+        memory=ConversationMemory(max_turns=2),
+    )
+    result = analyzer.generate_code("出错")
+    assert result["success"] and result["retry_count"] == 1
+    for i in range(4):
+        assert analyzer.generate_code(f"问题{i}")["success"]
+
+    assert [entry["question"] for entry in analyzer.execution_history] == ["问题2", "问题3"]
+    assert len(analyzer.memory.summaries) == 3
+    # 更早轮次的摘要进入提示词
+    messages = analyzer._build_code_messages("下一个问题", 0)
+    assert "更早的对话摘要" in messages[0].content and "问题1 → 问题1" in messages[0].content
+
+    session = analyzer.fork_session()
+    assert session.execution_history == [] and session.memory.max_turns == 2
+    assert len(analyzer.execution_history) == 2
+
+
+def main():
+    tests = [
+        test_ring_buffer_and_summaries,
+        test_large_results_spilled,
+        test_errors_not_accumulated,
+        test_analyzer_history_bounded,
+    ]
+    print("=" * 80)
+    print("🧪 对话记忆测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
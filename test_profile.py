@@ -0,0 +1,94 @@
+"""
+数据集概要测试 - 概要统计、提示词中的列描述, 以及结构指纹(schema_hash)在重复加载和缓存读取后保持不变
+
+使用方式:
+  python test_profile.py
+  或 python -m pytest test_profile.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存写入临时目录
+"""
+
+import os
+
+import pandas as pd
+
+from data_analyzer import DataAnalyzer
+from dataset_cache import DatasetCache
+from dataset_profile import DatasetProfile, schema_hash
+from fake_llm import FakeLLM
+from test_support import copy_sample_csv, temp_workspace
+
+
+def _frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "Year": [2017, 2018, 2018, 2019],
+        "Product": pd.Categorical(["Bikes", "Helmets", "Bikes", None]),
+        "Sales": [1.5, 2.5, None, 4.0],
+        "Tags": [["a"], ["b"], [], ["a"]],
+    })
+
+
+def test_build_profile():
+    df = _frame()
+    profile = DatasetProfile.build(df, sample_values=1, head_rows=2)
+    assert profile.rows == 4 and profile.columns == ["Year", "Product", "Sales", "Tags"]
+    assert profile.dtypes["Product"] == "category" and profile.null_counts == {"Year": 0, "Product": 1, "Sales": 1, "Tags": 0}
+    assert profile.cardinality["Year"] == 3 and profile.cardinality["Product"] == 2
+    assert profile.samples["Product"] == ["Bikes"]
+    # 不可哈希的值无法统计基数, 其余统计照常
+    assert "Tags" not in profile.cardinality and profile.text_columns == ["Product", "Tags"]
+    assert len(profile.head) == 2 and "Sales" in profile.describe.columns
+
+    assert profile.column_line("Product") == "  * Product: category (2个不同值, 如: Bikes)"
+    assert profile.column_line("Year") == "  * Year: int64"
+    text = profile.prompt_text("sales.csv", head_rows=1)
+    assert "- 行数: 4" in text and "前1行数据示例" in text
+    assert "前" not in profile.prompt_text("sales.csv", head_rows=0).split("列名和类型")[1]
+    assert profile.dtype_frame()["不同值个数"].tolist()[:2] == [3, 2]
+
+
+def test_schema_hash_stability():
+    df = _frame()
+    key = schema_hash(df)
+    # 只与列名、列顺序和类型有关, 与行内容无关
+    assert DatasetProfile.build(df).schema_hash == key == schema_hash(df.iloc[::-1].head(2))
+    assert schema_hash(df.rename(columns={"Sales": "Revenue"})) != key
+    assert schema_hash(df[["Sales", "Year", "Product", "Tags"]]) != key
+    assert schema_hash(df.astype({"Year": "int32"})) != key
+
+    with temp_workspace() as tmp:
+        cache = DatasetCache(os.path.join(tmp, "cache"))
+        frame = df.drop(columns="Tags")
+        cache.save("k", frame)
+        assert schema_hash(cache.load("k")) == schema_hash(frame)
+
+
+def test_analyzer_schema_hash_survives_cache():
+    with temp_workspace() as tmp:
+        csv_path = copy_sample_csv(tmp)
+        llm = FakeLLM(lambda q: "")
+        first = DataAnalyzer(csv_path, "fake", llm=llm)
+        # 第二次从数据集缓存读取(列类型已压缩), 指纹与首次加载一致
+        cached = DataAnalyzer(csv_path, "fake", llm=llm)
+        assert os.path.exists(cached.dataset_cache.data_path(cached.cache_key))
+        assert first.schema_hash == cached.schema_hash
+        # 相同数据重新计算概要得到相同结果
+        assert DatasetProfile.build(cached.df).schema_hash == first.profile.schema_hash
+
+
+def main():
+    tests = [
+        test_build_profile,
+        test_schema_hash_stability,
+        test_analyzer_schema_hash_survives_cache,
+    ]
+    print("=" * 80)
+    print("🧪 数据集概要测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+提示词预算测试 - 宽表与长对话历史逐级压缩到预算以内, 最紧凑档位仍超出时的警告与统计
+
+使用方式:
+  python test_prompt_builder.py
+  或 python -m pytest test_prompt_builder.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存写入临时目录
+"""
+
+import contextlib
+import io
+
+import pandas as pd
+
+from data_analyzer import DataAnalyzer
+from dataset_profile import DatasetProfile
+from fake_llm import FakeLLM
+from prompt_builder import LEVELS, PromptBuilder, estimate_tokens
+from test_support import SAMPLE_CSV, temp_workspace
+
+
+QUESTION = "Bikes 的 metric_3_value 总和"
+
+
+def _wide_profile(columns: int = 300) -> DatasetProfile:
+    df = pd.DataFrame({f"metric_{i}_value": [1.0, 2.0] for i in range(columns)})
+    df["Product"] = ["Bikes", "Helmets"]
+    return DatasetProfile.build(df)
+
+
+def _history(turns: int = 8):
+    return [
+        {"question": f"第{i}个问题", "code": "x = df['metric_1_value'].sum()\n" * 20, "result": "结果" * 200}
+        for i in range(turns)
+    ]
+
+
+def _render(dataset_info: str) -> str:
+    return "你是数据分析助手。" * 30 + dataset_info
+
+
+def test_prompt_fits_budget():
+    profile = _wide_profile()
+    for budget in (1000, 3000, 20000):
+        prompt, stats = PromptBuilder(profile, budget, "sales.csv").build(
+            QUESTION, _render, _history(), "Traceback ..." * 300, ["更早的摘要"] * 10,
+        )
+        assert stats["estimated_tokens"] <= budget and stats["over_budget"] == 0, stats
+        assert stats["estimated_tokens"] == estimate_tokens(prompt) + estimate_tokens(QUESTION)
+        # 与问题最相关的列始终详细描述
+        assert "metric_3_value: float64" in prompt
+
+    # 预算充足时使用最宽松档位; 预算紧张时去掉对话历史
+    _, loose = PromptBuilder(profile, 20000, "sales.csv").build(QUESTION, _render, _history())
+    assert loose["level"] == 0 and loose["columns_collapsed"] == 0
+    tight, stats = PromptBuilder(profile, 1000, "sales.csv").build(
+        QUESTION, _render, _history(), "Traceback ..." * 300, ["更早的摘要"] * 10,
+    )
+    assert stats["level"] >= 4 and "对话历史" not in tight
+
+
+def test_over_budget_reported():
+    profile = _wide_profile()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        _, stats = PromptBuilder(profile, 200, "sales.csv").build(QUESTION, _render, _history())
+    assert stats["level"] == len(LEVELS) - 1
+    assert stats["over_budget"] == stats["estimated_tokens"] - 200 > 0
+    assert "仍超出预算" in output.getvalue()
+
+    # 分析器在结果的token统计和追踪中记录超出量
+    with temp_workspace():
+        analyzer = DataAnalyzer(
+            SAMPLE_CSV, "fake", llm=FakeLLM(lambda q: "print(len(df))"), explain="none", prompt_budget=100,
+        )
+        result = analyzer.generate_code("一共多少行")
+        assert result["success"] and result["tokens"]["prompt_over_budget"] > 0
+        stage = next(item for item in result["trace"].spans if item.name == "prompt_build")
+        assert stage.attributes["over_budget"] == result["tokens"]["prompt_over_budget"]
+
+        roomy = DataAnalyzer(SAMPLE_CSV, "fake", llm=FakeLLM(lambda q: "print(len(df))"), explain="none")
+        assert roomy.generate_code("一共多少行")["tokens"]["prompt_over_budget"] == 0
+
+
+def main():
+    tests = [
+        test_prompt_fits_budget,
+        test_over_budget_reported,
+    ]
+    print("=" * 80)
+    print("🧪 提示词预算测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+提供商路由测试 - 使用本地模拟的提供商(可设置延迟和 402/429/503 错误)
+
+使用方式:
+  python test_router.py
+  或 python -m pytest test_router.py
+
+覆盖: 错误切换、熔断与冷却、按延迟选择、对冲请求、与 DataAnalyzer 的集成(不依赖API Key与网络)
+"""
+
+import asyncio
+import itertools
+import os
+import time
+
+from langchain_core.messages import HumanMessage
+
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeAPIError, FakeLLM
+from llm_registry import ClientRegistry
+from provider_router import ProviderHealth, ProviderRouter, ProviderRouterError, classify_error
+
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "大模型实习项目测试.csv")
+MESSAGES = [HumanMessage(content="你好")]
+
+
+def _fake(name: str, **kwargs) -> FakeLLM:
+    return FakeLLM(lambda q: "print(len(df))", explanation=name, **kwargs)
+
+
+def test_classify_error():
+    assert classify_error(FakeAPIError(402)) == "payment"
+    assert classify_error(FakeAPIError(429)) == "rate_limit"
+    assert classify_error(FakeAPIError(503)) == "unavailable"
+    assert classify_error(ValueError("bad request")) == "other"
+    assert classify_error("Error code: 402 - Insufficient Balance") == "payment"
+
+
+def test_failover_on_payment_error():
+    broke = _fake("a", errors=itertools.repeat(402))
+    healthy = _fake("b")
+    router = ProviderRouter({"a": broke, "b": healthy}, health={})
+
+    assert router.invoke(MESSAGES).content == "b"
+    assert router.last_provider == "b"
+    # 余额不足后熔断, 后续请求不再发往 a
+    assert router.invoke(MESSAGES).content == "b"
+    assert broke.calls == 1
+    assert not router.health("a").is_available()
+
+
+def test_rate_limit_circuit_recovers_after_cooldown():
+    health = {"a": ProviderHealth("a", cooldown=0.2)}
+    limited = _fake("a", errors=[429])
+    flaky = _fake("b", errors=[None, 503, 503, 503])
+    router = ProviderRouter({"a": limited, "b": flaky}, health=health)
+
+    # 429 响应带 "retry after 1 seconds", 熔断1秒
+    assert router.invoke(MESSAGES).content == "b"
+    assert health["a"].rate_limited == 1
+    assert router.ranked() == ["b"]
+
+    time.sleep(1.05)
+    # 冷却结束后 a 重新可用(半开), b 出错时切换回 a
+    assert router.invoke(MESSAGES).content == "a"
+    assert health["a"].is_available()
+
+
+def test_all_providers_failing_raises():
+    router = ProviderRouter({
+        "a": _fake("a", errors=itertools.repeat(503)),
+        "b": _fake("b", errors=itertools.repeat(429)),
+    }, health={})
+    try:
+        router.invoke(MESSAGES)
+    except ProviderRouterError as e:
+        assert [name for name, _ in e.errors] == ["a", "b"]
+    else:
+        raise AssertionError("应抛出 ProviderRouterError")
+
+
+def test_non_retryable_error_is_not_masked():
+    class Broken(FakeLLM):
+        def invoke(self, messages, **kwargs):
+            raise ValueError("invalid request")
+
+    router = ProviderRouter({"a": Broken(lambda q: ""), "b": _fake("b")}, health={})
+    try:
+        router.invoke(MESSAGES)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("非可切换错误应直接抛出")
+
+
+def test_routes_to_lowest_latency():
+    slow = _fake("slow", latency=0.1)
+    fast = _fake("fast", latency=0.01)
+    router = ProviderRouter({"slow": slow, "fast": fast}, health={})
+
+    answers = [router.invoke(MESSAGES).content for _ in range(6)]
+    # 两个提供商各试探一次后, 请求集中到延迟低的提供商
+    assert answers[2:] == ["fast"] * 4
+    stats = router.stats()
+    assert stats["fast"]["p95"] < stats["slow"]["p95"]
+
+
+def test_hedged_request_returns_faster_provider():
+    router = ProviderRouter({
+        "slow": _fake("slow", latency=1.0),
+        "fast": _fake("fast", latency=0.05),
+    }, hedge_after=0.1, health={})
+
+    start = time.perf_counter()
+    assert router.invoke(MESSAGES).content == "fast"
+    assert time.perf_counter() - start < 0.5
+
+
+def test_async_hedged_request_cancels_loser():
+    slow = _fake("slow", latency=1.0)
+    router = ProviderRouter({"slow": slow, "fast": _fake("fast", latency=0.05)}, hedge_after=0.1, health={})
+
+    async def run():
+        start = time.perf_counter()
+        response = await router.ainvoke(MESSAGES)
+        return response, time.perf_counter() - start
+
+    response, elapsed = asyncio.run(run())
+    assert response.content == "fast"
+    assert elapsed < 0.5
+    # 被取消的慢请求不计入错误统计
+    assert router.health("slow").error_rate == 0
+
+
+def test_stream_fails_over_before_first_chunk():
+    router = ProviderRouter({"a": _fake("a", errors=[429]), "b": _fake("b")}, health={})
+    text = "".join(chunk.content for chunk in router.stream(MESSAGES))
+    assert text == "b"
+    assert router.last_provider == "b"
+
+
+def test_analyzer_uses_router():
+    router = ProviderRouter({
+        "a": _fake("a", errors=itertools.repeat(402)),
+        "b": _fake("b"),
+    }, health={})
+    analyzer = DataAnalyzer(CSV_PATH, "auto", llm=router, use_cache=False)
+
+    result = analyzer.generate_code("有多少行数据?")
+    assert result["success"], result["error"]
+    assert result["execution_result"].strip() == str(len(analyzer.df))
+    assert result["explanation"] == "b"
+    assert analyzer.active_provider == "b"
+
+
+def test_registry_reuses_clients():
+    registry = ClientRegistry()
+    saved = os.environ.get("QWEN_API_KEY")
+    os.environ["QWEN_API_KEY"] = "sk-test"
+    try:
+        client = registry.get("qwen3")
+        assert registry.get("qwen") is client
+        assert client.sync_client() is client.sync_client()
+
+        async def per_loop():
+            return client.async_client()
+
+        # 异步连接绑定事件循环, 每个事件循环各自一个实例
+        assert asyncio.run(per_loop()) is not asyncio.run(per_loop())
+
+        # 更换API Key后创建新客户端
+        os.environ["QWEN_API_KEY"] = "sk-rotated"
+        assert registry.get("qwen3") is not client
+    finally:
+        if saved is None:
+            os.environ.pop("QWEN_API_KEY", None)
+        else:
+            os.environ["QWEN_API_KEY"] = saved
+        registry.clear()
+
+
+def main():
+    tests = [
+        test_classify_error,
+        test_failover_on_payment_error,
+        test_rate_limit_circuit_recovers_after_cooldown,
+        test_all_providers_failing_raises,
+        test_non_retryable_error_is_not_masked,
+        test_routes_to_lowest_latency,
+        test_hedged_request_returns_faster_provider,
+        test_async_hedged_request_cancels_loser,
+        test_stream_fails_over_before_first_chunk,
+        test_analyzer_uses_router,
+        test_registry_reuses_clients,
+    ]
+    print("=" * 80)
+    print("🧪 提供商路由测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+会话持久化测试 - 保存、按ID恢复(不重新读取CSV)与数据源变化时的处理
+
+使用方式:
+  python test_sessions.py
+  或 python -m pytest test_sessions.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存和会话写入临时目录
+"""
+
+import contextlib
+import io
+import os
+
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeLLM
+from session_store import SessionStore
+from test_support import SAMPLE_CSV, copy_sample_csv, temp_workspace
+from tracing import Trace
+
+
+@contextlib.contextmanager
+def _workspace():
+    """临时的缓存目录、CSV副本和会话存储"""
+    with temp_workspace() as tmp:
+        yield copy_sample_csv(tmp), SessionStore(os.path.join(tmp, "sessions.sqlite"))
+
+
+def _llm(code: str = "print(df['Sales'].sum())") -> FakeLLM:
+    return FakeLLM(lambda q: code, explanation="总销售额如上。")
+
+
+def test_resume_without_reading_csv():
+    with _workspace() as (csv_path, store):
+        analyzer = DataAnalyzer(csv_path, "fake", llm=_llm(), session_store=store)
+        assert analyzer.generate_code("总销售额是多少?")["success"]
+
+        trace = Trace("load")
+        with trace.activate():
+            resumed = DataAnalyzer.resume(analyzer.session_id, store, llm=_llm("print(len(df))"))
+        # 只读取会话记录: 没有读取CSV、清理或计算概要
+        assert not {"read_csv", "clean", "profile", "cache_load"} & set(trace.stages()), trace.stages()
+        assert resumed._df is None
+        assert resumed.current_provider == "fake"
+        assert resumed.profile.rows == analyzer.profile.rows
+        assert [hist["question"] for hist in resumed.execution_history] == ["总销售额是多少?"]
+
+        result = resumed.generate_code("有多少行?")
+        assert result["success"] and result["execution_result"].strip() == str(analyzer.profile.rows)
+        assert store.list()[0]["turns"] == 2
+
+
+def test_modified_source_reloaded_with_history():
+    with _workspace() as (csv_path, store):
+        analyzer = DataAnalyzer(csv_path, "fake", llm=_llm(), session_store=store)
+        analyzer.generate_code("总销售额是多少?")
+        with open(csv_path, "a", encoding="utf-8") as f:
+            f.write('2024,Bikes,New Bike," $1,000 ",50%\n')
+
+        resumed = DataAnalyzer(csv_path, "fake", llm=_llm(), session_store=store, session_id=analyzer.session_id)
+        assert resumed._df is not None and len(resumed.df) == analyzer.profile.rows + 1
+        # 对话记忆仍然恢复
+        assert len(resumed.execution_history) == 1
+
+
+def test_resume_uploaded_file():
+    with _workspace() as (csv_path, store):
+        with open(csv_path, "rb") as f:
+            content = f.read()
+        upload = io.BytesIO(content)
+        upload.name = "upload.csv"
+        analyzer = DataAnalyzer(upload, "fake", llm=_llm(), session_store=store)
+        assert analyzer.generate_code("总销售额是多少?")["success"]
+        # 以文件名和内容指纹标识上传的文件
+        assert store.load(analyzer.session_id)["source"].startswith("upload.csv#")
+
+        resumed = DataAnalyzer.resume(analyzer.session_id, store, llm=_llm("print(len(df))"), explain="none")
+        assert resumed._df is None and len(resumed.execution_history) == 1
+        result = resumed.generate_code("有多少行?")
+        assert result["success"] and result["execution_result"].strip() == str(analyzer.profile.rows)
+        assert store.load(analyzer.session_id)["source"] == store.load(resumed.session_id)["source"]
+
+        # 同名但内容不同的上传文件不恢复该会话
+        other = io.BytesIO(content + b'2024,Bikes,New Bike," $1,000 ",50%\n')
+        other.name = "upload.csv"
+        fresh = DataAnalyzer(other, "fake", llm=_llm(), session_store=store, session_id=analyzer.session_id)
+        assert fresh.execution_history == [] and fresh.session_id != analyzer.session_id
+
+        # 列式存储被清理后无法恢复
+        os.remove(resumed.store_path)
+        try:
+            DataAnalyzer.resume(analyzer.session_id, store, llm=_llm())
+            assert False, "数据已被清理的上传文件会话应抛出FileNotFoundError"
+        except FileNotFoundError:
+            pass
+
+
+def test_other_source_and_forks_start_fresh():
+    with _workspace() as (csv_path, store):
+        analyzer = DataAnalyzer(csv_path, "fake", llm=_llm(), session_store=store)
+        analyzer.generate_code("总销售额是多少?")
+
+        fork = analyzer.fork_session()
+        fork.generate_code("派生会话的问题")
+        assert store.list()[0]["turns"] == 1
+
+        other = DataAnalyzer(SAMPLE_CSV, "fake", llm=_llm(), session_store=store, session_id=analyzer.session_id)
+        assert other.execution_history == []
+        # 其他数据源使用新的会话ID, 原会话的记录不被覆盖
+        assert other.session_id != analyzer.session_id
+        original = store.load(analyzer.session_id)
+        assert original["source"] == os.path.abspath(csv_path)
+        assert len(DataAnalyzer.resume(analyzer.session_id, store, llm=_llm()).execution_history) == 1
+
+        try:
+            DataAnalyzer.resume("missing", store)
+            assert False, "不存在的会话应抛出KeyError"
+        except KeyError:
+            pass
+
+
+def main():
+    tests = [
+        test_resume_without_reading_csv,
+        test_modified_source_reloaded_with_history,
+        test_resume_uploaded_file,
+        test_other_source_and_forks_start_fresh,
+    ]
+    print("=" * 80)
+    print("🧪 会话持久化测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+启动与延迟加载测试 - 提供商SDK与matplotlib只在需要时导入
+
+使用方式:
+  python test_startup.py
+  或 python -m pytest test_startup.py
+
+在全新的子进程中导入/运行分析器, 检查 sys.modules (不依赖API Key与网络)
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+LAZY_MODULES = ["langchain_openai", "langchain_anthropic", "langchain_google_genai", "matplotlib"]
+
+_SCRIPT = """
+import json, sys
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeLLM
+
+codes = {{"rows": "print(len(df))", "plot": "df['Sales'].plot()\\nprint('ok')"}}
+analyzer = DataAnalyzer("data/大模型实习项目测试.csv", "fake", llm=FakeLLM(lambda q: codes[q]), use_cache=False)
+loaded = {{}}
+for question in {questions!r}:
+    result = analyzer.generate_code(question)
+    assert result["success"], result["error"]
+    loaded[question] = [name for name in {modules!r} if name in sys.modules]
+print("RESULT " + json.dumps(loaded))
+"""
+
+
+def _loaded_modules(questions):
+    proc = subprocess.run(
+        [sys.executable, "-c", _SCRIPT.format(questions=questions, modules=LAZY_MODULES)],
+        cwd=ROOT, capture_output=True, text=True, encoding="utf-8",
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    line = [line for line in proc.stdout.splitlines() if line.startswith("RESULT ")][-1]
+    return json.loads(line[len("RESULT "):])
+
+
+def test_no_heavy_imports_without_plotting():
+    loaded = _loaded_modules(["rows"])
+    assert loaded["rows"] == [], loaded
+
+
+def test_matplotlib_loaded_when_code_plots():
+    loaded = _loaded_modules(["rows", "plot"])
+    assert loaded["rows"] == []
+    assert loaded["plot"] == ["matplotlib"], loaded
+
+
+def main():
+    tests = [
+        test_no_heavy_imports_without_plotting,
+        test_matplotlib_loaded_when_code_plots,
+    ]
+    print("=" * 80)
+    print("🧪 启动与延迟加载测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
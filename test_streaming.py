@@ -0,0 +1,115 @@
+"""
+分块流式加载测试 - 各块列类型不一致时的schema对齐与放宽、与整体读取的结果一致、存储路径
+
+使用方式:
+  python test_streaming.py
+  或 python -m pytest test_streaming.py
+
+使用本地模拟的LLM(不依赖API Key与网络), 缓存写入临时目录
+"""
+
+import os
+
+import pandas as pd
+
+from csv_streaming import default_store_path, stream_csv_to_parquet
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeLLM
+from test_support import temp_workspace
+
+
+def _write_drifting_csv(path: str, rows: int = 1000) -> str:
+    """各列在后续块中类型变化: Sales第950行出现小数, Code先为文本后为数字, Note前200行为空"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("Year,Sales,Code,Note\n")
+        for i in range(rows):
+            sales = '"$2.50"' if i == 950 else f'"${1000 + i:,}"'
+            code = f"A{i}" if i < 100 else str(i)
+            note = "" if i < 200 else f"n{i}"
+            f.write(f"{2017 + i % 3},{sales},{code},{note}\n")
+    return path
+
+
+def _load(csv_path: str, **kwargs) -> pd.DataFrame:
+    analyzer = DataAnalyzer(
+        csv_path, "fake", llm=FakeLLM(lambda q: ""), use_cache=False, optimize_dtypes=False, **kwargs
+    )
+    return analyzer.df
+
+
+def test_schema_drift_between_chunks():
+    with temp_workspace() as tmp:
+        csv_path = _write_drifting_csv(os.path.join(tmp, "sales.csv"))
+        streamed = _load(csv_path, chunksize=100)
+        plain = _load(csv_path)
+
+        # 首块为整数的列出现小数后放宽为float64, 已写入的块随之转换
+        assert streamed["Sales"].dtype == "float64"
+        assert streamed["Sales"].iloc[950] == 2.5 and streamed["Sales"].iloc[0] == 1000
+        assert streamed["Sales"].sum() == plain["Sales"].sum()
+        # 没有小数的整数列保持整数
+        assert streamed["Year"].dtype == "int64"
+        # 首块为文本的列保持文本, 首块全空的列按文本存储
+        assert streamed["Code"].iloc[150] == "150" and streamed["Note"].iloc[500] == "n500"
+        assert streamed["Note"].isna().sum() == 200
+        assert len(streamed) == len(plain) == 1000
+
+
+def test_decimals_with_unparseable_value():
+    # 首块为整数; 后续块既有小数又有一个无法解析的值, 该块按文本读入
+    with temp_workspace() as tmp:
+        csv_path = os.path.join(tmp, "messy.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("Year,Qty\n")
+            for i in range(1000):
+                qty = "abc" if i == 700 else (f"{i}.5" if i >= 500 else str(i))
+                f.write(f"{2017 + i % 3},{qty}\n")
+
+        streamed = _load(csv_path, chunksize=500)
+        assert streamed["Qty"].dtype == "float64"
+        assert streamed["Qty"].iloc[10] == 10 and streamed["Qty"].iloc[600] == 600.5
+        # 无法解析的值为缺失值
+        assert pd.isna(streamed["Qty"].iloc[700]) and streamed["Qty"].isna().sum() == 1
+        assert len(streamed) == 1000 and streamed["Year"].dtype == "int64"
+
+
+def test_stream_without_drift_keeps_first_schema():
+    with temp_workspace() as tmp:
+        csv_path = os.path.join(tmp, "plain.csv")
+        pd.DataFrame({"a": range(500), "b": [f"x{i}" for i in range(500)]}).to_csv(csv_path, index=False)
+        store_path = os.path.join(tmp, "plain.parquet")
+        progress = []
+        rows = stream_csv_to_parquet(csv_path, store_path, lambda chunk, rules: rules or {}, 120, progress.append)
+        assert rows == 500 and progress == [120, 240, 360, 480, 500]
+        stored = pd.read_parquet(store_path)
+        assert stored["a"].dtype == "int64" and stored["a"].sum() == sum(range(500))
+        assert not os.path.exists(store_path + ".tmp")
+
+
+def test_default_store_path_per_source():
+    with temp_workspace() as tmp:
+        first = os.path.join(tmp, "a", "sales.csv")
+        second = os.path.join(tmp, "b", "sales.csv")
+        # 不同目录下的同名文件互不覆盖, 同一文件的路径稳定
+        assert default_store_path(first) != default_store_path(second)
+        assert default_store_path(first) == default_store_path(os.path.relpath(first))
+        assert os.path.basename(default_store_path(first)).startswith("sales-")
+
+
+def main():
+    tests = [
+        test_schema_drift_between_chunks,
+        test_decimals_with_unparseable_value,
+        test_stream_without_drift_keeps_first_schema,
+        test_default_store_path_per_source,
+    ]
+    print("=" * 80)
+    print("🧪 分块流式加载测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
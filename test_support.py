@@ -0,0 +1,39 @@
+"""
+测试的公共工具 - 临时工作目录与样例数据
+
+各测试脚本既可直接运行也可由pytest收集, 因此不依赖pytest的fixture
+"""
+
+import contextlib
+import os
+import shutil
+import tempfile
+from typing import Iterator
+from unittest import mock
+
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "大模型实习项目测试.csv")
+
+
+@contextlib.contextmanager
+def temp_workspace() -> Iterator[str]:
+    """
+    临时工作目录: 数据缓存目录(EXCEL_AGENT_CACHE_DIR)指向其中的 cache 子目录,
+    退出时恢复环境变量并删除整个目录
+
+    Yields:
+        临时目录路径
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        with mock.patch.dict(os.environ, {"EXCEL_AGENT_CACHE_DIR": os.path.join(tmp, "cache")}):
+            yield tmp
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def copy_sample_csv(directory: str, name: str = "sales.csv") -> str:
+    """将样例CSV复制到目录中(测试可修改副本), 返回副本路径"""
+    path = os.path.join(directory, name)
+    shutil.copy(SAMPLE_CSV, path)
+    return path
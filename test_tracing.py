@@ -0,0 +1,115 @@
+"""
+追踪测试 - 各阶段耗时、LLM调用token与导出格式
+
+使用方式:
+  python test_tracing.py
+  或 python -m pytest test_tracing.py
+
+使用本地模拟的LLM(不依赖API Key与网络)
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+
+from data_analyzer import DataAnalyzer
+from fake_llm import FakeLLM
+
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "大模型实习项目测试.csv")
+
+
+def _analyzer(code: str = "print(df['Sales'].sum())", **kwargs) -> DataAnalyzer:
+    llm = FakeLLM(lambda q: code, explanation="总销售额如上。", latency=0.02)
+    return DataAnalyzer(CSV_PATH, "fake", llm=llm, use_cache=False, **kwargs)
+
+
+def test_stages_and_llm_calls():
+    analyzer = _analyzer(streaming=False, trace_memory=True)
+    result = analyzer.generate_code("总销售额是多少?")
+    assert result["success"], result["error"]
+
+    trace = result["trace"]
+    stages = trace.stages()
+    for name in ["code_generation", "prompt_build", "llm", "execute", "explanation"]:
+        assert name in stages, stages
+    assert trace.duration >= stages["code_generation"]
+
+    calls = trace.llm_calls()
+    assert len(calls) == 2
+    assert all(call["provider"] == "fake" and call["prompt_tokens"] > 0 for call in calls)
+    # 各次调用的token之和与结果中的累计值一致
+    assert sum(call["prompt_tokens"] for call in calls) == result["tokens"]["prompt_tokens"]
+
+    execute = next(item for item in trace.spans if item.name == "execute")
+    assert execute.attributes["success"] is True
+    assert execute.attributes["cpu_time"] >= 0
+    assert execute.attributes["peak_memory"] > 0
+    assert "execute" in trace.format()
+
+
+def test_retries_recorded_per_attempt():
+    codes = iter(["raise ValueError('boom')", "print(1)"])
+    analyzer = DataAnalyzer(CSV_PATH, "fake", llm=FakeLLM(lambda q: next(codes)), use_cache=False, explain="none")
+    result = analyzer.generate_code("重试?")
+    assert result["success"] and result["retry_count"] == 1
+
+    attempts = [item.attributes["attempt"] for item in result["trace"].spans if item.name == "code_generation"]
+    assert attempts == [0, 1]
+    outcomes = [item.attributes["success"] for item in result["trace"].spans if item.name == "execute"]
+    assert outcomes == [False, True]
+
+
+def test_export_jsonl_after_async_explanation():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "trace.jsonl")
+        analyzer = _analyzer(trace_path=path, explain="async")
+
+        async def run():
+            result = await analyzer.agenerate_code("总销售额是多少?")
+            await result["explanation_future"]
+            return result
+
+        asyncio.run(run())
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+    assert len(records) == 1
+    # 后台解释完成后才导出, 解释阶段已计入
+    assert "explanation" in records[0]["stages"]
+    assert records[0]["attributes"]["success"] is True
+
+
+def test_export_otlp():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "trace.otlp.jsonl")
+        analyzer = _analyzer(trace_path=path, trace_format="otlp", explain="none")
+        analyzer.generate_code("总销售额是多少?")
+        with open(path, encoding="utf-8") as f:
+            request = json.loads(f.readline())
+
+    spans = request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root = spans[0]
+    assert root["name"] == "generate_code" and "parentSpanId" not in root
+    assert all(item["traceId"] == root["traceId"] for item in spans)
+    assert all(item.get("parentSpanId") for item in spans[1:])
+    assert int(root["endTimeUnixNano"]) >= int(root["startTimeUnixNano"])
+
+
+def main():
+    tests = [
+        test_stages_and_llm_calls,
+        test_retries_recorded_per_attempt,
+        test_export_jsonl_after_async_explanation,
+        test_export_otlp,
+    ]
+    print("=" * 80)
+    print("🧪 追踪测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
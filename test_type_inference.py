@@ -0,0 +1,96 @@
+"""
+列类型推断测试 - 货币、百分比、千分位、日期列的识别与转换, 95%匹配阈值, 清洗报告与规则沿用
+
+使用方式:
+  python test_type_inference.py
+  或 python -m pytest test_type_inference.py
+"""
+
+import pandas as pd
+
+from type_inference import MATCH_THRESHOLD, clean_dataframe, format_report, infer_column_kind
+
+
+def test_infer_formats():
+    cases = {
+        "currency": [" $1,000 ", "$25.50", "¥300", "-$12", "€4.5"],
+        "percent": ["50%", "12.5%", " 3% ", "100%", "0.5%"],
+        "thousands": ["1,000", "25,300", "7", "1,234,567.5", "-2,000"],
+        "numeric": ["1", "2.5", "-3", "+4", ".5"],
+        "date": ["2024-01-05", "2024/2/6", "2024.03.07", "05/01/2024", "2024-01-05 10:30"],
+    }
+    for kind, values in cases.items():
+        assert infer_column_kind(pd.Series(values * 20, dtype=object)) == kind, kind
+
+    # 普通文本、空列和已是数值的列不转换
+    assert infer_column_kind(pd.Series(["Bikes", "Helmets", "A1"])) is None
+    assert infer_column_kind(pd.Series([None, " ", ""], dtype=object)) is None
+    assert infer_column_kind(pd.Series([1.0, 2.0])) is None
+
+
+def test_match_threshold():
+    assert MATCH_THRESHOLD == 0.95
+
+    def column(bad: int) -> pd.Series:
+        return pd.Series([f"${i}" for i in range(100 - bad)] + ["n/a"] * bad, dtype=object)
+
+    # 恰好95%的值符合格式时转换, 其余被置为NaN并计入报告
+    df = pd.DataFrame({"at": column(5), "below": column(6)})
+    rules, report = clean_dataframe(df)
+    assert rules == {"at": "currency"}
+    assert [item["column"] for item in report] == ["at"]
+    assert report[0]["failed"] == 5 and df["at"].isna().sum() == 5
+    assert df["below"].dtype == object and df["below"].iloc[0] == "$0"
+    assert "5个值无法解析" in format_report(report)
+
+
+def test_sampling_covers_whole_column():
+    # 前部全是数字、尾部全是文本: 只看首行会误判为数字
+    values = [str(i) for i in range(900)] + ["text"] * 100
+    assert infer_column_kind(pd.Series(values, dtype=object)) is None
+    assert infer_column_kind(pd.Series(values, dtype=object), sample_size=50) is None
+
+
+def test_clean_dataframe_converts_and_reuses_rules():
+    df = pd.DataFrame({
+        "Sales": [" $1,000 ", "$2,500.50", None],
+        "Rate": ["50%", "12.5%", "7%"],
+        "Date": ["2024-01-05", "2024/02/06", "2024.03.07"],
+        "Product": ["Bikes", "Helmets", "Bikes"],
+    })
+    rules, report = clean_dataframe(df)
+    assert rules == {"Sales": "currency", "Rate": "percent", "Date": "date"}
+    assert df["Sales"].tolist()[:2] == [1000.0, 2500.5] and pd.isna(df["Sales"].iloc[2])
+    # 百分比保留原始数值(50% → 50)
+    assert df["Rate"].tolist() == [50.0, 12.5, 7.0]
+    assert pd.api.types.is_datetime64_any_dtype(df["Date"])
+    assert df["Date"].dt.month.tolist() == [1, 2, 3]
+    assert df["Product"].iloc[0] == "Bikes"
+    assert all(item["failed"] == 0 for item in report)
+    assert "Sales (货币 → float64)" in format_report(report)
+
+    # 分块加载时后续块沿用已有规则, 即使该块单独看不满足阈值
+    chunk = pd.DataFrame({"Sales": ["$3", "oops"], "Rate": ["1%", "2%"]})
+    chunk_rules, chunk_report = clean_dataframe(chunk, rules)
+    assert chunk_rules == {"Sales": "currency", "Rate": "percent"}
+    assert chunk["Sales"].iloc[0] == 3.0 and pd.isna(chunk["Sales"].iloc[1])
+    assert chunk_report[0]["failed"] == 1
+
+
+def main():
+    tests = [
+        test_infer_formats,
+        test_match_threshold,
+        test_sampling_covers_whole_column,
+        test_clean_dataframe_converts_and_reuses_rules,
+    ]
+    print("=" * 80)
+    print("🧪 列类型推断测试")
+    print("=" * 80)
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
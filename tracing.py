@@ -0,0 +1,351 @@
+"""
+问题级追踪
+记录一次提问各阶段(缓存查询、提示词构建、LLM调用、代码执行、图形渲染、解释)的耗时,
+每次LLM调用的token用量与提供商, 以及生成代码执行的CPU时间和内存峰值;
+可导出为JSON Lines或OpenTelemetry(OTLP JSON, 每行一个 ExportTraceServiceRequest)格式的本地文件
+
+使用方式:
+    trace = Trace("generate_code", question=question)
+    with trace.activate():
+        with span("execute", attempt=0) as s:
+            ...
+            s.set(success=True)
+    trace.finish()
+"""
+
+import json
+import secrets
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+# 当前执行上下文中正在进行的span(线程/asyncio任务各自独立)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+TRACE_FORMATS = ("jsonl", "otlp")
+
+# tracemalloc 为进程级开关, 按引用计数在并发测量间共享
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False
+
+
+class Span:
+    """一个计时阶段"""
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key: str, value: float):
+        """累加数值属性(如同一次流式调用分多段返回的token数)"""
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def end(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": None if self.duration is None else round(self.duration, 6),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NullSpan:
+    """未在追踪中时使用的占位span, 所有操作均为空操作"""
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, key: str, value: float):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """一次提问的追踪记录, 根span即整个提问"""
+
+    def __init__(self, name: str = "generate_code", **attributes):
+        self.trace_id = secrets.token_hex(16)
+        self._lock = threading.Lock()
+        self.root = Span(self, name, None, attributes)
+        self.spans: List[Span] = [self.root]
+
+    @contextmanager
+    def activate(self) -> Iterator["Trace"]:
+        """在当前上下文中以根span为父级, 其中(及复制了该上下文的线程/任务中)的 span() 均记入本追踪"""
+        token = _current_span.set(self.root)
+        try:
+            yield self
+        finally:
+            _current_span.reset(token)
+
+    def _start_span(self, name: str, parent: Optional[Span], attributes: Dict[str, Any]) -> Span:
+        child = Span(self, name, (parent or self.root).span_id, attributes)
+        with self._lock:
+            self.spans.append(child)
+        return child
+
+    def record(self, name: str, seconds: float, parent: Optional[Span] = None, **attributes) -> Span:
+        """记录一个已在别处计时完成的阶段(如工作进程或界面中的图形渲染)"""
+        child = self._start_span(name, parent, attributes)
+        child.start -= seconds
+        child.duration = seconds
+        return child
+
+    def finish(self, **attributes):
+        """结束根span(后台生成的解释可在此之后结束)"""
+        self.root.set(**attributes)
+        self.root.end()
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.root.duration
+
+    def stages(self) -> Dict[str, float]:
+        """各阶段累计耗时(秒), 同名阶段(如多次重试)相加; 未结束的阶段不计入"""
+        totals: Dict[str, float] = {}
+        for item in self.spans[1:]:
+            if item.duration is not None:
+                totals[item.name] = round(totals.get(item.name, 0.0) + item.duration, 6)
+        return totals
+
+    def llm_calls(self) -> List[Dict[str, Any]]:
+        """每次LLM调用的耗时、提供商和token用量"""
+        return [
+            {"duration": item.duration, **item.attributes}
+            for item in self.spans if item.name == "llm"
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "start": self.root.start,
+            "duration": self.root.duration,
+            "attributes": self.root.attributes,
+            "stages": self.stages(),
+            "spans": [item.to_dict() for item in self.spans[1:]],
+        }
+
+    def to_otlp(self, service_name: str = "excel_agent") -> Dict[str, Any]:
+        """OTLP JSON 格式(ExportTraceServiceRequest), 可由 OpenTelemetry Collector 的文件接收器读取"""
+        spans = []
+        for item in self.spans:
+            start_ns = int(item.start * 1e9)
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(start_ns),
+                "endTimeUnixNano": str(start_ns + int((item.duration or 0.0) * 1e9)),
+                "attributes": [_otlp_attribute(key, value) for key, value in item.attributes.items() if value is not None],
+                "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+            }
+            if item.parent_id:
+                otlp_span["parentSpanId"] = item.parent_id
+            spans.append(otlp_span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", service_name)]},
+            "scopeSpans": [{"scope": {"name": "excel_agent.tracing"}, "spans": spans}],
+        }]}
+
+    def format(self) -> str:
+        """按阶段的耗时明细(命令行展示)"""
+        attrs = self.root.attributes
+        total = f"{self.root.duration:.3f}s" if self.root.duration is not None else "进行中"
+        header = f"⏱ 总耗时 {total}"
+        if attrs.get("provider"):
+            header += f" | 提供商 {attrs['provider']}"
+        if attrs.get("prompt_tokens") or attrs.get("completion_tokens"):
+            header += f" | tokens {attrs.get('prompt_tokens', 0)}+{attrs.get('completion_tokens', 0)}"
+        lines = [header]
+
+        depth = {self.root.span_id: 0}
+        for item in self.spans[1:]:
+            level = depth.get(item.parent_id, 0) + 1
+            depth[item.span_id] = level
+            label = "  " * level + item.name
+            if "attempt" in item.attributes:
+                label += f"#{item.attributes['attempt'] + 1}"
+            elapsed = f"{item.duration:.3f}s" if item.duration is not None else "进行中"
+            lines.append(f"{label:<24}{elapsed:>10}  {_describe(item)}".rstrip())
+        return "\n".join(lines)
+
+
+def _describe(item: Span) -> str:
+    attrs = item.attributes
+    parts = []
+    if item.name == "llm":
+        if attrs.get("provider"):
+            parts.append(str(attrs["provider"]))
+        if attrs.get("prompt_tokens") or attrs.get("completion_tokens"):
+            estimated = "(估算)" if attrs.get("estimated") else ""
+            parts.append(f"tokens {attrs.get('prompt_tokens', 0)}+{attrs.get('completion_tokens', 0)}{estimated}")
+        if attrs.get("first_token") is not None:
+            parts.append(f"首字 {attrs['first_token']:.3f}s")
+    if attrs.get("estimated_tokens") is not None:
+        parts.append(f"约{attrs['estimated_tokens']} tokens(档位 {attrs.get('level', 0)})")
+        if attrs.get("over_budget"):
+            parts.append(f"超出预算 {attrs['over_budget']} tokens")
+    if attrs.get("hit"):
+        parts.append(f"命中({attrs['hit']})")
+    if attrs.get("cpu_time") is not None:
+        parts.append(f"CPU {attrs['cpu_time']:.3f}s")
+    if attrs.get("peak_memory") is not None:
+        parts.append(f"内存峰值 {attrs['peak_memory'] / 1024 ** 2:.1f}MB")
+    if attrs.get("peak_rss") is not None:
+        parts.append(f"进程内存峰值 {attrs['peak_rss'] / 1024 ** 2:.1f}MB")
+    if attrs.get("success") is False:
+        parts.append("失败")
+    if item.error:
+        parts.append(f"错误: {item.error[:60]}")
+    return "  ".join(parts)
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Any]:
+    """
+    在当前追踪中记录一个阶段; 不在追踪中时为空操作
+
+    Yields:
+        Span(可用 set/add 写入属性), 不在追踪中时为空操作的占位对象
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield _NULL_SPAN
+        return
+    child = parent.trace._start_span(name, parent, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def annotate(**attributes):
+    """为当前span设置属性"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def increment(key: str, value: float):
+    """累加当前span的数值属性"""
+    current = _current_span.get()
+    if current is not None and value:
+        current.add(key, value)
+
+
+def record_span(name: str, seconds: float, **attributes):
+    """在当前span下记录一个已计时完成的阶段, 见 Trace.record"""
+    parent = _current_span.get()
+    if parent is not None:
+        parent.trace.record(name, seconds, parent=parent, **attributes)
+
+
+@contextmanager
+def measure_resources(memory: bool = False) -> Iterator[None]:
+    """
+    记录当前线程的CPU时间到当前span; memory 为True时用tracemalloc记录Python内存分配峰值
+    (tracemalloc为进程级统计, 并发执行时峰值包含其他线程的分配, 且会使执行变慢)
+    """
+    current = _current_span.get()
+    if current is None:
+        yield
+        return
+    if memory:
+        _start_tracemalloc()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        current.set(cpu_time=round(time.thread_time() - cpu_start, 6))
+        if memory:
+            current.set(peak_memory=tracemalloc.get_traced_memory()[1])
+            _stop_tracemalloc()
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_owned = True
+        _tracemalloc_users += 1
+        tracemalloc.reset_peak()
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        # 只停止由本模块开启的tracemalloc
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+
+
+class TraceExporter:
+    """追加写入追踪记录的本地文件导出器(线程安全)"""
+
+    def __init__(self, path: str, fmt: str = "jsonl"):
+        """
+        Args:
+            path: 输出文件路径, 每条追踪一行
+            fmt: jsonl - 本项目的追踪结构; otlp - OpenTelemetry OTLP JSON
+        """
+        if fmt not in TRACE_FORMATS:
+            raise ValueError(f"未知的追踪格式: {fmt}, 可选: {', '.join(TRACE_FORMATS)}")
+        self.path = path
+        self.fmt = fmt
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        payload = trace.to_otlp() if self.fmt == "otlp" else trace.to_dict()
+        line = json.dumps(payload, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
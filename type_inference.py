@@ -0,0 +1,172 @@
+"""
+列类型推断与向量化清洗
+在整列范围内均匀采样判断格式(货币、百分比、千分位数字、日期)，
+每列只做一次正则替换 + 一次类型转换，并返回逐列的清洗报告
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# 推断时每列最多采样的值个数
+DEFAULT_SAMPLE_SIZE = 1000
+
+# 采样值中至少有该比例符合某种格式时才进行转换
+MATCH_THRESHOLD = 0.95
+
+# 行数超过该值时按列并行清洗
+PARALLEL_MIN_ROWS = 100_000
+
+CURRENCY_SYMBOLS = "$¥€£"
+
+_NUMBER_LIKE = rf'[-+]?[{CURRENCY_SYMBOLS}]?\s*[-+]?(?:\d[\d,]*)?\.?\d+\s*%?'
+_DATE_LIKE = (
+    r'\d{4}[-/.]\d{1,2}[-/.]\d{1,2}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?'
+    r'|\d{1,2}[-/.]\d{1,2}[-/.]\d{4}(?: \d{1,2}:\d{2}(?::\d{2})?)?'
+)
+# 数值列清洗时一次性移除的字符: 空白、货币符号、千分位逗号、百分号
+_STRIP_PATTERN = rf'[\s{CURRENCY_SYMBOLS},%]'
+
+KIND_LABELS = {
+    "currency": "货币",
+    "percent": "百分比",
+    "thousands": "千分位数字",
+    "numeric": "数字文本",
+    "date": "日期",
+}
+
+
+def _is_text_column(series: pd.Series) -> bool:
+    return series.dtype == 'object' or pd.api.types.is_string_dtype(series.dtype)
+
+
+def _sample(series: pd.Series, sample_size: int) -> pd.Series:
+    """在整列范围内均匀采样非空值，避免只看首行导致误判"""
+    values = series.dropna()
+    if len(values) > sample_size:
+        positions = np.linspace(0, len(values) - 1, sample_size).astype(int)
+        values = values.iloc[positions]
+    values = values.astype(str).str.strip()
+    return values[values != ""]
+
+
+def infer_column_kind(series: pd.Series, sample_size: int = DEFAULT_SAMPLE_SIZE) -> Optional[str]:
+    """
+    推断文本列的实际格式
+
+    Returns:
+        "currency" | "percent" | "thousands" | "numeric" | "date"，无需转换时返回None
+    """
+    if not _is_text_column(series):
+        return None
+
+    sample = _sample(series, sample_size)
+    if sample.empty:
+        return None
+
+    numeric_ratio = sample.str.fullmatch(_NUMBER_LIKE).mean()
+    if numeric_ratio >= MATCH_THRESHOLD:
+        if sample.str.contains(f"[{CURRENCY_SYMBOLS}]", regex=True).any():
+            return "currency"
+        if sample.str.endswith("%").mean() >= 0.5:
+            return "percent"
+        if sample.str.contains(",", regex=False).any():
+            return "thousands"
+        return "numeric"
+
+    if sample.str.fullmatch(_DATE_LIKE).mean() >= MATCH_THRESHOLD:
+        return "date"
+
+    return None
+
+
+def convert_column(series: pd.Series, kind: str) -> pd.Series:
+    """按推断出的格式转换整列(单次向量化正则替换)"""
+    if kind == "date":
+        # 统一日期分隔符, 使整列可按同一格式解析
+        normalized = series.astype(str).str.strip().str.replace(r'[/.]', '-', regex=True)
+        return pd.to_datetime(normalized, errors='coerce')
+
+    stripped = series.astype(str).str.replace(_STRIP_PATTERN, '', regex=True)
+    return pd.to_numeric(stripped, errors='coerce')
+
+
+def _clean_one(series: pd.Series, kind: Optional[str], sample_size: int) -> Tuple[Optional[str], Optional[pd.Series]]:
+    if kind is None:
+        kind = infer_column_kind(series, sample_size)
+    if kind is None or not _is_text_column(series):
+        return kind, None
+    return kind, convert_column(series, kind)
+
+
+def clean_dataframe(
+    df: pd.DataFrame,
+    rules: Optional[Dict[str, str]] = None,
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+    max_workers: Optional[int] = None,
+) -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
+    """
+    推断并清洗数据框中的格式化文本列(原地修改)
+
+    Args:
+        df: 待清洗的数据框
+        rules: 已有的清洗规则 {列名: 格式}; 为None时逐列推断，分块加载时后续块沿用首块规则
+        sample_size: 每列采样个数
+        max_workers: 并行线程数，默认按列数和CPU数自动决定
+
+    Returns:
+        (rules, report) - report 为逐列清洗报告:
+        {"column", "kind", "from_dtype", "to_dtype", "failed"}，failed 为转换失败被置为空值的个数
+    """
+    if rules is None:
+        columns = [col for col in df.columns if _is_text_column(df[col])]
+        known: Dict[Any, Optional[str]] = {}
+    else:
+        columns = [col for col in rules if col in df.columns]
+        known = dict(rules)
+
+    def task(col):
+        return _clean_one(df[col], known.get(col), sample_size)
+
+    if len(df) >= PARALLEL_MIN_ROWS and len(columns) > 1:
+        workers = max_workers or min(len(columns), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(task, columns))
+    else:
+        outcomes = [task(col) for col in columns]
+
+    new_rules: Dict[str, str] = {}
+    report: List[Dict[str, Any]] = []
+    for col, (kind, converted) in zip(columns, outcomes):
+        if kind is None:
+            continue
+        new_rules[col] = kind
+        if converted is None:
+            continue
+        original = df[col]
+        failed = int((converted.isna() & original.notna()).sum())
+        report.append({
+            "column": col,
+            "kind": kind,
+            "from_dtype": str(original.dtype),
+            "to_dtype": str(converted.dtype),
+            "failed": failed,
+        })
+        df[col] = converted
+
+    return new_rules, report
+
+
+def format_report(report: List[Dict[str, Any]]) -> str:
+    """将清洗报告格式化为简短文本"""
+    parts = []
+    for item in report:
+        text = f"{item['column']} ({KIND_LABELS.get(item['kind'], item['kind'])} → {item['to_dtype']})"
+        if item["failed"]:
+            text += f" [{item['failed']}个值无法解析, 已置为NaN]"
+        parts.append(text)
+    return ", ".join(parts)